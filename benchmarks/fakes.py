@@ -0,0 +1,286 @@
+"""
+In-process stand-ins for the MQTT plugin, OctoPrint's REST API, file
+storage and printer used by the benchmarks
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import re
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from octoprint_mqtt_controls import MQTTControlsPlugin
+
+CHUNK = os.urandom(64 * 1024)
+
+RANGE = re.compile(r'bytes=(\d+)-(\d*)')
+
+
+def merge(target, overrides):
+    """Recursively update nested dict `target` with `overrides`"""
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+def file_content(size):
+    """Deterministic content of a file served by `FakeOctoPrintServer`"""
+    repeats, rest = divmod(size, len(CHUNK))
+    return CHUNK * repeats + CHUNK[:rest]
+
+
+class FakeSettings(object):
+    """Plugin settings backed by a nested dict"""
+
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, path):
+        value = self.values
+        for key in path:
+            value = value[key]
+        return value
+
+    def get_int(self, path):
+        return int(self.get(path))
+
+    def get_float(self, path):
+        return float(self.get(path))
+
+    def get_boolean(self, path):
+        return bool(self.get(path))
+
+
+class FakeMQTT(object):
+    """
+    Broker delivering messages synchronously, like the MQTT client's
+    network thread does. Published messages are delivered back to
+    matching subscriptions, as a real broker echoes them.
+
+    Attributes:
+        published - number of published messages
+        published_bytes - total size of published JSON payloads
+        delivered - number of messages delivered to subscriptions
+        delivered_bytes - total size of delivered payloads
+    """
+
+    def __init__(self):
+        self.published = 0
+        self.published_bytes = 0
+        self.delivered = 0
+        self.delivered_bytes = 0
+
+        self._lock = threading.Lock()
+        self._subscriptions = []
+        self._listeners = []
+
+    def subscribe(self, topic, callback, *args, **kwargs):
+        self._subscriptions.append((topic, callback))
+
+    def publish(self, topic, payload, *args, **kwargs):
+        size = len(payload if isinstance(payload, str)
+                   else json.dumps(payload))
+        with self._lock:
+            self.published += 1
+            self.published_bytes += size
+        for listener in self._listeners:
+            listener(topic, payload)
+        self.deliver(
+            topic, payload if isinstance(payload, str) else json.dumps(payload))
+
+    def add_listener(self, listener):
+        """Call `listener` with topic and payload of published messages"""
+        self._listeners.append(listener)
+
+    def deliver(self, topic, payload):
+        """Pass message received from the broker to subscribed callbacks"""
+        for subscription, callback in self._subscriptions:
+            if (
+                subscription == topic
+                or subscription.endswith('#')
+                and topic.startswith(subscription[:-1])
+            ):
+                with self._lock:
+                    self.delivered += 1
+                    self.delivered_bytes += len(payload)
+                callback(topic, payload)
+
+
+class _FakeMQTTPlugin(object):
+    def __init__(self, base_topic):
+        self._settings = FakeSettings({'publish': {'baseTopic': base_topic}})
+
+
+class _PluginInfo(object):
+    def __init__(self, implementation):
+        self.implementation = implementation
+
+
+class FakePluginManager(object):
+    def __init__(self, mqtt, base_topic):
+        self._mqtt = mqtt
+        self._base_topic = base_topic
+
+    def get_plugin_info(self, identifier):
+        return _PluginInfo(_FakeMQTTPlugin(self._base_topic))
+
+    def get_helpers(self, identifier, *names):
+        return {
+            'mqttaws_subscribe': self._mqtt.subscribe,
+            'mqttaws_publish': self._mqtt.publish,
+        }
+
+
+class FakeFileManager(object):
+    """Local storage keeping files in a plain directory"""
+
+    def __init__(self, location):
+        self.location = location
+
+    def path_on_disk(self, destination, path):
+        return os.path.join(self.location, path)
+
+    def path_in_storage(self, destination, path):
+        return path
+
+    def add_file(self, destination, path, file_object, allow_overwrite=False):
+        file_object.save(self.path_on_disk(destination, path))
+        return path
+
+    def remove_file(self, destination, path):
+        os.remove(self.path_on_disk(destination, path))
+
+
+class FakePrinter(object):
+    """
+    Always ready printer which never prints anything. Like OctoPrint's
+    printer, it selects local files by their path on the disk.
+    """
+
+    def is_ready(self):
+        return True
+
+    def can_modify_file(self, path, sd):
+        return True
+
+    def select_file(self, path, sd, printAfterSelect=False):
+        if not sd and not os.path.isfile(path):
+            raise IOError('File does not exist: %r' % path)
+
+    def get_current_job(self):
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment, otherwise delayed ACKs add
+    # tens of milliseconds to each keep-alive request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_api(self):
+        body = json.dumps({
+            'path': self.path,
+            'data': 'x' * self.server.response_size,
+        })
+        self._send(200, [('Content-Type', 'application/json')], body)
+
+    def _send_file(self):
+        content = self.server.file_content
+        start, end = 0, len(content) - 1
+        headers = [
+            ('Content-Type', 'application/octet-stream'),
+            ('Accept-Ranges', 'bytes'),
+            ('ETag', '"%d"' % len(content)),
+        ]
+        status = 200
+        match = RANGE.match(self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else end
+            status = 206
+            headers.append((
+                'Content-Range',
+                'bytes %d-%d/%d' % (start, end, len(content))
+            ))
+        self._send(status, headers, content[start:end + 1])
+
+    def do_GET(self):
+        if self.path.startswith('/downloads/'):
+            self._send_file()
+        else:
+            self._send_api()
+
+    do_HEAD = do_GET
+    do_POST = do_GET
+
+
+class FakeOctoPrintServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server answering every `/api/...` request with a JSON body and
+    serving a file with range request support at `/downloads/<name>`
+
+    Attributes:
+        response_size - size of the `data` field of API responses
+        file_content - content of downloaded files
+    """
+    daemon_threads = True
+
+    def __init__(self, response_size=64, file_size=1024 * 1024):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.response_size = response_size
+        self.file_content = file_content(file_size)
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def file_url(self, name):
+        return 'http://127.0.0.1:%d/downloads/%s' % (self.port, name)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def create_plugin(mqtt, data_folder, uploads_location, base_topic,
+                  settings_overrides=None):
+    """Create the plugin and start it the way OctoPrint does"""
+    plugin = MQTTControlsPlugin()
+    settings = plugin.get_settings_defaults()
+    merge(settings, settings_overrides or {})
+
+    plugin._settings = FakeSettings(settings)
+    plugin._identifier = 'mqtt-controls'
+    plugin._plugin_name = 'mqtt-controls'
+    plugin._logger = logging.getLogger('benchmarks.plugin')
+    plugin._data_folder = data_folder
+    plugin._plugin_manager = FakePluginManager(mqtt, base_topic)
+    plugin._file_manager = FakeFileManager(uploads_location)
+    plugin._printer = FakePrinter()
+    plugin.on_after_startup()
+    return plugin
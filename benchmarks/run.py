@@ -0,0 +1,130 @@
+"""
+Run benchmark scenarios and save their results as JSON
+
+    python -m benchmarks.run --scenario polling_storm --output results.json
+"""
+from __future__ import absolute_import
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+from octoprint.settings import settings
+
+from .fakes import FakeOctoPrintServer, merge
+from .scenarios import SCENARIOS, run_scenario
+
+
+def _setting(option):
+    """Parse `path.to.setting=<JSON value>` into a nested dict"""
+    path, _, value = option.partition('=')
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    result = value
+    for key in reversed(path.split('.')):
+        result = {key: result}
+    return result
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--scenario', action='append', choices=sorted(SCENARIOS),
+        help='scenario to run, may be repeated (default: all)')
+    parser.add_argument(
+        '--count', type=int, help='number of commands sent')
+    parser.add_argument(
+        '--rate', type=float,
+        help='commands sent per second, 0 sends them at once')
+    parser.add_argument(
+        '--response-size', type=int, help='size of API responses in bytes')
+    parser.add_argument(
+        '--file-size', type=int, help='size of downloaded files in bytes')
+    parser.add_argument(
+        '--set', action='append', default=[], type=_setting,
+        metavar='PATH=VALUE',
+        help='override plugin setting, e.g. executor.pool_size=8')
+    parser.add_argument(
+        '--timeout', type=float, default=300,
+        help='seconds to wait for a scenario to finish')
+    parser.add_argument(
+        '--output', help='file results are written to (default: stdout)')
+    return parser.parse_args(args)
+
+
+def _scenario(name, args):
+    scenario = SCENARIOS[name]
+    overrides = dict(
+        (field, getattr(args, field))
+        for field in ('count', 'rate', 'response_size', 'file_size')
+        if getattr(args, field) is not None
+    )
+    settings_overrides = json.loads(json.dumps(scenario.settings))
+    for setting in args.set:
+        merge(settings_overrides, setting)
+    return scenario._replace(settings=settings_overrides, **overrides)
+
+
+def _run_isolated(name, args):
+    """Run the scenario with its own fake servers, settings and storage"""
+    logging.basicConfig(level=logging.WARNING)
+
+    basedir = tempfile.mkdtemp(prefix='mqtt-controls-benchmark-')
+    uploads_location = os.path.join(basedir, 'uploads')
+    os.makedirs(uploads_location)
+
+    server = FakeOctoPrintServer()
+    server.start()
+
+    octoprint_settings = settings(init=True, basedir=basedir)
+    octoprint_settings.set(['server', 'host'], '127.0.0.1')
+    octoprint_settings.setInt(['server', 'port'], server.port)
+    octoprint_settings.set(['folder', 'uploads'], uploads_location)
+
+    try:
+        return run_scenario(
+            _scenario(name, args), server, tempfile.mkdtemp(dir=basedir),
+            uploads_location, timeout=args.timeout
+        )
+    finally:
+        server.stop()
+        shutil.rmtree(basedir, ignore_errors=True)
+
+
+def main(args=None):
+    args = parse_args(args)
+
+    results = []
+    for name in args.scenario or sorted(SCENARIOS):
+        # Peak memory is measured per process, so each scenario gets one
+        pool = Pool(1)
+        try:
+            results.append(pool.apply(_run_isolated, (name, args)))
+        finally:
+            pool.close()
+            pool.join()
+
+    output = json.dumps({
+        'timestamp': time.time(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
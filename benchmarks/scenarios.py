@@ -0,0 +1,216 @@
+"""Benchmark scenarios driving the plugin's commands over the fake broker"""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import resource
+import time
+from collections import namedtuple
+from threading import Event, Lock
+
+from octoprint_mqtt_controls.commands.download_file.progress import Progress
+from octoprint_mqtt_controls.util.metrics import Histogram
+
+from .fakes import FakeMQTT, create_plugin, file_content
+
+API_SUBTOPIC = 'mqtt-rest-api/'
+API_REPORT_SUBTOPIC = 'control-response/'
+DOWNLOAD_SUBTOPIC = 'download-file/command'
+DOWNLOAD_REPORT_SUBTOPIC = 'download-file/report'
+
+COMMAND_API = 'api'
+COMMAND_DOWNLOAD = 'download'
+
+FINAL_PROGRESS = (
+    Progress.success.value, Progress.error.value, Progress.stopped.value
+)
+
+Scenario = namedtuple('Scenario', (
+    'name', 'description', 'command', 'count', 'rate', 'response_size',
+    'file_size', 'settings'
+))
+
+SCENARIOS = dict((scenario.name, scenario) for scenario in (
+    Scenario(
+        name='polling_storm',
+        command=COMMAND_API,
+        description='many small GET /api/printer requests',
+        count=2000,
+        rate=0,
+        response_size=256,
+        file_size=0,
+        settings={'executor': {'queue_depth': 4096}},
+    ),
+    Scenario(
+        name='large_responses',
+        command=COMMAND_API,
+        description='GET /api/files requests with 1 MiB responses',
+        count=100,
+        rate=0,
+        response_size=1024 * 1024,
+        file_size=0,
+        settings={'executor': {'queue_depth': 256}},
+    ),
+    Scenario(
+        name='parallel_downloads',
+        command=COMMAND_DOWNLOAD,
+        description='8 downloads of a 32 MiB file at once',
+        count=8,
+        rate=0,
+        response_size=0,
+        file_size=32 * 1024 * 1024,
+        settings={'download': {
+            'max_concurrent': 8,
+            'cache': {'enabled': False},
+        }},
+    ),
+))
+
+
+class Tracker(object):
+    """
+    Measure time between delivering a command and publishing its final
+    report
+    """
+
+    def __init__(self, report_topic, count, is_final):
+        self.latencies = Histogram(reservoir_size=count)
+        self.completed = 0
+        self.errors = 0
+
+        self._report_topic = report_topic
+        self._count = count
+        self._is_final = is_final
+        self._sent = dict()
+        self._lock = Lock()
+        self._done = Event()
+
+    def sent(self, uid):
+        with self._lock:
+            self._sent[uid] = time.time()
+
+    def on_publish(self, topic, payload):
+        if topic != self._report_topic or not self._is_final(payload):
+            return
+        with self._lock:
+            sent_at = self._sent.pop(payload.get('uid'), None)
+            if sent_at is None:
+                return
+            self.latencies.observe(time.time() - sent_at)
+            self.completed += 1
+            if payload.get('progress') == Progress.error.value:
+                self.errors += 1
+            if self.completed == self._count:
+                self._done.set()
+
+    def wait(self, timeout):
+        return self._done.wait(timeout)
+
+
+def _is_api_response(payload):
+    return True
+
+
+def _is_download_finished(payload):
+    return payload.get('progress') in FINAL_PROGRESS
+
+
+def _api_command(uid, scenario, server):
+    endpoint = (
+        '/api/files' if scenario.response_size > 64 * 1024 else '/api/printer'
+    )
+    return API_SUBTOPIC, {
+        'uid': uid,
+        'timestamp': time.time(),
+        'endpoint': endpoint,
+        'method': 'GET',
+    }
+
+
+def _download_command(uid, scenario, server):
+    return DOWNLOAD_SUBTOPIC, {
+        'uid': uid,
+        'timestamp': time.time(),
+        'url': server.file_url('model-%s.gcode' % uid),
+        'filename': 'model-%s.gcode' % uid,
+        'md5': hashlib.md5(server.file_content).hexdigest(),
+    }
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _milliseconds(summary):
+    return dict(
+        (name, value * 1000 if value is not None and name != 'count'
+         else value)
+        for name, value in summary.items()
+    )
+
+
+def run_scenario(scenario, server, data_folder, uploads_location,
+                 base_topic='octoprint/', timeout=300):
+    """Run the scenario and return its results as a JSON-serializable dict"""
+    server.response_size = scenario.response_size
+    server.file_content = file_content(scenario.file_size)
+
+    mqtt = FakeMQTT()
+    plugin = create_plugin(
+        mqtt, data_folder, uploads_location, base_topic, scenario.settings)
+    downloads = scenario.command == COMMAND_DOWNLOAD
+    if downloads:
+        make_command = _download_command
+        tracker = Tracker(
+            base_topic + DOWNLOAD_REPORT_SUBTOPIC,
+            scenario.count,
+            _is_download_finished
+        )
+    else:
+        make_command = _api_command
+        tracker = Tracker(
+            base_topic + API_REPORT_SUBTOPIC,
+            scenario.count,
+            _is_api_response
+        )
+    mqtt.add_listener(tracker.on_publish)
+
+    cpu_started = _cpu_time()
+    started_at = time.time()
+    try:
+        for number in range(scenario.count):
+            if scenario.rate:
+                delay = started_at + number / float(scenario.rate)
+                time.sleep(max(0, delay - time.time()))
+            uid = '%s-%d' % (scenario.name, number)
+            subtopic, payload = make_command(uid, scenario, server)
+            tracker.sent(uid)
+            mqtt.deliver(base_topic + subtopic, json.dumps(payload))
+        finished = tracker.wait(timeout)
+        duration = time.time() - started_at
+    finally:
+        plugin.on_shutdown()
+
+    results = {
+        'scenario': scenario.name,
+        'description': scenario.description,
+        'parameters': scenario._asdict(),
+        'finished': finished,
+        'commands': scenario.count,
+        'completed': tracker.completed,
+        'errors': tracker.errors,
+        'duration': duration,
+        'commands_per_sec': tracker.completed / duration,
+        'latency_ms': _milliseconds(tracker.latencies.summary()),
+        'cpu_seconds': _cpu_time() - cpu_started,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'published': mqtt.published,
+        'published_bytes': mqtt.published_bytes,
+        'delivered': mqtt.delivered,
+        'delivered_bytes': mqtt.delivered_bytes,
+    }
+    if downloads:
+        received = (tracker.completed - tracker.errors) * scenario.file_size
+        results['download_mb_per_sec'] = received / duration / 1024 / 1024
+    return results
@@ -3,18 +3,32 @@ from __future__ import absolute_import
 
 import os
 
-from octoprint.plugin import SettingsPlugin, StartupPlugin
+from octoprint.plugin import (
+    EventHandlerPlugin, SettingsPlugin, ShutdownPlugin, StartupPlugin
+)
 from octoprint.plugin.core import PluginCantInitialize
 from octoprint.settings import settings as get_octoprint_settings
 
 from .commands import COMMANDS
-from .util import cached_property, urlencode_safe
+from .commands.admission import AdmissionController
+from .commands.executor import CommandExecutor
+from .commands.idempotency import IdempotencyStore
+from .commands.publisher import PublishQueue
+from .commands.router import CommandRouter
+from .util import invalidate_on_event, memoized_stats, urlencode_safe
+from .util.engine import AsyncEngine
+from .util.http import PooledSession
+from .util.metrics import MetricsPublisher, MetricsRegistry
 from .settings import uploads_location
 
-DEFAULT_UPLOAD_DIR = '~/.octoprint/uploads'
+SUBSCRIPTION_WILDCARD = 'wildcard'
+SUBSCRIPTION_PER_COMMAND = 'per_command'
 
+ENGINE_TORNADO = 'tornado'
 
-class MQTTControlsPlugin(SettingsPlugin, StartupPlugin):
+
+class MQTTControlsPlugin(SettingsPlugin, StartupPlugin, ShutdownPlugin,
+                         EventHandlerPlugin):
     """
     Implementation of plugin. Connects mqtt to OctoPrint's REST API
 
@@ -27,26 +41,266 @@ class MQTTControlsPlugin(SettingsPlugin, StartupPlugin):
         controls_topic  MQTT topic used to retrieve control messages from
 
         response_topic  MQTT topic used to send responses to
+
+        command_executor    pool of workers executing received commands
+
+        commands        instances of subscribed commands
+
+        idempotency_store   recently received commands, None if duplicates
+                            are not dropped
+
+        admission_controller    limits of commands in flight and of client
+                                rates, None if commands are not limited
+
+        http_session    connection pools shared by downloads
+
+        engine          event loop performing HTTP requests of commands
+                        and downloads, None if they run in threads
+
+        publish_queue   queue of reports published by a background thread,
+                        None if reports are published synchronously
+
+        metrics         counters, gauges and histograms of the plugin's
+                        activity
+
+        metrics_publisher   periodically publishes `metrics`, None if they
+                            are not published
     """
     def __init__(self):
         super(MQTTControlsPlugin, self).__init__()
         self.octoprint_settings = get_octoprint_settings()
+        self.command_executor = None
+        self.commands = []
+        self.idempotency_store = None
+        self.admission_controller = None
+        self.publish_queue = None
+        self.engine = None
+        self.http_session = None
+        self.metrics = MetricsRegistry(enabled=False)
+        self.metrics_publisher = None
+
+    def get_settings_defaults(self):
+        return dict(
+            subscription=SUBSCRIPTION_PER_COMMAND,
+            executor=dict(
+                pool_size=4,
+                queue_depth=32,
+            ),
+            http=dict(
+                pool_connections=10,
+                pool_maxsize=10,
+                connect_timeout=10,
+                read_timeout=60,
+            ),
+            engine=dict(
+                type='threads',
+                max_clients=64,
+                file_workers=2,
+                write_buffer=16 * 1024 * 1024,
+            ),
+            api=dict(
+                dispatch='http',
+                batch_concurrency=4,
+                batch_max_size=32,
+                stream_chunk_size=64 * 1024,
+                cache=dict(
+                    enabled=False,
+                    max_size=128,
+                    ttl={
+                        '/api/printer': 1,
+                        '/api/job': 1,
+                        '/api/connection': 5,
+                        '/api/files': 10,
+                    },
+                ),
+            ),
+            idempotency=dict(
+                enabled=False,
+                max_size=1024,
+                ttl=600,
+                persist=False,
+            ),
+            download=dict(
+                max_concurrent=2,
+                queue='priority',
+                buffer_size=256 * 1024,
+                segments=1,
+                segment_min_size=32 * 1024 * 1024,
+                progress_interval=1.0,
+                progress_step=1,
+                sync_size=16 * 1024 * 1024,
+                cache=dict(
+                    enabled=True,
+                    max_size=0,
+                ),
+                stream_print=dict(
+                    buffer_ahead=8 * 1024 * 1024,
+                    min_lead=1024 * 1024,
+                    poll_interval=0.5,
+                ),
+                partial=dict(
+                    max_age=7 * 24 * 60 * 60,
+                    max_size=0,
+                ),
+            ),
+            publisher=dict(
+                enabled=True,
+                max_bytes=4 * 1024 * 1024,
+            ),
+            admission=dict(
+                enabled=False,
+                max_in_flight=0,
+                command_limits={},
+                client_rate=0,
+                client_burst=10,
+                max_clients=1024,
+                retry_after=1,
+            ),
+            metrics=dict(
+                enabled=False,
+                interval=60,
+                subtopic='metrics',
+            ),
+        )
+
+    def _create_metrics(self):
+        if not self._settings.get_boolean(['metrics', 'enabled']):
+            return
+
+        self.metrics = MetricsRegistry()
+        self._register_memoized_gauges()
+        interval = self._settings.get_float(['metrics', 'interval'])
+        if interval > 0:
+            topic = self.base_topic + self._settings.get(
+                ['metrics', 'subtopic'])
+            self.metrics_publisher = MetricsPublisher(
+                self.metrics,
+                interval,
+                lambda snapshot: self.mqtt_publish(topic, snapshot)
+            )
+            self.metrics_publisher.start()
+
+    def _register_memoized_gauges(self):
+        """Measure hits and misses of caches of memoized functions"""
+        for name in memoized_stats():
+            for counter in ('hits', 'misses'):
+                self.metrics.gauge(
+                    'memoize.{name}.{counter}'.format(
+                        name=name, counter=counter),
+                    lambda name=name, counter=counter:
+                        memoized_stats()[name][counter]
+                )
 
-    @cached_property
-    def uploads_location(self):
-        return os.path.expanduser(
-            self.octoprint_settings.get(['folder', 'uploads'])
-            or DEFAULT_UPLOAD_DIR
+    def _create_http_session(self):
+        self.http_session = PooledSession(
+            self._settings.get_int(['http', 'pool_connections']),
+            self._settings.get_int(['http', 'pool_maxsize']),
+            (
+                self._settings.get_float(['http', 'connect_timeout']),
+                self._settings.get_float(['http', 'read_timeout'])
+            )
+        )
+
+    def _create_engine(self):
+        if self._settings.get(['engine', 'type']) != ENGINE_TORNADO:
+            return
+
+        self.engine = AsyncEngine(
+            self._settings.get_int(['engine', 'max_clients']),
+            self._logger,
+            self._settings.get_int(['engine', 'file_workers']),
+            self._settings.get_int(['engine', 'write_buffer'])
+        )
+
+    def _create_publish_queue(self):
+        if not self._settings.get_boolean(['publisher', 'enabled']):
+            return
+
+        self.publish_queue = PublishQueue(
+            self.mqtt_publish,
+            self._settings.get_int(['publisher', 'max_bytes']),
+            self._logger,
+            self.metrics
+        )
+
+    def _create_command_executor(self):
+        self.command_executor = CommandExecutor(
+            self._settings.get_int(['executor', 'pool_size']),
+            self._settings.get_int(['executor', 'queue_depth']),
+            self._logger,
+            self.metrics
+        )
+
+    def _create_idempotency_store(self):
+        if not self._settings.get_boolean(['idempotency', 'enabled']):
+            return
+
+        path = None
+        if self._settings.get_boolean(['idempotency', 'persist']):
+            path = os.path.join(
+                self.get_plugin_data_folder(), 'seen_commands.json')
+
+        self.idempotency_store = IdempotencyStore(
+            self._settings.get_int(['idempotency', 'max_size']),
+            self._settings.get_int(['idempotency', 'ttl']),
+            path
+        )
+        try:
+            self.idempotency_store.load()
+        except (IOError, ValueError):
+            self._logger.exception('Could not load seen commands')
+
+    def _create_admission_controller(self):
+        if not self._settings.get_boolean(['admission', 'enabled']):
+            return
+
+        self.admission_controller = AdmissionController(
+            max_in_flight=self._settings.get_int(
+                ['admission', 'max_in_flight']),
+            command_limits=self._settings.get(
+                ['admission', 'command_limits']),
+            client_rate=self._settings.get_float(
+                ['admission', 'client_rate']),
+            client_burst=self._settings.get_int(
+                ['admission', 'client_burst']),
+            max_clients=self._settings.get_int(
+                ['admission', 'max_clients']),
+            retry_after=self._settings.get_float(
+                ['admission', 'retry_after'])
+        )
+        self.metrics.gauge(
+            'admission.in_flight',
+            lambda: self.admission_controller.stats()['in_flight']
         )
 
     def _subscribe_commands(self, mqtt_subscribe):
-        for command_class in COMMANDS:
-            command = command_class(self)
+        self.commands = [command_class(self) for command_class in COMMANDS]
+
+        wildcard = (
+            self._settings.get(['subscription']) == SUBSCRIPTION_WILDCARD
+            and self.base_topic.endswith('/')
+        )
+        if wildcard:
+            router = CommandRouter(self.base_topic, self.commands)
+            mqtt_subscribe(router.topic, router)
+            self._logger.debug(
+                'Subscribed commands {command_names!r} to topic {topic!r}'
+                .format(
+                    command_names=[
+                        command.__class__.__name__
+                        for command in self.commands
+                    ],
+                    topic=router.topic
+                )
+            )
+            return
+
+        for command in self.commands:
             mqtt_subscribe(command.topic, command)
             self._logger.debug(
                 'Subscribed command {command_name!r} to topic {topic!r}'
                 .format(
-                    command_name=command_class.__name__,
+                    command_name=command.__class__.__name__,
                     topic=command.topic
                 )
             )
@@ -94,8 +348,36 @@ class MQTTControlsPlugin(SettingsPlugin, StartupPlugin):
                 "Cannot get 'mqttaws_subscribe' helper method "
                 "from OctoPrint-MQTT plugin"
             )
+        self._create_metrics()
+        self._create_publish_queue()
+        self._create_command_executor()
+        self._create_engine()
+        self._create_http_session()
+        self._create_idempotency_store()
+        self._create_admission_controller()
         self._subscribe_commands(mqtt_subscribe)
 
+    def on_event(self, event, payload):
+        invalidate_on_event(event)
+        for command in self.commands:
+            command.on_event(event, payload)
+
+    def on_shutdown(self):
+        if self.metrics_publisher is not None:
+            self.metrics_publisher.stop()
+        if self.command_executor is not None:
+            self.command_executor.shutdown(timeout=5)
+        for command in self.commands:
+            command.on_shutdown()
+        if self.engine is not None:
+            self.engine.stop(timeout=5)
+        if self.publish_queue is not None:
+            self.publish_queue.stop(timeout=5)
+        if self.http_session is not None:
+            self.http_session.close()
+        if self.idempotency_store is not None:
+            self.idempotency_store.save()
+
 
 __plugin_name__ = 'MQTT Controls'
 
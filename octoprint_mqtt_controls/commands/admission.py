@@ -0,0 +1,119 @@
+from __future__ import absolute_import
+
+import time
+from collections import defaultdict
+from threading import Lock
+
+from ..util import LRUCache
+from .exceptions import CommandRejected
+
+REASON_IN_FLIGHT = 'in_flight'
+REASON_COMMAND = 'command'
+REASON_CLIENT_RATE = 'client_rate'
+
+
+class _TokenBucket(object):
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = now
+
+    def take(self, now):
+        """Take a token, return seconds until one is available if empty"""
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        return None
+
+
+class AdmissionController(object):
+    """
+    Decides whether a received command may run, before any work is done
+    for it. Limits number of commands in flight, overall and per command,
+    and rate of commands sent by each client.
+
+    Attributes:
+        max_in_flight - maximum number of commands admitted and not yet
+                        finished, 0 for no limit
+        command_limits - maximum number of commands in flight by command
+                         subtopic
+        client_rate - number of commands per second allowed for each
+                      client, 0 for no limit
+        client_burst - number of commands a client may send at once
+        retry_after - seconds clients are asked to wait when a concurrency
+                      limit is reached
+    """
+
+    def __init__(self, max_in_flight=0, command_limits=None, client_rate=0,
+                 client_burst=1, max_clients=1024, retry_after=1,
+                 clock=time.time):
+        """
+        Create an AdmissionController
+
+        :param max_in_flight: maximum number of commands in flight
+        :param command_limits: maximum number of commands in flight
+                               by command subtopic
+        :param client_rate: commands per second allowed for each client
+        :param client_burst: size of each client's token bucket
+        :param max_clients: maximum number of tracked clients, the least
+                            recently seen ones are forgotten first
+        :param retry_after: seconds to wait after hitting concurrency limit
+        """
+        self.max_in_flight = max_in_flight
+        self.command_limits = command_limits or {}
+        self.client_rate = client_rate
+        self.client_burst = max(1, client_burst)
+        self.retry_after = retry_after
+
+        self._clock = clock
+        self._lock = Lock()
+        self._in_flight = 0
+        self._commands_in_flight = defaultdict(int)
+        self._buckets = LRUCache(max_clients, clock=clock)
+
+    def _take_client_token(self, client_id):
+        now = self._clock()
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            bucket = _TokenBucket(self.client_rate, self.client_burst, now)
+            self._buckets.set(client_id, bucket)
+        return bucket.take(now)
+
+    def admit(self, command, client_id=None):
+        """
+        Count the command as in flight, `release` has to be called once it
+        finishes.
+        Raise `CommandRejected` if any limit would be exceeded.
+        """
+        with self._lock:
+            if self.max_in_flight and self._in_flight >= self.max_in_flight:
+                raise CommandRejected(REASON_IN_FLIGHT, self.retry_after)
+
+            limit = self.command_limits.get(command)
+            if limit and self._commands_in_flight[command] >= limit:
+                raise CommandRejected(REASON_COMMAND, self.retry_after)
+
+            if self.client_rate:
+                wait = self._take_client_token(client_id)
+                if wait is not None:
+                    raise CommandRejected(REASON_CLIENT_RATE, wait)
+
+            self._in_flight += 1
+            self._commands_in_flight[command] += 1
+
+    def release(self, command):
+        """Mark previously admitted command as finished"""
+        with self._lock:
+            self._in_flight -= 1
+            self._commands_in_flight[command] -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'commands': dict(self._commands_in_flight),
+            }
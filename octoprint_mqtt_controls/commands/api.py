@@ -1,13 +1,49 @@
 from __future__ import absolute_import
 
-import requests
+import hashlib
+import json
+import time
+from base64 import b64encode
+from collections import namedtuple
+from functools import partial
+from multiprocessing.pool import ThreadPool
+
 from octoprint.settings import settings
+from tornado import gen
+from tornado.httpclient import HTTPRequest
 
 from .base import CommandBase
-from ..util.api import get_endpoint_url
+from .response_cache import CACHEABLE_METHODS, ResponseCache
+from ..util import memoize
+from ..util.api import api_url_base, get_endpoint_url
+from ..util.encoding import encode_message, filter_headers, project
+from ..util.http import PooledSession
+from ..util.wsgi import FLASK_PREFIXES, WSGIAdapter, get_octoprint_app
 
 RESPONSE_SUBTOPIC = 'control-response/'
 
+DISPATCH_WSGI = 'wsgi'
+
+BATCH_SEQUENTIAL = 'sequential'
+BATCH_PARALLEL = 'parallel'
+
+STREAM_HEADER = 'header'
+STREAM_CHUNK = 'chunk'
+STREAM_END = 'end'
+STREAM_ERROR = 'error'
+
+APIResponse = namedtuple('APIResponse', ('status_code', 'headers', 'body'))
+
+
+@memoize(max_size=256)
+def endpoint_group(endpoint):
+    """
+    Return first two segments of endpoint's path, e.g. `api/files` for
+    `/api/files/local/model.gcode?recursive=true`
+    """
+    path = endpoint.split('?', 1)[0].strip('/')
+    return '/'.join(path.split('/')[:2])
+
 
 class APIRequestCommand(CommandBase):
     subtopic = 'mqtt-rest-api/'
@@ -19,37 +55,109 @@ class APIRequestCommand(CommandBase):
         self.api_session = self._create_api_session(
             octoprint_settings.get(['api', 'key'])
         )
+        self.response_cache = self._create_response_cache()
+        self._batch_pool = ThreadPool(
+            self._settings.get_int(['api', 'batch_concurrency']))
+
+    def _create_response_cache(self):
+        if not self._settings.get_boolean(['api', 'cache', 'enabled']):
+            return None
+        response_cache = ResponseCache(
+            self._settings.get_int(['api', 'cache', 'max_size']),
+            self._settings.get(['api', 'cache', 'ttl'])
+        )
+        self.metrics.gauge(
+            'api.cache.hits', lambda: response_cache.stats()['hits'])
+        self.metrics.gauge(
+            'api.cache.misses', lambda: response_cache.stats()['misses'])
+        return response_cache
 
     def _create_api_session(self, api_key=None):
-        s = requests.Session()
+        s = PooledSession(
+            pool_connections=self._settings.get_int(
+                ['http', 'pool_connections']),
+            pool_maxsize=self._settings.get_int(['http', 'pool_maxsize']),
+            timeout=(
+                self._settings.get_float(['http', 'connect_timeout']),
+                self._settings.get_float(['http', 'read_timeout'])
+            )
+        )
         headers = {'Content-Type': 'application/json'}
         if api_key:
             headers['X-Api-Key'] = api_key
         s.headers.update(headers)
+
+        if self._settings.get(['api', 'dispatch']) == DISPATCH_WSGI:
+            app = get_octoprint_app()
+            if app is None:
+                self._logger.warning(
+                    'OctoPrint application is not available, '
+                    'API requests will be sent over HTTP'
+                )
+                return s
+            adapter = WSGIAdapter(app)
+            for prefix in FLASK_PREFIXES:
+                s.mount(api_url_base() + prefix, adapter)
         return s
 
-    def execute(self, topic, payload, *args, **kwargs):
-        uid = payload['uid']
-        timestamp = payload['timestamp']
-        method = payload.get('method', 'GET').upper()
-        data = payload.get('data')
+    def on_event(self, event, payload):
+        if self.response_cache is not None:
+            self.response_cache.on_event(event)
 
-        endpoint = payload.get('endpoint')
-        if not endpoint:
-            self._logger.error(
-                'Invalid command format: {payload}'.format(payload=payload)
-            )
-            return
+    def on_shutdown(self):
+        self._batch_pool.close()
+        self._batch_pool.join()
 
+    def _request(self, method, endpoint, data):
+        started_at = time.time()
         response = self.api_session.request(
             method,
             get_endpoint_url(endpoint),
             json=data
         )
+        self.metrics.histogram(
+            'api.latency.' + endpoint_group(endpoint)
+        ).observe(time.time() - started_at)
         response_payload = response.text
         if response.headers['content-type'] == 'application/json':
             response_payload = response.json()
 
+        return self._api_response(
+            method, endpoint, data, response.status_code,
+            dict(response.headers), response_payload
+        )
+
+    @gen.coroutine
+    def _request_async(self, method, endpoint, data):
+        """Perform the request with the engine's non-blocking client"""
+        started_at = time.time()
+        response = yield self.plugin_instance.engine.http_client.fetch(
+            HTTPRequest(
+                get_endpoint_url(endpoint),
+                method=method,
+                headers=dict(self.api_session.headers),
+                body=json.dumps(data) if data is not None else None,
+                allow_nonstandard_methods=True
+            ),
+            raise_error=False
+        )
+        self.metrics.histogram(
+            'api.latency.' + endpoint_group(endpoint)
+        ).observe(time.time() - started_at)
+        if response.code == 599:
+            raise response.error
+
+        headers = dict(response.headers)
+        response_payload = response.body.decode('utf-8')
+        if headers.get('Content-Type') == 'application/json':
+            response_payload = json.loads(response_payload)
+
+        raise gen.Return(self._api_response(
+            method, endpoint, data, response.code, headers, response_payload
+        ))
+
+    def _api_response(self, method, endpoint, data, status_code, headers,
+                      response_payload):
         self._logger.debug(
             'API request: HTTP {method} {endpoint} with data {data!r} - '
             '{code} headers: {response_headers!r}; body: {response_payload!r}'
@@ -57,20 +165,248 @@ class APIRequestCommand(CommandBase):
                 method=method,
                 endpoint=endpoint,
                 data=data,
-                code=response.status_code,
-                response_headers=response.headers,
+                code=status_code,
+                response_headers=headers,
                 response_payload=response_payload
             )
         )
+        return APIResponse(status_code, headers, response_payload)
+
+    def _fetch(self, method, endpoint, data):
+        if self.response_cache is not None:
+            return self.response_cache.fetch(
+                method,
+                endpoint,
+                data,
+                lambda: self._request(method, endpoint, data)
+            )
+        return self._request(method, endpoint, data)
+
+    @staticmethod
+    def _option(name, request, defaults):
+        return request.get(name, defaults.get(name))
+
+    def _response_message(self, request, defaults=None):
+        """
+        Perform single request and describe its response, reduced to
+        the requested headers and body fields
+        """
+        response = self._fetch(
+            request.get('method', 'GET').upper(),
+            request['endpoint'],
+            request.get('data')
+        )
+        return self._describe_response(request, response, defaults)
+
+    def _describe_response(self, request, response, defaults=None):
+        defaults = defaults or {}
+        method = request.get('method', 'GET').upper()
+        endpoint = request['endpoint']
+        data = request.get('data')
 
         message = {
-            'timestamp': timestamp,
-            'uid': uid,
             'endpoint': endpoint,
             'method': method,
             'request_data': data,
             'status_code': response.status_code,
-            'headers': dict(response.headers),
-            'body': response_payload,
+            'body': project(
+                response.body, self._option('fields', request, defaults)),
+        }
+
+        self._add_headers(
+            message, response.headers,
+            self._option('headers', request, defaults)
+        )
+        return message
+
+    @staticmethod
+    def _add_headers(message, headers, requested):
+        """Add all, requested or no response headers to the message"""
+        if requested is None or requested is True:
+            message['headers'] = headers
+        elif requested:
+            message['headers'] = filter_headers(headers, requested)
+
+    def _batch_item_message(self, request, defaults):
+        if not isinstance(request, dict) or not request.get('endpoint'):
+            return {'request': request, 'error': 'Invalid request format'}
+        try:
+            return self._response_message(request, defaults)
+        except Exception as e:
+            self._logger.exception('Batched API request failed')
+            return {'request': request, 'error': str(e)}
+
+    def _report_encoded(self, message, encoding):
+        encoded, used_encoding = encode_message(message, encoding)
+        if encoding and used_encoding != encoding:
+            self._logger.warning(
+                'Cannot encode response as {encoding!r}, sending {used!r}'
+                .format(encoding=encoding, used=used_encoding)
+            )
+        self.report(encoded)
+
+    def _execute_stream(self, uid, timestamp, payload):
+        """
+        Publish the response body in numbered chunks as it is read, between
+        a header with the status and headers and a trailer with total size
+        and MD5 checksum of the body
+        """
+        method = payload.get('method', 'GET').upper()
+        endpoint = payload['endpoint']
+        chunk_size = self._settings.get_int(['api', 'stream_chunk_size'])
+
+        def message(stream, **fields):
+            fields.update(uid=uid, timestamp=timestamp, stream=stream)
+            return fields
+
+        started_at = time.time()
+        response = self.api_session.request(
+            method,
+            get_endpoint_url(endpoint),
+            json=payload.get('data'),
+            stream=True
+        )
+        self.metrics.histogram(
+            'api.latency.' + endpoint_group(endpoint)
+        ).observe(time.time() - started_at)
+
+        try:
+            content_length = response.headers.get('Content-Length')
+            header = message(
+                STREAM_HEADER,
+                endpoint=endpoint,
+                method=method,
+                status_code=response.status_code,
+                content_length=int(content_length) if content_length else None,
+                chunk_size=chunk_size
+            )
+            self._add_headers(
+                header, dict(response.headers), payload.get('headers'))
+            self.report(header)
+
+            checksum = hashlib.md5()
+            total_size = 0
+            chunks = 0
+            for chunk in response.iter_content(chunk_size):
+                checksum.update(chunk)
+                total_size += len(chunk)
+                self._publish(
+                    message(STREAM_CHUNK, seq=chunks, data=b64encode(chunk)),
+                    block=True
+                )
+                chunks += 1
+        except Exception as e:
+            self._logger.exception(
+                'Streaming response of {endpoint} failed'.format(
+                    endpoint=endpoint))
+            self.report(message(STREAM_ERROR, reason=str(e)))
+            return
+        finally:
+            response.close()
+
+        self.report(message(
+            STREAM_END,
+            chunks=chunks,
+            total_size=total_size,
+            md5=checksum.hexdigest()
+        ))
+
+    def ordering_key(self, payload):
+        """
+        Requests of a client changing OctoPrint's state, e.g. start and
+        cancel of a job, are executed in the order they were received,
+        reading requests and requests of other clients in any order
+        """
+        requests = payload.get('requests')
+        if not isinstance(requests, list):
+            requests = [payload]
+        if any(
+            isinstance(request, dict)
+            and request.get('method', 'GET').upper() not in CACHEABLE_METHODS
+            for request in requests
+        ):
+            return u'{subtopic}client:{client_id}'.format(
+                subtopic=self.subtopic,
+                client_id=payload.get('client_id')
+            )
+        return super(APIRequestCommand, self).ordering_key(payload)
+
+    def supports_async(self, payload):
+        """
+        Single requests are performed by the async engine, unless they are
+        streamed, dispatched in-process or answered from the cache
+        """
+        method = payload.get('method', 'GET').upper()
+        return bool(
+            payload.get('endpoint')
+            and 'requests' not in payload
+            and not payload.get('stream')
+            and self._settings.get(['api', 'dispatch']) != DISPATCH_WSGI
+            and (
+                self.response_cache is None
+                or method not in CACHEABLE_METHODS
+            )
+        )
+
+    @gen.coroutine
+    def execute_async(self, topic, payload, *args, **kwargs):
+        response = yield self._request_async(
+            payload.get('method', 'GET').upper(),
+            payload['endpoint'],
+            payload.get('data')
+        )
+        message = {
+            'timestamp': payload['timestamp'],
+            'uid': payload['uid'],
+        }
+        message.update(self._describe_response(payload, response))
+        self._report_encoded(message, payload.get('encoding'))
+
+    def _execute_batch(self, uid, timestamp, batch, payload):
+        mode = payload.get('mode', BATCH_SEQUENTIAL)
+        item_message = partial(self._batch_item_message, defaults=payload)
+        if mode == BATCH_PARALLEL:
+            responses = self._batch_pool.map(item_message, batch)
+        else:
+            responses = [item_message(r) for r in batch]
+
+        self._report_encoded({
+            'timestamp': timestamp,
+            'uid': uid,
+            'mode': mode,
+            'responses': responses,
+        }, payload.get('encoding'))
+
+    def execute(self, topic, payload, *args, **kwargs):
+        uid = payload['uid']
+        timestamp = payload['timestamp']
+
+        batch = payload.get('requests')
+        if batch is not None:
+            max_size = self._settings.get_int(['api', 'batch_max_size'])
+            if not isinstance(batch, list) or len(batch) > max_size:
+                self._logger.error(
+                    'Invalid batch of requests, expected a list of at most '
+                    '{max_size} items: {payload}'
+                    .format(max_size=max_size, payload=payload)
+                )
+                return
+            self._execute_batch(uid, timestamp, batch, payload)
+            return
+
+        if not payload.get('endpoint'):
+            self._logger.error(
+                'Invalid command format: {payload}'.format(payload=payload)
+            )
+            return
+
+        if payload.get('stream'):
+            self._execute_stream(uid, timestamp, payload)
+            return
+
+        message = {
+            'timestamp': timestamp,
+            'uid': uid,
         }
-        self.report(message)
+        message.update(self._response_message(payload))
+        self._report_encoded(message, payload.get('encoding'))
@@ -1,12 +1,21 @@
 import json
+import time
 from abc import ABCMeta, abstractmethod, abstractproperty
 
+from tornado import gen
+
 from ..util import cached_property
+from .exceptions import CommandRejected, ExecutorBusy
+
+REASON_QUEUE_FULL = 'queue_full'
 
 
 class CommandBase(object):
     __metaclass__ = ABCMeta
 
+    # Whether responses may be reported after `execute` has returned
+    reports_later = False
+
     def __init__(self, plugin_instance):
         self.plugin_instance = plugin_instance
         self._logger = self.plugin_instance._logger
@@ -28,14 +37,225 @@ class CommandBase(object):
     def report_topic(self):
         return self.plugin_instance.base_topic + self.report_subtopic
 
-    def report(self, payload):
+    @property
+    def metrics(self):
+        return self.plugin_instance.metrics
+
+    def _metric_name(self, name):
+        return 'commands.{command_name}.{name}'.format(
+            command_name=self.__class__.__name__,
+            name=name
+        )
+
+    def coalesce_key(self, payload):
+        """
+        Key of a report which may be replaced by a newer report with
+        the same key before it is published, None for reports which must be
+        published
+        """
+        return None
+
+    def _publish(self, payload, block=False):
+        publish_queue = self.plugin_instance.publish_queue
+        if publish_queue is not None:
+            publish_queue.publish(
+                self.report_topic, payload, self.coalesce_key(payload), block)
+            return
+
+        if self.metrics.enabled:
+            self.metrics.counter('publish.count').inc()
+            self.metrics.counter('publish.bytes').inc(len(json.dumps(payload)))
         self.plugin_instance.mqtt_publish(self.report_topic, payload)
 
+    def report(self, payload, idempotency_key=None):
+        """
+        Publish the response and remember it for redelivered commands.
+        `idempotency_key` identifies the command the response belongs to
+        if it cannot be derived from the response.
+        """
+        idempotency_store = self.plugin_instance.idempotency_store
+        if idempotency_store is not None and 'uid' in payload:
+            idempotency_store.record(
+                idempotency_key or self.idempotency_key(payload), payload)
+        self._publish(payload)
+
+    def idempotency_key(self, payload):
+        """Key identifying the command, redelivered commands share it"""
+        return u'{subtopic}:{uid}'.format(
+            subtopic=self.subtopic,
+            uid=payload['uid']
+        )
+
+    def ordering_key(self, payload):
+        """
+        Key of commands executed in the order they were received,
+        by default commands with the same uid, e.g. start and stop
+        of a download
+        """
+        return u'{subtopic}:{uid}'.format(
+            subtopic=self.subtopic,
+            uid=payload['uid']
+        )
+
+    def _is_duplicate(self, payload):
+        """
+        Check whether the command has already been received.
+        Report the last response again for such commands.
+        """
+        idempotency_store = self.plugin_instance.idempotency_store
+        if idempotency_store is None:
+            return False
+
+        is_new, response = idempotency_store.claim(
+            self.idempotency_key(payload))
+        if is_new:
+            return False
+
+        self._logger.info(
+            'Dropped duplicate of command {command_name}#{uid}'.format(
+                command_name=self.__class__.__name__,
+                uid=payload['uid']
+            )
+        )
+        if response is not None:
+            self._publish(response)
+        return True
+
     @abstractmethod
     def execute(self, topic, payload, *args, **kwargs):
         """Command action"""
 
+    def supports_async(self, payload):
+        """Whether the command can be executed by `execute_async`"""
+        return False
+
+    def execute_async(self, topic, payload, *args, **kwargs):
+        """
+        Command action as a coroutine running on the plugin's
+        `AsyncEngine`, used if `supports_async` returns True
+        """
+        raise NotImplementedError
+
+    def on_event(self, event, payload):
+        """Called with events fired by OctoPrint"""
+
+    def on_shutdown(self):
+        """Called when OctoPrint shuts down, after commands have finished"""
+
+    def busy_message(self, payload, reason, retry_after=None):
+        """Response to the command rejected because of the load"""
+        message = {
+            'uid': payload['uid'],
+            'timestamp': payload['timestamp'],
+            'busy': True,
+            'reason': reason,
+        }
+        if retry_after is not None:
+            message['retry_after'] = retry_after
+        return message
+
+    def _reject(self, payload, reason, retry_after=None):
+        """
+        Respond that the command cannot run now. The response is not
+        remembered, so the command may be retried with the same uid.
+        """
+        self.metrics.counter('admission.rejected.' + reason).inc()
+        if self.plugin_instance.idempotency_store is not None:
+            self.plugin_instance.idempotency_store.release(
+                self.idempotency_key(payload))
+        self._publish(self.busy_message(payload, reason, retry_after))
+
+    def _settle_idempotency(self, payload, failed):
+        """
+        Forget the command which failed or has not been answered, so its
+        redelivery or retry is executed again instead of being dropped
+        """
+        idempotency_store = self.plugin_instance.idempotency_store
+        if idempotency_store is None:
+            return
+        if failed or not self.reports_later:
+            idempotency_store.release_unanswered(
+                self.idempotency_key(payload))
+
+    def _release_admission(self):
+        admission_controller = self.plugin_instance.admission_controller
+        if admission_controller is not None:
+            admission_controller.release(self.subtopic)
+
+    def _execute_measured(self, topic, payload, *args, **kwargs):
+        started_at = time.time()
+        failed = True
+        try:
+            self.execute(topic, payload, *args, **kwargs)
+            failed = False
+        finally:
+            self._settle_idempotency(payload, failed)
+            self._release_admission()
+            self.metrics.histogram(
+                self._metric_name('execution_time')
+            ).observe(time.time() - started_at)
+
+    @gen.coroutine
+    def _execute_async_measured(self, topic, payload, *args, **kwargs):
+        started_at = time.time()
+        failed = True
+        try:
+            yield self.execute_async(topic, payload, *args, **kwargs)
+            failed = False
+        finally:
+            self._settle_idempotency(payload, failed)
+            self._release_admission()
+            self.metrics.histogram(
+                self._metric_name('execution_time')
+            ).observe(time.time() - started_at)
+
+    def _submit(self, topic, payload, *args, **kwargs):
+        """
+        Hand parsed command over to the plugin's command executor if it is
+        admitted, it runs the command on a worker or on the async engine
+        """
+        admission_controller = self.plugin_instance.admission_controller
+        if admission_controller is not None:
+            try:
+                admission_controller.admit(
+                    self.subtopic, payload.get('client_id'))
+            except CommandRejected as e:
+                self._logger.info(
+                    'Rejected command {command_name}#{uid}: {reason}'.format(
+                        command_name=self.__class__.__name__,
+                        uid=payload['uid'],
+                        reason=e.reason
+                    )
+                )
+                self._reject(payload, e.reason, e.retry_after)
+                return
+
+        name = '{command_name}#{uid}'.format(
+            command_name=self.__class__.__name__,
+            uid=payload['uid']
+        )
+        command_executor = self.plugin_instance.command_executor
+        engine = self.plugin_instance.engine
+        try:
+            if engine is not None and self.supports_async(payload):
+                command_executor.submit_async(
+                    self.ordering_key(payload), name, engine,
+                    self._execute_async_measured,
+                    topic, payload, *args, **kwargs
+                )
+            else:
+                command_executor.submit_ordered(
+                    self.ordering_key(payload), name, self._execute_measured,
+                    topic, payload, *args, **kwargs
+                )
+        except ExecutorBusy as e:
+            self._logger.error(str(e))
+            self._release_admission()
+            self._reject(payload, REASON_QUEUE_FULL)
+
     def __call__(self, topic, payload, *args, **kwargs):
+        self.metrics.counter(self._metric_name('received')).inc()
+        started_at = time.time()
         try:
             parsed_payload = json.loads(payload)
         except ValueError:
@@ -44,10 +264,12 @@ class CommandBase(object):
                 .format(topic=topic, payload=payload)
             )
         else:
+            self.metrics.histogram(self._metric_name('parse_time')).observe(
+                time.time() - started_at)
             if (
                 'uid' not in parsed_payload
                 or 'timestamp' not in parsed_payload
             ):
                 self._logger.error("'uid' and 'timestamp' fields are required")
-            else:
-                self.execute(topic, parsed_payload, *args, **kwargs)
+            elif not self._is_duplicate(parsed_payload):
+                self._submit(topic, parsed_payload, *args, **kwargs)
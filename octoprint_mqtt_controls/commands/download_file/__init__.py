@@ -1,40 +1,186 @@
 from __future__ import absolute_import
 
 import os
-from threading import Lock
 
-from ...settings import uploads_location
+from octoprint.events import Events
+from octoprint.filemanager.destinations import FileDestinations
+
 from ..base import CommandBase
-from .download_thread import DownloadThread
+from .checksum_index import ChecksumIndex
+from .compression import CHECKSUM_COMPRESSED
+from .async_download import AsyncDownload
+from .download_thread import DownloadThread, select_and_print
+from .manager import DownloadManager
+from .partial import cleanup_partial_downloads
+from .progress import Progress
+from .stream_print import StreamPrintOptions
 
-_DOWNLOAD_THREADS = dict()
-_DOWNLOAD_THREADS_LOCK = Lock()
+QUEUE_FIFO = 'fifo'
 
 
-def _set_download_thread(uid, thread):
-    with _DOWNLOAD_THREADS_LOCK:
-        _DOWNLOAD_THREADS[uid] = thread
+class DownloadFile(CommandBase):
+    subtopic = 'download-file/command'
+    report_subtopic = 'download-file/report'
+    reports_later = True
 
+    def __init__(self, *args, **kwargs):
+        super(DownloadFile, self).__init__(*args, **kwargs)
+        self.download_manager = DownloadManager(
+            self._settings.get_int(['download', 'max_concurrent']),
+            self._logger
+        )
+        self.metrics.gauge(
+            'downloads.running',
+            lambda: self.download_manager.running_count
+        )
+        self.metrics.gauge(
+            'downloads.queued',
+            lambda: self.download_manager.queued_count
+        )
+        self._fifo = self._settings.get(['download', 'queue']) == QUEUE_FIFO
+        self._buffer_size = self._settings.get_int(['download', 'buffer_size'])
+        self._segment_min_size = self._settings.get_int(
+            ['download', 'segment_min_size'])
+        self._progress_interval = self._settings.get_float(
+            ['download', 'progress_interval'])
+        self._progress_step = self._settings.get_int(
+            ['download', 'progress_step'])
+        self._sync_size = self._settings.get_int(['download', 'sync_size'])
+        self._stream_print_options = StreamPrintOptions(
+            self._settings.get_int(
+                ['download', 'stream_print', 'buffer_ahead']),
+            self._settings.get_int(['download', 'stream_print', 'min_lead']),
+            self._settings.get_float(
+                ['download', 'stream_print', 'poll_interval'])
+        )
+        self.checksum_index = self._create_checksum_index()
 
-def _pop_download_thread(uid):
-    with _DOWNLOAD_THREADS_LOCK:
-        return _DOWNLOAD_THREADS.pop(uid, None)
+        removed = cleanup_partial_downloads(
+            self._settings.get_int(['download', 'partial', 'max_age']),
+            self._settings.get_int(['download', 'partial', 'max_size'])
+        )
+        if removed:
+            self._logger.info(
+                'Removed %d orphaned or expired partial files' % removed)
 
+    def _create_checksum_index(self):
+        if not self._settings.get_boolean(['download', 'cache', 'enabled']):
+            return None
 
-class DownloadFile(CommandBase):
-    subtopic = 'download-file/command'
-    report_subtopic = 'download-file/report'
+        checksum_index = ChecksumIndex(
+            os.path.join(
+                self.plugin_instance.get_plugin_data_folder(),
+                'checksum_index.json'
+            ),
+            self._settings.get_int(['download', 'cache', 'max_size']),
+            self.plugin_instance._file_manager,
+            self.plugin_instance._printer,
+            self._logger
+        )
+        try:
+            checksum_index.load()
+        except (IOError, ValueError):
+            self._logger.exception('Could not load checksum index')
+        return checksum_index
+
+    def on_event(self, event, payload):
+        if (
+            self.checksum_index is None
+            or event not in (Events.FILE_ADDED, Events.FILE_REMOVED)
+            or payload.get('storage') != FileDestinations.LOCAL
+        ):
+            return
+        if event == Events.FILE_ADDED:
+            # Entries of files stored by downloads match them and are kept
+            self.checksum_index.refresh_path(payload['path'])
+        else:
+            self.checksum_index.remove_path(payload['path'])
+
+    def on_shutdown(self):
+        # Downloads use the engine and HTTP session closed afterwards
+        self.download_manager.stop_all()
+
+    def coalesce_key(self, payload):
+        # Only progress reports carry downloaded bytes, their progress
+        # is None when the size of the file is unknown
+        if 'downloaded' in payload:
+            return payload['uid']
+        return None
+
+    def busy_message(self, payload, reason, retry_after=None):
+        message = super(DownloadFile, self).busy_message(
+            payload, reason, retry_after)
+        message['progress'] = Progress.error.value
+        return message
+
+    def _print_cached(self, uid, timestamp, path, report_func):
+        """Print already stored file instead of downloading it again"""
+        report_data = {
+            'uid': uid,
+            'timestamp': timestamp,
+            'cached': True,
+            'path': path,
+        }
+        try:
+            select_and_print(
+                self.plugin_instance._printer,
+                self.plugin_instance._file_manager.path_on_disk(
+                    FileDestinations.LOCAL, path)
+            )
+        except Exception as e:
+            report_data.update(progress=Progress.error.value, reason=str(e))
+        else:
+            report_data.update(progress=Progress.success.value)
+        report_func(report_data)
+
+    def _reporter(self, payload):
+        """
+        Return function reporting progress of the command, remembered
+        under its key, so e.g. resumed downloads answer retries of
+        the resume command
+        """
+        idempotency_key = self.idempotency_key(payload)
+        return lambda report_data: self.report(report_data, idempotency_key)
+
+    def idempotency_key(self, payload):
+        """
+        Stop and resume commands reuse uid of the download, so they are
+        told apart from it and from each other by action and timestamp
+        """
+        key = super(DownloadFile, self).idempotency_key(payload)
+        for action in ('stop', 'resume'):
+            if payload.get(action):
+                return u'{key}:{action}:{timestamp}'.format(
+                    key=key,
+                    action=action,
+                    timestamp=payload.get('timestamp')
+                )
+        return key
+
+    def _segments(self, payload):
+        try:
+            return int(payload['segments'])
+        except (KeyError, TypeError, ValueError):
+            return self._settings.get_int(['download', 'segments'])
+
+    def _priority(self, payload):
+        if self._fifo:
+            return 0
+        try:
+            return int(payload.get('priority', 0))
+        except (TypeError, ValueError):
+            return 0
 
     def execute(self, topic, payload, *args, **kwargs):
         uid = payload['uid']
         timestamp = payload['timestamp']
 
         if payload.get('stop'):
-            download_thread = _pop_download_thread(uid)
-            if download_thread is not None:
-                download_thread.schedule_to_stop()
+            if self.download_manager.stop(uid):
                 self._logger.info('Stopped download #%s' % uid)
-                return
+            else:
+                self._logger.warning('Cannot stop unknown download #%s' % uid)
+            return
 
         try:
             url = payload['url']
@@ -45,16 +191,69 @@ class DownloadFile(CommandBase):
             )
         else:
             md5 = payload.get('md5')
-            download_thread = DownloadThread(
+            checksum_form = payload.get('checksum_form')
+            if (
+                md5 and self.checksum_index is not None
+                and checksum_form != CHECKSUM_COMPRESSED
+            ):
+                cached_path = self.checksum_index.lookup(md5)
+                if cached_path is not None:
+                    self._logger.info(
+                        'File of download #%s is already stored as %s'
+                        % (uid, cached_path)
+                    )
+                    self._print_cached(
+                        uid, timestamp, cached_path, self._reporter(payload))
+                    return
+
+            download_class, engine_kwargs = DownloadThread, {}
+            resume = bool(payload.get('resume'))
+            segments = self._segments(payload)
+            stream_print = (
+                self._stream_print_options
+                if payload.get('stream_print') else None
+            )
+            engine = self.plugin_instance.engine
+            if (
+                engine is not None and not resume and segments < 2
+                and stream_print is None
+            ):
+                download_class = AsyncDownload
+                engine_kwargs = {'engine': engine}
+
+            download_thread = download_class(
                 uid,
                 timestamp,
                 url,
                 filename,
                 md5,
-                self.report
+                self._reporter(payload),
+                self.plugin_instance._file_manager,
+                self.plugin_instance._printer,
+                sha256=payload.get('sha256'),
+                buffer_size=self._buffer_size,
+                resume=resume,
+                segments=segments,
+                segment_min_size=self._segment_min_size,
+                progress_interval=self._progress_interval,
+                progress_step=self._progress_step,
+                checksum_index=self.checksum_index,
+                metrics=self.metrics,
+                session=self.plugin_instance.http_session,
+                compression=payload.get('compression'),
+                checksum_form=checksum_form,
+                stream_print=stream_print,
+                sync_size=self._sync_size,
+                **engine_kwargs
             )
-            _set_download_thread(uid, download_thread)
-            download_thread.start()
-            self._logger.info(
-                'Started download #%s. File: %s' % (uid, filename)
+            scheduled = self.download_manager.schedule(
+                download_thread, self._priority(payload)
             )
+            if scheduled:
+                self._logger.info(
+                    'Scheduled download #%s. File: %s' % (uid, filename)
+                )
+            else:
+                self._logger.error(
+                    'Download #%s is already scheduled' % uid
+                )
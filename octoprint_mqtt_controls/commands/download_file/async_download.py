@@ -0,0 +1,331 @@
+from __future__ import absolute_import
+
+import time
+
+from tornado import gen
+from tornado.httpclient import HTTPError, HTTPRequest
+
+from ...util.engine import Cancellation
+from .checksum import ChecksumVerifier
+from .compression import accept_encoding
+from .download_thread import CONTENT_RANGE, DownloadThread
+from .exceptions import (
+    ChecksumVerificationError, IncompleteDownload, StopDownload
+)
+from .partial import PartialDownload
+from .progress import ProgressReporter
+from .writer import FileWriter
+
+# Downloads of large files may take long, the limit only guards against
+# connections which never finish
+REQUEST_TIMEOUT = 24 * 60 * 60
+
+# Client errors which may go away when the request is repeated
+TRANSIENT_CLIENT_ERRORS = (408, 429)
+
+# Reasons requests of downloads are cancelled for
+PAUSED = 'Paused until received data is written'
+STOPPED = 'Download stopped'
+IDLE = 'Timeout while waiting for data'
+WRITE_FAILED = 'Writing the file failed'
+
+
+def is_permanent_failure(error):
+    """Whether the server refused to send the file"""
+    return (
+        isinstance(error, HTTPError)
+        and 400 <= error.code < 500
+        and error.code not in TRANSIENT_CLIENT_ERRORS
+    )
+
+
+class IdleTimeout(object):
+    """
+    Cancels the request when no data has been received for `timeout`
+    seconds. Runs on the event loop.
+    """
+
+    def __init__(self, io_loop, timeout, cancellation):
+        self._io_loop = io_loop
+        self._timeout = timeout
+        self._cancellation = cancellation
+        self._received_at = io_loop.time()
+        self._handle = None
+
+    def touch(self):
+        """Record that data has been received"""
+        self._received_at = self._io_loop.time()
+
+    def start(self):
+        if self._timeout:
+            self._handle = self._io_loop.call_later(
+                self._timeout, self._check)
+
+    def stop(self):
+        if self._handle is not None:
+            self._io_loop.remove_timeout(self._handle)
+            self._handle = None
+
+    def _check(self):
+        idle = self._io_loop.time() - self._received_at
+        if idle >= self._timeout:
+            self._handle = None
+            self._cancellation.cancel(IDLE)
+        else:
+            self._handle = self._io_loop.call_later(
+                self._timeout - idle, self._check)
+
+
+class AsyncDownload(DownloadThread):
+    """
+    Download performed by a coroutine on the `AsyncEngine` event loop
+    instead of in its own thread. Starting it schedules the coroutine,
+    no thread is created for receiving data. Received data is written,
+    verified and stored by the engine's shared `WorkerPool`.
+
+    When the pool's budget of pending data is used up, the download
+    closes its connection, waits until its data is written and continues
+    with a range request. Interrupted downloads keep their partial file,
+    so they can be resumed by `DownloadThread`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Create an AsyncDownload, takes the same arguments as
+        `DownloadThread` and:
+
+        :param engine: `AsyncEngine` running the download
+        """
+        self._engine = kwargs.pop('engine')
+        super(AsyncDownload, self).__init__(*args, **kwargs)
+
+        self._cancellation = None
+        self._checksum_verifier = None
+        self._target_file = None
+        self._target_size = None
+        self._validator = None
+
+    def start(self):
+        self._engine.spawn(self._run_async)
+
+    def schedule_to_stop(self):
+        super(AsyncDownload, self).schedule_to_stop()
+        self._engine.io_loop.add_callback(self._cancel, STOPPED)
+
+    def _cancel(self, reason):
+        if self._cancellation is not None:
+            self._cancellation.cancel(reason)
+
+    def _timeouts(self):
+        """Return connect and read timeouts of the session"""
+        timeout = getattr(self._session, 'timeout', None)
+        if isinstance(timeout, tuple):
+            return timeout
+        return timeout, timeout
+
+    def _http_request(self, offset, on_header, on_chunk):
+        headers = {'Accept-Encoding': accept_encoding()}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+            if self._validator:
+                headers['If-Range'] = self._validator
+        connect_timeout, _ = self._timeouts()
+        return HTTPRequest(
+            self.url,
+            headers=headers,
+            header_callback=on_header,
+            streaming_callback=on_chunk,
+            decompress_response=False,
+            connect_timeout=connect_timeout,
+            request_timeout=REQUEST_TIMEOUT
+        )
+
+    @staticmethod
+    def _continued_offset(status_code, headers, offset):
+        """
+        Return offset the response body starts at: `offset` if the server
+        continues the download, 0 if it sends the whole file
+        or None if it sends an unexpected range
+        """
+        if status_code != 206:
+            return 0
+        match = CONTENT_RANGE.match(headers.get('content-range', ''))
+        if match and int(match.group(1)) == offset:
+            return offset
+        return None
+
+    def _open_file(self, partial, headers, offset):
+        """
+        Prepare writing of the response body described by headers,
+        the file is written from the start unless the response continues
+        the download at `offset`
+        """
+        if offset:
+            # Continued response, the file is open and its data verified
+            return
+
+        self._close_file()
+        content_length = headers.get('content-length')
+        self._target_size = int(content_length) if content_length else None
+        self._validator = headers.get('etag') or headers.get('last-modified')
+        partial.save_state(
+            etag=headers.get('etag'),
+            last_modified=headers.get('last-modified'),
+            total_size=self._target_size
+        )
+        self._checksum_verifier = ChecksumVerifier(
+            md5=self.md5, sha256=self.sha256)
+        self._downloaded = 0
+        self._start_decoding(headers.get('content-encoding'))
+        self._target_file = FileWriter(
+            partial.file_path, 0, self.buffer_size, self.sync_size)
+        if self._target_size and not self._compressed:
+            self._target_file.reserve(self._target_size)
+
+    def _write_received(self, chunk):
+        self._write_chunk(
+            chunk, self._target_file, self._checksum_verifier,
+            self._target_size)
+
+    def _close_file(self):
+        if self._target_file is not None:
+            self._target_file.close()
+            self._target_file = None
+
+    def _finish(self, partial):
+        """Write the rest of the file, verify it and store it"""
+        if self._target_file is None:
+            raise IncompleteDownload(None, 0)
+        self._finish_decoding(self._target_file, self._checksum_verifier)
+        self._close_file()
+        if self._target_size and self._downloaded < self._target_size:
+            raise IncompleteDownload(self._target_size, self._downloaded)
+
+        try:
+            self._checksum_verifier.verify()
+        except ChecksumVerificationError:
+            partial.discard()
+            raise
+        self._complete(partial)
+
+    def _failure(self, error, stream, partial):
+        """
+        Return the exception the download failed with. The partial file
+        is kept for resuming, unless the server refused to send the file.
+        """
+        if self._should_stop.is_set():
+            return StopDownload(self.uid)
+        if is_permanent_failure(error):
+            partial.discard()
+        return stream.error or error
+
+    @gen.coroutine
+    def _fetch_once(self, partial, stream, offset):
+        """
+        Receive the response continuing the download at `offset` and pass
+        its body to the stream. Return whether the request has been paused.
+        """
+        cancellation = self._cancellation = Cancellation()
+        _, read_timeout = self._timeouts()
+        idle_timeout = IdleTimeout(
+            self._engine.io_loop, read_timeout, cancellation)
+        response_info = {'status_code': None, 'headers': {}, 'body': False}
+
+        def on_header(line):
+            idle_timeout.touch()
+            if line.startswith('HTTP/'):
+                # Headers of a redirect are followed by the target's ones
+                response_info['status_code'] = int(line.split()[1])
+                response_info['headers'] = {}
+            elif not line.strip():
+                status_code = response_info['status_code']
+                if not 200 <= status_code < 300:
+                    return
+                headers = dict(response_info['headers'])
+                start = (
+                    self._continued_offset(status_code, headers, offset)
+                    if offset else 0
+                )
+                if start is None:
+                    cancellation.cancel(
+                        'Unexpected range %s' % headers.get('content-range'))
+                    return
+                response_info['body'] = True
+                stream.submit(self._open_file, partial, headers, start)
+            else:
+                name, _, value = line.partition(':')
+                response_info['headers'][name.strip().lower()] = \
+                    value.strip()
+
+        def on_chunk(chunk):
+            idle_timeout.touch()
+            if stream.error is not None:
+                cancellation.cancel(WRITE_FAILED)
+            elif response_info['body']:
+                stream.submit(self._write_received, chunk, size=len(chunk))
+                if stream.full:
+                    cancellation.cancel(PAUSED)
+
+        idle_timeout.start()
+        try:
+            yield self._engine.fetch(
+                self._http_request(offset, on_header, on_chunk),
+                cancellation
+            )
+        except HTTPError:
+            if cancellation.reason != PAUSED:
+                raise
+            raise gen.Return(True)
+        finally:
+            idle_timeout.stop()
+            self._cancellation = None
+        raise gen.Return(False)
+
+    @gen.coroutine
+    def _download_async(self):
+        """Download the file, verify its checksums and store it"""
+        partial = PartialDownload(self.uid, self.url)
+        partial.prepare()
+        self._partial = partial
+
+        self._progress_reporter = ProgressReporter(
+            self._report, self.progress_interval, self.progress_step)
+        stream = self._engine.worker_pool.stream()
+        started_at = time.time()
+        try:
+            try:
+                offset = 0
+                while True:
+                    if self._should_stop.is_set():
+                        raise StopDownload(self.uid)
+                    paused = yield self._fetch_once(partial, stream, offset)
+                    if not paused:
+                        break
+                    # Continues once the received data is on the disk
+                    yield stream.drained()
+                    if stream.error is not None:
+                        raise stream.error
+                    offset = self._downloaded
+                yield stream.call(self._finish, partial)
+            except Exception as e:
+                # Data received so far is kept for resuming
+                yield stream.call(self._close_file, always=True)
+                raise self._failure(e, stream, partial)
+        finally:
+            self._progress_reporter.flush()
+            self._record_transfer(time.time() - started_at)
+
+    @gen.coroutine
+    def _run_async(self):
+        self._report_started()
+        try:
+            yield self._download_async()
+        except StopDownload:
+            self._report_stopped()
+        except Exception as e:
+            self._report_failure(str(e))
+        else:
+            self._report_success()
+        finally:
+            if self.finished_callback is not None:
+                self.finished_callback(self)
@@ -0,0 +1,66 @@
+from __future__ import absolute_import
+
+import hashlib
+
+from .exceptions import ChecksumVerificationError
+
+ALGORITHMS = ('md5', 'sha256')
+
+
+class ChecksumVerifier(object):
+    """
+    Calculates checksums of the data as it is being downloaded
+    and compares them to the expected ones
+
+    Attributes:
+        expected - dict mapping algorithm name to expected hex digest
+    """
+
+    def __init__(self, **expected):
+        """
+        Create a ChecksumVerifier
+
+        :param expected: expected hex digests keyed by algorithm name,
+                         algorithms with empty digest are skipped
+        """
+        self.expected = dict(
+            (algorithm, digest.lower())
+            for algorithm, digest in expected.items()
+            if algorithm in ALGORITHMS and digest
+        )
+        self._hashes = dict(
+            (algorithm, hashlib.new(algorithm))
+            for algorithm in self.expected
+        )
+
+    def update(self, chunk):
+        for hash_object in self._hashes.values():
+            hash_object.update(chunk)
+
+    def update_from_file(self, file_path, start, length, buffer_size):
+        """Feed `length` bytes of the file starting at `start`"""
+        if not self._hashes:
+            return
+
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(buffer_size, remaining))
+                if not chunk:
+                    break
+                self.update(chunk)
+                remaining -= len(chunk)
+
+    def verify(self):
+        """
+        Compare calculated checksums to the expected ones.
+        Raise `ChecksumVerificationError` if any of them do not match.
+        """
+        for algorithm, expected in self.expected.items():
+            calculated = self._hashes[algorithm].hexdigest()
+            if expected != calculated:
+                raise ChecksumVerificationError(
+                    expected=expected,
+                    calculated=calculated
+                )
@@ -0,0 +1,159 @@
+from __future__ import absolute_import
+
+import json
+import os
+import time
+from threading import Lock
+
+from octoprint.filemanager.destinations import FileDestinations
+
+
+class ChecksumIndex(object):
+    """
+    Persistent index of downloaded files by their MD5 checksum, so files
+    already present in the storage are not downloaded again.
+    When the indexed files exceed `max_size` bytes, the least recently
+    used ones not selected for printing are removed from the storage.
+
+    Attributes:
+        path - path to the JSON file the index is persisted to
+        max_size - maximum total size of indexed files in bytes,
+                   0 for no limit
+    """
+
+    def __init__(self, path, max_size, file_manager, printer, logger,
+                 clock=time.time):
+        self.path = path
+        self.max_size = max_size
+
+        self._file_manager = file_manager
+        self._printer = printer
+        self._logger = logger
+        self._clock = clock
+        self._lock = Lock()
+        self._entries = dict()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            self._entries = json.load(f)
+
+    def _save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.rename(temp_path, self.path)
+
+    def _stat(self, path):
+        """Return size and modification time of the stored file or None"""
+        try:
+            stat = os.stat(
+                self._file_manager.path_on_disk(FileDestinations.LOCAL, path)
+            )
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    @staticmethod
+    def _is_current(entry, stat):
+        return stat == (entry['size'], entry.get('mtime'))
+
+    def lookup(self, md5):
+        """
+        Return storage path of the file with given checksum or None
+        if there is no such file or it has changed since it was indexed
+        """
+        md5 = md5.lower()
+        with self._lock:
+            entry = self._entries.get(md5)
+            if entry is None:
+                return None
+            if not self._is_current(entry, self._stat(entry['path'])):
+                del self._entries[md5]
+                self._save()
+                return None
+
+            # Order of use is persisted with the next change of the index
+            entry['used_at'] = self._clock()
+            return entry['path']
+
+    def _remove_entries(self, path, keep=lambda entry: False):
+        """Drop entries of the path not kept, return whether any was"""
+        md5s = [
+            md5 for md5, entry in self._entries.items()
+            if entry['path'] == path and not keep(entry)
+        ]
+        for md5 in md5s:
+            del self._entries[md5]
+        return bool(md5s)
+
+    def add(self, md5, path):
+        """Index the file stored at `path` and evict files over the limit"""
+        stat = self._stat(path)
+        if stat is None:
+            return
+
+        with self._lock:
+            # The file may have replaced a file with other checksum
+            self._remove_entries(path)
+            self._entries[md5.lower()] = {
+                'path': path,
+                'size': stat[0],
+                'mtime': stat[1],
+                'used_at': self._clock(),
+            }
+            self._save()
+        self.evict(keep=path)
+
+    def refresh_path(self, path):
+        """Drop entries of the file if it has changed, e.g. was replaced"""
+        stat = self._stat(path)
+        with self._lock:
+            if self._remove_entries(
+                path, lambda entry: self._is_current(entry, stat)
+            ):
+                self._save()
+
+    def remove_path(self, path):
+        """Drop the file from the index, e.g. after it has been deleted"""
+        with self._lock:
+            if self._remove_entries(path):
+                self._save()
+
+    def _selected_path(self):
+        job = self._printer.get_current_job() or {}
+        selected = job.get('file') or {}
+        if selected.get('origin') != FileDestinations.LOCAL:
+            return None
+        return selected.get('path')
+
+    def _eviction_candidates(self, keep):
+        """Return paths to remove, the least recently used first"""
+        if not self.max_size:
+            return []
+
+        with self._lock:
+            entries = sorted(
+                self._entries.values(), key=lambda e: e['used_at'])
+        total_size = sum(entry['size'] for entry in entries)
+
+        referenced = set([keep, self._selected_path()])
+        candidates = []
+        for entry in entries:
+            if total_size <= self.max_size:
+                break
+            if entry['path'] in referenced:
+                continue
+            candidates.append(entry['path'])
+            total_size -= entry['size']
+        return candidates
+
+    def evict(self, keep=None):
+        """Remove the least recently used files exceeding the size limit"""
+        for path in self._eviction_candidates(keep):
+            try:
+                self._file_manager.remove_file(FileDestinations.LOCAL, path)
+            except Exception:
+                self._logger.exception('Could not evict %r' % path)
+            self.remove_path(path)
@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+
+import zlib
+
+from .exceptions import UnsupportedCompression
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = 'gzip'
+DEFLATE = 'deflate'
+ZSTD = 'zstd'
+
+ALIASES = {
+    'x-gzip': GZIP,
+    'identity': None,
+    '': None,
+}
+
+# Forms of the file the checksums of a compressed download may describe
+CHECKSUM_DECOMPRESSED = 'decompressed'
+CHECKSUM_COMPRESSED = 'compressed'
+
+
+def normalize(compression):
+    """
+    Return name of the compression algorithm, None for uncompressed files.
+    Raise `UnsupportedCompression` for unknown or unavailable algorithms.
+    """
+    if compression is None:
+        return None
+    compression = compression.strip().lower()
+    compression = ALIASES.get(compression, compression)
+    if compression is None:
+        return None
+    if compression not in (GZIP, DEFLATE, ZSTD) or (
+        compression == ZSTD and zstandard is None
+    ):
+        raise UnsupportedCompression(compression)
+    return compression
+
+
+def accept_encoding():
+    """Value of Accept-Encoding header listing supported compressions"""
+    encodings = [GZIP, DEFLATE]
+    if zstandard is not None:
+        encodings.append(ZSTD)
+    return ', '.join(encodings)
+
+
+class _IdentityDecoder(object):
+    def decode(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+class _ZlibDecoder(object):
+    """
+    Decoder of gzip and deflate streams. Deflate streams are usually
+    wrapped in zlib format, but some servers send raw deflate data.
+    """
+
+    def __init__(self, compression):
+        self._raw_fallback = compression == DEFLATE
+        self._decompressor = zlib.decompressobj(
+            zlib.MAX_WBITS | 16 if compression == GZIP else zlib.MAX_WBITS)
+
+    def decode(self, data):
+        try:
+            decoded = self._decompressor.decompress(data)
+        except zlib.error:
+            if not self._raw_fallback:
+                raise
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            decoded = self._decompressor.decompress(data)
+        self._raw_fallback = False
+        return decoded
+
+    def flush(self):
+        return self._decompressor.flush()
+
+
+class _ZstdDecoder(object):
+    def __init__(self):
+        self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def decode(self, data):
+        return self._decompressor.decompress(data)
+
+    def flush(self):
+        return b''
+
+
+def create_decoder(compression):
+    """
+    Return object decompressing the stream chunk by chunk with `decode`,
+    `flush` returns the remaining data
+    """
+    compression = normalize(compression)
+    if compression is None:
+        return _IdentityDecoder()
+    if compression == ZSTD:
+        return _ZstdDecoder()
+    return _ZlibDecoder(compression)
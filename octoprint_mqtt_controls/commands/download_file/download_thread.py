@@ -1,14 +1,42 @@
 from __future__ import absolute_import
 
-import hashlib
-import os
+import re
+import time
 from threading import Event, Thread
-from urllib import urlretrieve
 
-from ...settings import uploads_location
-from ...util import api_request, cached_property
-from .exceptions import ChecksumVerificationError, StopDownload
-from .progress import Progress
+from octoprint.filemanager.destinations import FileDestinations
+from octoprint.filemanager.util import DiskFileWrapper
+
+from ...util.http import PooledSession
+from ...util.metrics import MetricsRegistry
+
+from .checksum import ChecksumVerifier
+from .compression import (
+    CHECKSUM_COMPRESSED, accept_encoding, create_decoder, normalize
+)
+from .exceptions import (
+    ChecksumVerificationError, FileBeingPrinted, IncompleteDownload,
+    PrinterNotReady, StopDownload
+)
+from .partial import PartialDownload
+from .progress import Progress, ProgressReporter
+from .segmented import SegmentedFetcher
+from .stream_print import StreamPrintGuard
+from .writer import FileWriter
+
+DEFAULT_BUFFER_SIZE = 256 * 1024
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+def select_and_print(printer, path):
+    """
+    Select file stored in the local storage and start printing it.
+    OctoPrint selects local files by their path on the disk.
+    """
+    if not printer.is_ready():
+        raise PrinterNotReady(path)
+    printer.select_file(path, False, printAfterSelect=True)
 
 
 class DownloadThread(Thread):
@@ -21,9 +49,35 @@ class DownloadThread(Thread):
         url - file download url
         filename - name of the downloaded file
         md5 - md5 checksum of the downloaded file
+        sha256 - sha256 checksum of the downloaded file
+        buffer_size - size of chunks read from the network and written
+                      to the file
+        sync_size - number of bytes written between syncs to the disk,
+                    0 to sync only the complete file
+        resume - whether to continue previously interrupted download
+        segments - number of connections used for downloading the file
+        segment_min_size - minimum file size in bytes for downloading it
+                           over several connections
+        progress_interval - minimum number of seconds between progress
+                            reports
+        progress_step - minimum progress change in percent between
+                        progress reports
+        compression - algorithm the file is compressed with, None to rely
+                      on Content-Encoding of the response
+        checksum_form - `compressed` if checksums describe the compressed
+                        file, otherwise they describe the stored one
+        stream_print - `StreamPrintOptions` if printing should start before
+                       the download is finished, None otherwise
+        finished_callback - called with the thread when it finishes
     """
 
-    def __init__(self, uid, timestamp, url, filename, md5, report_func):
+    def __init__(self, uid, timestamp, url, filename, md5, report_func,
+                 file_manager, printer, sha256=None,
+                 buffer_size=DEFAULT_BUFFER_SIZE, resume=False, segments=1,
+                 segment_min_size=0, progress_interval=0, progress_step=0,
+                 checksum_index=None, metrics=None, session=None,
+                 compression=None, checksum_form=None, stream_print=None,
+                 sync_size=0):
         """
         Create a DownloadThread
 
@@ -33,28 +87,84 @@ class DownloadThread(Thread):
         :param filename: name of the downloaded file
         :param md5: md5 checksum of the downloaded file
         :param report_func: function used for progress reporting
+        :param file_manager: OctoPrint's file manager the file is stored with
+        :param printer: OctoPrint's printer used for printing the file
+        :param sha256: sha256 checksum of the downloaded file
+        :param buffer_size: size of chunks read from the network
+        :param resume: whether to continue previously interrupted download
+        :param segments: number of connections used if the server supports
+                         range requests
+        :param segment_min_size: minimum file size for segmented download
+        :param progress_interval: minimum number of seconds between progress
+                                  reports
+        :param progress_step: minimum progress change in percent between
+                              progress reports
+        :param checksum_index: `ChecksumIndex` the downloaded file is added
+                               to
+        :param metrics: `MetricsRegistry` transfer speed is recorded in
+        :param session: `requests.Session` shared between downloads to reuse
+                        connections
+        :param compression: algorithm the file is compressed with, it is
+                            decompressed while being written
+        :param checksum_form: `compressed` if checksums describe
+                              the compressed file
+        :param stream_print: `StreamPrintOptions` if the file should be
+                             printed while it is being downloaded
+        :param sync_size: number of bytes written between syncs to the disk
         """
         self.uid = uid
         self.timestamp = timestamp
         self.url = url
         self.filename = filename
         self.md5 = md5
+        self.sha256 = sha256
+        self.buffer_size = buffer_size
+        self.sync_size = sync_size
+        self.resume = resume
+        self.segments = segments
+        self.segment_min_size = segment_min_size
+        self.progress_interval = progress_interval
+        self.progress_step = progress_step
+        self.compression = compression
+        self.checksum_form = checksum_form
+        self.stream_print = stream_print
 
         self._report_func = report_func
+        self._file_manager = file_manager
+        self._printer = printer
+        self._checksum_index = checksum_index
+        self._metrics = metrics or MetricsRegistry(enabled=False)
+        self._session = session if session is not None else PooledSession()
+        self.finished_callback = None
 
         self._should_stop = Event()
+        self._progress_reporter = None
+        self._downloaded = 0
+        self._resumed_from = 0
+        self._written = 0
+        self._decoder = None
+        self._compressed = False
+        self._partial = None
+        self._stream_guard = None
 
         super(DownloadThread, self).__init__()
 
-    @cached_property
-    def _file_path(self):
-        """Get full path to the target download file"""
-        return os.path.join(uploads_location(), self.filename)
-
     def schedule_to_stop(self):
         """Schedule the thread to stop"""
         self._should_stop.set()
 
+    def cancel(self):
+        """Stop the download which has not been started yet"""
+        self.schedule_to_stop()
+        self._report_stopped()
+
+    def report_queued(self, position):
+        """Report that the download waits in the queue"""
+        self._report({
+            'progress': Progress.queued.value,
+            'position': position
+        })
+
     def _report(self, data):
         report_data = {
             'uid': self.uid,
@@ -76,71 +186,333 @@ class DownloadThread(Thread):
     def _report_stopped(self):
         self._report({'progress': Progress.stopped.value})
 
-    def _report_progress(self, block_count, block_size, total_size):
-        progress = min(
-            int(round(block_count * block_size / float(total_size) * 100)),
-            100
-        ) if total_size > 0 else None
-        self._report({'progress': progress})
+    def _report_started(self):
+        self._report({'progress': Progress.started.value})
 
-    def _reporthook(self, *args):
-        """Used as reporthook callback argument in `urllib.urlretrieve`"""
+    def _report_progress(self, downloaded, total_size):
+        self._downloaded = downloaded
+        self._progress_reporter.update(
+            downloaded,
+            total_size,
+            self._written if self._compressed else None
+        )
+
+    def _record_transfer(self, elapsed):
+        """Record number of bytes received in this run and their rate"""
+        transferred = self._downloaded - self._resumed_from
+        if transferred <= 0:
+            return
+        self._metrics.counter('downloads.bytes').inc(transferred)
+        if elapsed > 0:
+            self._metrics.histogram('downloads.speed').observe(
+                transferred / elapsed)
+
+    def _start_decoding(self, content_encoding):
+        """
+        Prepare decompression of the body compressed as declared by
+        the command or by the response
+        """
+        compression = normalize(self.compression or content_encoding)
+        self._decoder = create_decoder(compression)
+        self._compressed = compression is not None
+        self._written = 0
+
+    def _write_chunk(self, chunk, target_file, checksum_verifier,
+                     total_size):
+        """
+        Decompress received chunk, write it to the file and feed
+        the checksum verifier with the form its checksums describe
+        """
         if self._should_stop.is_set():
-            raise StopDownload
+            raise StopDownload(self.uid)
+
+        data = self._decoder.decode(chunk)
+        target_file.write(data)
+        checksum_verifier.update(
+            chunk if self.checksum_form == CHECKSUM_COMPRESSED else data)
+        self._written += len(data)
+        if self.stream_print is not None:
+            self._stream(target_file)
+        self._report_progress(self._downloaded + len(chunk), total_size)
 
-        self._report_progress(*args)
+    def _finish_decoding(self, target_file, checksum_verifier):
+        data = self._decoder.flush()
+        if data:
+            target_file.write(data)
+            if self.checksum_form != CHECKSUM_COMPRESSED:
+                checksum_verifier.update(data)
+            self._written += len(data)
 
-    def _verify_file_hash(self, file_path=None):
+    def _stream(self, target_file):
         """
-        Calculate hash of the downloaded file and compare it to the given
-        checksum (if provided).
-        Raise `ChecksumVerificationError` if checksums do not match.
+        Start printing the file once enough data is buffered ahead
+        of the printer and let the guard keep the print behind
+        the download afterwards
         """
-        if not self.md5:
+        # The printer reads the file from the disk
+        target_file.flush()
+        size = self._resumed_from + self._written
+        if self._stream_guard is not None:
+            self._stream_guard.update(size)
+        elif (
+            size >= self.stream_print.buffer_ahead
+            and self._printer.is_ready()
+        ):
+            # The open file keeps being written after it is moved
+            path = self._store(self._partial)
+            self._stream_guard = StreamPrintGuard(
+                self._printer, path, self.stream_print, self._report)
+            select_and_print(
+                self._printer,
+                self._file_manager.path_on_disk(FileDestinations.LOCAL, path)
+            )
+            self._stream_guard.start(size)
+
+    def _abort_stream_print(self):
+        """Cancel print of the file which could not be downloaded"""
+        if self._stream_guard is None:
             return
+        self._stream_guard.abort()
+        try:
+            self._file_manager.remove_file(
+                FileDestinations.LOCAL, self._stream_guard.path)
+        except Exception:
+            # The failure is reported anyway, the user can remove the file
+            pass
 
-        file_path = file_path or self._file_path
-        md5_hash = hashlib.md5()
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b''):
-                md5_hash.update(chunk)
-
-        calculated_md5 = md5_hash.hexdigest()
-        if not self.md5 == calculated_md5:
-            raise ChecksumVerificationError(
-                expected=self.md5,
-                calculated=calculated_md5
-            )
+    def _write_response(self, response, target_file, checksum_verifier,
+                        total_size):
+        """
+        Write response body to the file chunk by chunk, feeding each chunk
+        to the checksum verifier on the way
+        """
+        for chunk in response.raw.stream(
+                self.buffer_size, decode_content=False):
+            self._write_chunk(
+                chunk, target_file, checksum_verifier, total_size)
+        self._finish_decoding(target_file, checksum_verifier)
+
+        if total_size and self._downloaded < total_size:
+            raise IncompleteDownload(total_size, self._downloaded)
+
+    def _request(self, offset=0, state=None):
+        headers = {'Accept-Encoding': accept_encoding()}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+            validator = state.get('etag') or state.get('last_modified')
+            if validator:
+                headers['If-Range'] = validator
+        return self._session.get(self.url, stream=True, headers=headers)
+
+    @staticmethod
+    def _resume_offset(response, offset):
+        """
+        Return offset the response body starts at: `offset` if the server
+        continues the download, 0 if it sends the whole file
+        or None if the request has to be repeated without range
+        """
+        if response.status_code == 200:
+            return 0
+        if response.status_code == 206:
+            match = CONTENT_RANGE.match(
+                response.headers.get('Content-Range', ''))
+            if match and int(match.group(1)) == offset:
+                return offset
+        return None
+
+    @staticmethod
+    def _total_size(response):
+        if response.status_code == 206:
+            match = CONTENT_RANGE.match(response.headers['Content-Range'])
+            total_size = match.group(3)
+            return int(total_size) if total_size != '*' else None
 
-    def _printjob_request(self):
-        return api_request(
-            'POST',
-            '/api/files/local',
-            data={
-                'select': True,
-                'print': True,
-            },
-            files={
-                'file': (
-                    self.filename,
-                    open(self._file_path, 'rb'),
-                    'application/octet-stream',
+        content_length = response.headers.get('Content-Length')
+        return int(content_length) if content_length else None
+
+    def _fetch_single(self, partial, checksum_verifier):
+        """
+        Download the file over a single connection, continuing previously
+        interrupted download if requested.
+        Interrupted download is kept, so it can be resumed later.
+        """
+        # Compressed stream cannot be decoded from the middle
+        state, offset = (
+            partial.resumable_state()
+            if self.resume and not self.compression else (None, 0)
+        )
+
+        response = self._request(offset, state)
+        try:
+            if offset:
+                offset = self._resume_offset(response, offset)
+                if offset is None or normalize(
+                    response.headers.get('Content-Encoding')
+                ):
+                    response.close()
+                    offset = 0
+                    response = self._request()
+            response.raise_for_status()
+
+            total_size = self._total_size(response)
+            partial.save_state(
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+                total_size=total_size
+            )
+            self._resumed_from = self._downloaded = offset
+            if offset:
+                # Resumed bytes are not transferred in this run
+                self._progress_reporter = ProgressReporter(
+                    self._report, self.progress_interval, self.progress_step,
+                    downloaded=offset
                 )
-            },
+            self._start_decoding(response.headers.get('Content-Encoding'))
+            if offset:
+                checksum_verifier.update_from_file(
+                    partial.file_path, 0, offset, self.buffer_size)
+
+            with FileWriter(
+                partial.file_path, offset, self.buffer_size, self.sync_size
+            ) as f:
+                if total_size and not self._compressed:
+                    f.reserve(total_size)
+                self._write_response(
+                    response, f, checksum_verifier, total_size)
+        finally:
+            response.close()
+
+    def _segmented_size(self, partial):
+        """
+        Return size of the file if it should be downloaded in segments,
+        None otherwise
+        """
+        # Printer reading the file while it is downloaded needs it
+        # written in order
+        if (
+            self.segments < 2 or self.compression
+            or self.stream_print is not None
+        ):
+            return None
+        if self.resume and partial.resumable_state()[1]:
+            return None
+
+        response = self._session.head(self.url, allow_redirects=True)
+        if (
+            not response.ok
+            or response.headers.get('Accept-Ranges') != 'bytes'
+            or response.headers.get('Content-Encoding')
+        ):
+            return None
+
+        total_size = int(response.headers.get('Content-Length') or 0)
+        if total_size < max(self.segment_min_size, self.segments):
+            return None
+        return total_size
+
+    def _fetch_segmented(self, partial, total_size, checksum_verifier):
+        """Download the file over several connections at once"""
+        fetcher = SegmentedFetcher(
+            self.uid,
+            self.url,
+            partial.file_path,
+            total_size,
+            self.segments,
+            self.buffer_size,
+            self._should_stop,
+            self._report_progress,
+            self._session
         )
+        try:
+            fetcher.fetch(checksum_verifier)
+        except Exception:
+            # Segmented file has holes, so it cannot be resumed
+            partial.discard()
+            raise
 
-    def run(self):
+    def _fetch(self):
+        """Download the file and verify its checksums in a single pass"""
+        checksum_verifier = ChecksumVerifier(md5=self.md5, sha256=self.sha256)
+        partial = PartialDownload(self.uid, self.url)
+        partial.prepare()
+        self._partial = partial
+
+        self._progress_reporter = ProgressReporter(
+            self._report, self.progress_interval, self.progress_step)
+        started_at = time.time()
         try:
-            file_path, headers = urlretrieve(
-                self.url, self._file_path, self._reporthook)
-            self._verify_file_hash(file_path)
+            total_size = self._segmented_size(partial)
+            if total_size:
+                self._fetch_segmented(partial, total_size, checksum_verifier)
+            else:
+                self._fetch_single(partial, checksum_verifier)
+        finally:
+            self._progress_reporter.flush()
+            self._record_transfer(time.time() - started_at)
+
+        try:
+            checksum_verifier.verify()
+        except ChecksumVerificationError:
+            partial.discard()
+            raise
+        return partial
+
+    def _store(self, partial):
+        """
+        Move downloaded file into OctoPrint's local storage.
+        Partial files live inside the uploads folder, so this is a rename.
+        Return path of the file in the storage.
+        Raise `FileBeingPrinted` if it would replace the file being printed.
+        """
+        stored_path = self._file_manager.path_in_storage(
+            FileDestinations.LOCAL, self.filename)
+        if not self._printer.can_modify_file(stored_path, False):
+            raise FileBeingPrinted(stored_path)
+
+        path = self._file_manager.add_file(
+            FileDestinations.LOCAL,
+            self.filename,
+            DiskFileWrapper(self.filename, partial.file_path),
+            allow_overwrite=True
+        )
+        partial.complete()
+        return path
+
+    def _complete(self, partial):
+        """Store verified file, index it and start printing it"""
+        if self._stream_guard is not None:
+            path = self._stream_guard.path
+            self._stream_guard.finish()
+        else:
+            path = self._store(partial)
+        # Checksum of the compressed file does not describe the stored one
+        stored_md5 = self.md5 and not (
+            self._compressed and self.checksum_form == CHECKSUM_COMPRESSED)
+        if self._checksum_index is not None and stored_md5:
+            self._checksum_index.add(self.md5, path)
+        if self._stream_guard is None:
+            select_and_print(
+                self._printer,
+                self._file_manager.path_on_disk(FileDestinations.LOCAL, path)
+            )
+
+    def _download(self):
+        self._report_started()
+        try:
+            partial = self._fetch()
+            self._complete(partial)
         except StopDownload:
+            self._abort_stream_print()
             self._report_stopped()
         except Exception as e:
+            self._abort_stream_print()
             self._report_failure(str(e))
         else:
-            resp = self._printjob_request()
-            if resp.ok:
-                self._report_success()
-            else:
-                self._report_failure(resp.status)
+            self._report_success()
+
+    def run(self):
+        try:
+            self._download()
+        finally:
+            if self.finished_callback is not None:
+                self.finished_callback(self)
@@ -13,3 +13,44 @@ class ChecksumVerificationError(Exception):
             'Checksums do not match: {!r} != {!r}'.format(
                 expected, calculated)
         )
+
+
+class IncompleteDownload(Exception):
+    """Raised when connection is closed before the whole file is received"""
+    def __init__(self, expected, received):
+        super(IncompleteDownload, self).__init__(
+            'Received {} out of {} bytes'.format(received, expected)
+        )
+
+
+class UnexpectedRangeResponse(Exception):
+    """Raised when server does not respond to range request with a range"""
+    def __init__(self, status_code):
+        super(UnexpectedRangeResponse, self).__init__(
+            'Expected partial content, got HTTP {}'.format(status_code)
+        )
+
+
+class FileBeingPrinted(Exception):
+    """Raised when downloaded file would replace the file being printed"""
+    def __init__(self, path):
+        super(FileBeingPrinted, self).__init__(
+            'Trying to overwrite file that is currently being printed: '
+            '{!r}'.format(path)
+        )
+
+
+class PrinterNotReady(Exception):
+    """Raised when downloaded file cannot be printed"""
+    def __init__(self, path):
+        super(PrinterNotReady, self).__init__(
+            'Printer is not ready, {!r} has been stored only'.format(path)
+        )
+
+
+class UnsupportedCompression(Exception):
+    """Raised when the file is compressed with an unknown algorithm"""
+    def __init__(self, compression):
+        super(UnsupportedCompression, self).__init__(
+            'Unsupported compression {!r}'.format(compression)
+        )
@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+
+import heapq
+from itertools import count
+from threading import Lock
+
+
+class DownloadManager(object):
+    """
+    Scheduler limiting number of concurrently running downloads.
+    Downloads exceeding the limit wait in a queue ordered by priority
+    (higher first) and by arrival time.
+
+    Attributes:
+        max_concurrent - maximum number of downloads running at once
+    """
+
+    def __init__(self, max_concurrent, logger):
+        """
+        Create a DownloadManager
+
+        :param max_concurrent: maximum number of downloads running at once
+        :param logger: logger used for reporting scheduling events
+        """
+        self.max_concurrent = max_concurrent
+
+        self._logger = logger
+        self._lock = Lock()
+        self._counter = count()
+        self._queue = []
+        self._queued = dict()
+        self._running = dict()
+
+    @property
+    def running_count(self):
+        return len(self._running)
+
+    @property
+    def queued_count(self):
+        return len(self._queued)
+
+    def schedule(self, download_thread, priority=0):
+        """
+        Start the download or put it in the queue if the limit of running
+        downloads has been reached.
+        Return False if a download with the same uid is already scheduled.
+        """
+        uid = download_thread.uid
+        with self._lock:
+            if uid in self._queued or uid in self._running:
+                return False
+
+            download_thread.finished_callback = self._on_finished
+            if len(self._running) < self.max_concurrent:
+                self._running[uid] = download_thread
+                position = None
+            else:
+                self._queued[uid] = download_thread
+                entry = (-priority, next(self._counter), download_thread)
+                heapq.heappush(self._queue, entry)
+                position = self._position(entry)
+
+        if position is None:
+            download_thread.start()
+            self._logger.info('Started download #%s' % uid)
+        else:
+            download_thread.report_queued(position)
+            self._logger.info(
+                'Queued download #%s at position %d' % (uid, position)
+            )
+        return True
+
+    def stop(self, uid):
+        """
+        Stop running or remove queued download.
+        Return False if there is no such download.
+        """
+        with self._lock:
+            download_thread = self._running.get(uid)
+            queued_thread = self._queued.pop(uid, None)
+
+        if download_thread is not None:
+            download_thread.schedule_to_stop()
+        elif queued_thread is not None:
+            # Entry stays in the heap and is skipped when popped
+            queued_thread.cancel()
+        else:
+            return False
+        return True
+
+    def stop_all(self):
+        """Stop all running downloads and clear the queue"""
+        with self._lock:
+            uids = list(self._queued) + list(self._running)
+        for uid in uids:
+            self.stop(uid)
+
+    def _position(self, entry):
+        """Return 1-based position of the heap entry in the start order"""
+        return 1 + sum(
+            1 for queued_entry in self._queue
+            if queued_entry[:2] < entry[:2]
+            and self._queued.get(queued_entry[2].uid) is queued_entry[2]
+        )
+
+    def _pop_next(self):
+        while self._queue:
+            _, _, download_thread = heapq.heappop(self._queue)
+            if self._queued.get(download_thread.uid) is download_thread:
+                del self._queued[download_thread.uid]
+                return download_thread
+        return None
+
+    def _on_finished(self, download_thread):
+        with self._lock:
+            self._running.pop(download_thread.uid, None)
+            next_thread = self._pop_next()
+            if next_thread is not None:
+                self._running[next_thread.uid] = next_thread
+
+        if next_thread is not None:
+            next_thread.start()
+            self._logger.info('Started queued download #%s' % next_thread.uid)
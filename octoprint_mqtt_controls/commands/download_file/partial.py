@@ -0,0 +1,156 @@
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import time
+
+from ...settings import uploads_location
+
+PARTIAL_DIR = os.path.join('.mqtt-controls', 'partial')
+
+
+def partial_location():
+    """Get directory storing partially downloaded files"""
+    return os.path.join(uploads_location(), PARTIAL_DIR)
+
+
+def _stat_downloads(location, keys):
+    """
+    Return `(modified, size, key)` of partial downloads by their keys,
+    oldest first; `modified` is the last change of the file or its state
+    """
+    downloads = []
+    for key in keys:
+        try:
+            part = os.stat(os.path.join(location, key + '.part'))
+            state = os.stat(os.path.join(location, key + '.json'))
+        except OSError:
+            continue
+        downloads.append(
+            (max(part.st_mtime, state.st_mtime), part.st_size, key))
+    return sorted(downloads)
+
+
+def cleanup_partial_downloads(max_age=0, max_size=0, clock=time.time):
+    """
+    Remove partial files left without their state by downloads interrupted
+    while being completed or downloaded in segments, and state of files
+    which no longer exist. Resumable downloads not changed for `max_age`
+    seconds are removed too, then the oldest ones while their total size
+    exceeds `max_size` bytes; `0` disables either limit.
+    Return number of removed files.
+    """
+    location = partial_location()
+    try:
+        names = set(os.listdir(location))
+    except OSError:
+        return 0
+
+    removed = 0
+    resumable = set()
+    for name in names:
+        key, extension = os.path.splitext(name)
+        counterpart = {'.part': '.json', '.json': '.part'}.get(extension)
+        if not counterpart:
+            continue
+        if key + counterpart in names:
+            resumable.add(key)
+        else:
+            PartialDownload._remove(os.path.join(location, name))
+            removed += 1
+
+    downloads = _stat_downloads(location, resumable)
+    total_size = sum(size for _, size, _ in downloads)
+    now = clock()
+    for modified, size, key in downloads:
+        expired = max_age and now - modified > max_age
+        if not expired and (not max_size or total_size <= max_size):
+            continue
+        for extension in ('.part', '.json'):
+            PartialDownload._remove(os.path.join(location, key + extension))
+            removed += 1
+        total_size -= size
+    return removed
+
+
+class PartialDownload(object):
+    """
+    Partially downloaded file together with the state required to resume
+    its download. Stored in a hidden directory inside the uploads folder,
+    so finished files can be moved into place without copying.
+
+    Attributes:
+        uid - unique id of the download
+        url - file download url
+        file_path - path to the partially downloaded file
+        state_path - path to the JSON file with download state
+    """
+
+    def __init__(self, uid, url):
+        self.uid = uid
+        self.url = url
+
+        key = hashlib.sha1(
+            u'{}\n{}'.format(uid, url).encode('utf-8')
+        ).hexdigest()
+        self.file_path = os.path.join(partial_location(), key + '.part')
+        self.state_path = os.path.join(partial_location(), key + '.json')
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def resumable_state(self):
+        """
+        Return saved state (`etag`, `last_modified`, `total_size`) together
+        with the number of bytes already downloaded, or `(None, 0)`
+        if the download cannot be resumed
+        """
+        state = self._load_state()
+        if not state or state.get('url') != self.url:
+            return None, 0
+        try:
+            size = os.path.getsize(self.file_path)
+        except OSError:
+            return None, 0
+
+        total_size = state.get('total_size')
+        if total_size and size > total_size:
+            return None, 0
+        return state, size
+
+    def prepare(self):
+        """Create directory for partial files if it does not exist"""
+        location = partial_location()
+        if not os.path.exists(location):
+            os.makedirs(location)
+
+    def save_state(self, etag=None, last_modified=None, total_size=None):
+        with open(self.state_path, 'w') as f:
+            json.dump({
+                'uid': self.uid,
+                'url': self.url,
+                'etag': etag,
+                'last_modified': last_modified,
+                'total_size': total_size,
+            }, f)
+
+    def complete(self):
+        """Forget state of the download moved into the storage"""
+        self._remove(self.state_path)
+
+    def discard(self):
+        """Remove partial file and its state"""
+        self._remove(self.file_path)
+        self._remove(self.state_path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
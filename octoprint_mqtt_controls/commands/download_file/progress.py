@@ -1,9 +1,114 @@
 from __future__ import absolute_import
 
+import time
+from threading import Lock
+
 from enum import Enum
 
 
 class Progress(Enum):
+    queued = 'queued'
+    started = 'started'
     error = 'error'
     stopped = 'stopped'
     success = 'success'
+    printing = 'printing'
+    print_paused = 'print_paused'
+
+
+class ProgressReporter(object):
+    """
+    Coalesces download progress updates into reports sent at most once per
+    `interval` seconds and only when progress has advanced by at least
+    `step` percent. Reports carry downloaded bytes, speed in bytes per
+    second and estimated seconds left.
+
+    Attributes:
+        interval - minimum number of seconds between reports
+        step - minimum progress change in percent between reports
+    """
+
+    def __init__(self, report_func, interval, step, clock=time.time,
+                 downloaded=0):
+        """
+        Create a ProgressReporter
+
+        :param report_func: function called with report data
+        :param interval: minimum number of seconds between reports
+        :param step: minimum progress change in percent between reports
+        :param clock: function returning current time in seconds
+        :param downloaded: number of bytes downloaded before, e.g. by
+                           an interrupted download being resumed
+        """
+        self.interval = interval
+        self.step = step
+
+        self._report_func = report_func
+        self._clock = clock
+        self._lock = Lock()
+
+        self._reported_at = self._clock()
+        self._reported_bytes = downloaded
+        self._reported_progress = 0
+        self._pending = None
+
+    @staticmethod
+    def _progress(downloaded, total_size):
+        return min(
+            int(round(downloaded / float(total_size) * 100)),
+            100
+        ) if total_size else None
+
+    def _is_due(self, now, progress):
+        if now - self._reported_at < self.interval:
+            return False
+        return (
+            progress is None
+            or progress - self._reported_progress >= self.step
+        )
+
+    def _send(self, now, downloaded, total_size, progress, written):
+        elapsed = now - self._reported_at
+        speed = (
+            (downloaded - self._reported_bytes) / elapsed
+            if elapsed > 0 else None
+        )
+        eta = (
+            (total_size - downloaded) / speed
+            if speed and total_size else None
+        )
+
+        self._reported_at = now
+        self._reported_bytes = downloaded
+        self._reported_progress = progress
+        self._pending = None
+
+        report_data = {
+            'progress': progress,
+            'downloaded': downloaded,
+            'total_size': total_size,
+            'speed': int(speed) if speed is not None else None,
+            'eta': int(round(eta)) if eta is not None else None,
+        }
+        if written is not None:
+            report_data['written'] = written
+        self._report_func(report_data)
+
+    def update(self, downloaded, total_size, written=None):
+        """
+        Record progress, report it if it is due. `written` is the number
+        of decompressed bytes of compressed downloads.
+        """
+        progress = self._progress(downloaded, total_size)
+        with self._lock:
+            now = self._clock()
+            if self._is_due(now, progress):
+                self._send(now, downloaded, total_size, progress, written)
+            else:
+                self._pending = (downloaded, total_size, progress, written)
+
+    def flush(self):
+        """Report the last recorded progress if it has not been reported"""
+        with self._lock:
+            if self._pending is not None:
+                self._send(self._clock(), *self._pending)
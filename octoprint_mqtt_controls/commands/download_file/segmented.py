@@ -0,0 +1,139 @@
+from __future__ import absolute_import
+
+from threading import Event, Lock, Thread
+
+from .exceptions import (
+    IncompleteDownload, StopDownload, UnexpectedRangeResponse
+)
+from .writer import preallocate, sync_file
+
+
+def split_ranges(total_size, segments):
+    """Split `total_size` bytes into at most `segments` inclusive ranges"""
+    segment_size = -(-total_size // segments)
+    return [
+        (start, min(start + segment_size, total_size) - 1)
+        for start in range(0, total_size, segment_size)
+    ]
+
+
+class SegmentedFetcher(object):
+    """
+    Downloads a file over several connections at once, each of them
+    fetching a separate byte range into a preallocated file
+
+    Attributes:
+        uid - unique id of the download
+        url - file download url
+        file_path - path to the file the data is written to
+        total_size - size of the file in bytes
+        segments - number of ranges fetched in parallel
+        buffer_size - size of chunks read from the network
+    """
+
+    def __init__(self, uid, url, file_path, total_size, segments,
+                 buffer_size, should_stop, progress_callback, session):
+        """
+        Create a SegmentedFetcher
+
+        :param should_stop: `Event` set when the download should be stopped
+        :param progress_callback: called with number of downloaded bytes
+                                  and total size
+        :param session: `requests.Session` ranges are requested with
+        """
+        self.uid = uid
+        self.url = url
+        self.file_path = file_path
+        self.total_size = total_size
+        self.segments = segments
+        self.buffer_size = buffer_size
+
+        self._should_stop = should_stop
+        self._progress_callback = progress_callback
+        self._session = session
+        self._failed = Event()
+        self._lock = Lock()
+        self._downloaded = 0
+
+    def fetch(self, checksum_verifier):
+        """
+        Download all ranges, feeding them to the checksum verifier.
+        The first range is hashed as it arrives, the following ones are
+        read back once they are all complete, since hashes need the data
+        in order.
+        """
+        ranges = split_ranges(self.total_size, self.segments)
+        with open(self.file_path, 'wb') as f:
+            preallocate(f.fileno(), 0, self.total_size)
+            f.truncate(self.total_size)
+
+        errors = []
+        threads = [
+            Thread(
+                target=self._fetch_range,
+                args=(start, end, checksum_verifier if not i else None,
+                      errors)
+            )
+            for i, (start, end) in enumerate(ranges)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            stops = [e for e in errors if isinstance(e, StopDownload)]
+            raise (stops or errors)[0]
+        sync_file(self.file_path)
+
+        for start, end in ranges[1:]:
+            checksum_verifier.update_from_file(
+                self.file_path, start, end - start + 1, self.buffer_size)
+
+    def _add_progress(self, size):
+        with self._lock:
+            self._downloaded += size
+            self._progress_callback(self._downloaded, self.total_size)
+
+    def _fetch_range(self, start, end, checksum_verifier, errors):
+        try:
+            self._write_range(start, end, checksum_verifier)
+        except Exception as e:
+            errors.append(e)
+            self._failed.set()
+
+    def _write_range(self, start, end, checksum_verifier):
+        response = self._session.get(
+            self.url,
+            stream=True,
+            headers={
+                'Range': 'bytes=%d-%d' % (start, end),
+                'Accept-Encoding': 'identity',
+            }
+        )
+        try:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise UnexpectedRangeResponse(response.status_code)
+
+            received = 0
+            with open(self.file_path, 'r+b', self.buffer_size) as f:
+                f.seek(start)
+                for chunk in response.raw.stream(
+                        self.buffer_size, decode_content=False):
+                    if self._should_stop.is_set():
+                        raise StopDownload(self.uid)
+                    if self._failed.is_set():
+                        return
+
+                    f.write(chunk)
+                    if checksum_verifier is not None:
+                        checksum_verifier.update(chunk)
+                    received += len(chunk)
+                    self._add_progress(len(chunk))
+        finally:
+            response.close()
+
+        expected = end - start + 1
+        if received < expected:
+            raise IncompleteDownload(expected, received)
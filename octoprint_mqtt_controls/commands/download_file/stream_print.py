@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+
+from collections import namedtuple
+from threading import RLock
+
+from octoprint.util import RepeatedTimer
+
+from .progress import Progress
+
+StreamPrintOptions = namedtuple(
+    'StreamPrintOptions', ['buffer_ahead', 'min_lead', 'poll_interval']
+)
+
+
+class StreamPrintGuard(object):
+    """
+    Keeps the print of a file which is still being downloaded behind
+    the download. The printer reads the file as it grows and would finish
+    the print when it reaches its end, so the print is paused whenever
+    it gets closer than `min_lead` bytes to the end of the written data.
+    It is resumed once `buffer_ahead` bytes are buffered again or
+    the download is finished.
+
+    Only prints paused by the guard are resumed by it. The guard stops
+    watching the printer when the print of the file ends for any other
+    reason.
+
+    Attributes:
+        path - path of the printed file in the local storage
+        options - `StreamPrintOptions` with buffer sizes in bytes
+                  and the number of seconds between printer checks
+    """
+
+    def __init__(self, printer, path, options, report_func):
+        """
+        Create a StreamPrintGuard
+
+        :param printer: OctoPrint's printer printing the file
+        :param path: path of the printed file in the local storage
+        :param options: `StreamPrintOptions`
+        :param report_func: function reporting pauses and resumes
+        """
+        self.path = path
+        self.options = options
+
+        self._printer = printer
+        self._report_func = report_func
+        self._lock = RLock()
+        self._written = 0
+        self._finished = False
+        self._paused = False
+        self._active = False
+        self._timer = None
+
+    def start(self, written):
+        """Start watching the print of the file `written` bytes long"""
+        self._written = written
+        self._active = True
+        self._timer = RepeatedTimer(
+            self.options.poll_interval,
+            self.check,
+            condition=lambda: self._active,
+            daemon=True
+        )
+        self._timer.start()
+        self._report_func({'progress': Progress.printing.value})
+
+    def update(self, written):
+        """Record number of bytes of the file written to the disk"""
+        self._written = written
+
+    def _is_printing_file(self):
+        return self._printer.is_current_file(self.path, False) and (
+            self._printer.is_printing()
+            or self._printer.is_pausing()
+            or self._printer.is_paused()
+        )
+
+    def _filepos(self):
+        progress = self._printer.get_current_data().get('progress') or {}
+        return progress.get('filepos') or 0
+
+    def check(self):
+        """Pause or resume the print depending on the buffered data"""
+        with self._lock:
+            if not self._active:
+                return
+            if not self._is_printing_file():
+                self._active = False
+                return
+
+            lead = self._written - self._filepos()
+            if self._paused:
+                if self._finished or lead >= self.options.buffer_ahead:
+                    self._paused = False
+                    self._printer.resume_print()
+                    self._report_func({'progress': Progress.printing.value})
+            elif not self._finished and lead < self.options.min_lead:
+                self._paused = True
+                self._printer.pause_print()
+                self._report_func({
+                    'progress': Progress.print_paused.value,
+                    'lead': lead
+                })
+
+    def finish(self):
+        """Let the print continue to the end of the downloaded file"""
+        with self._lock:
+            self._finished = True
+            self.check()
+            self._stop()
+
+    def abort(self):
+        """Cancel the print of the file which could not be downloaded"""
+        with self._lock:
+            if self._active and self._is_printing_file():
+                self._printer.cancel_print()
+            self._stop()
+
+    def _stop(self):
+        self._active = False
+        if self._timer is not None:
+            self._timer.cancel()
@@ -0,0 +1,148 @@
+from __future__ import absolute_import
+
+import ctypes
+import ctypes.util
+import errno
+import os
+
+# Written blocks are multiples of the usual file system block size
+ALIGNMENT = 4096
+
+FALLOC_FL_KEEP_SIZE = 0x01
+
+
+def _load_fallocate():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fallocate = libc.fallocate64
+    except (OSError, AttributeError, TypeError):
+        return None
+    fallocate.argtypes = [
+        ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64
+    ]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+
+_fallocate = _load_fallocate()
+
+
+def align(size):
+    """Round size up to a multiple of `ALIGNMENT`"""
+    return max(ALIGNMENT, -(-size // ALIGNMENT) * ALIGNMENT)
+
+
+def preallocate(fd, offset, length):
+    """
+    Reserve disk space for `length` bytes of the file starting at `offset`,
+    so it is not fragmented by writes of concurrent downloads. Size of
+    the file is not changed, partially written files keep the size
+    of their data. Return whether the space has been reserved, it is not
+    on platforms and file systems not supporting it.
+    Raise `OSError` if there is not enough space on the disk.
+    """
+    if _fallocate is None or length <= 0:
+        return False
+    if _fallocate(fd, FALLOC_FL_KEEP_SIZE, offset, length) == 0:
+        return True
+
+    error = ctypes.get_errno()
+    if error == errno.ENOSPC:
+        raise OSError(error, os.strerror(error))
+    return False
+
+
+def sync_file(path):
+    """Flush the file written by other means to the disk"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FileWriter(object):
+    """
+    Writes downloaded data to the file in blocks of `buffer_size` bytes
+    aligned to their offsets in the file, so SD cards and file systems
+    get whole blocks instead of network sized pieces. Written data is
+    synced to the disk every `sync_size` bytes and when the writer is
+    closed, so the file is complete on the disk before it is moved into
+    the storage.
+
+    Attributes:
+        path - path to the written file
+        buffer_size - size of written blocks, a multiple of `ALIGNMENT`
+        sync_size - number of bytes written between syncs, 0 to sync
+                    only when the writer is closed
+    """
+
+    def __init__(self, path, offset=0, buffer_size=ALIGNMENT, sync_size=0):
+        """
+        Open the file for writing, truncating it unless data is appended
+        at `offset`
+
+        :param path: path to the written file
+        :param offset: number of bytes already stored in the file
+        :param buffer_size: size of written blocks
+        :param sync_size: number of bytes written between syncs
+        """
+        self.path = path
+        self.buffer_size = align(buffer_size)
+        self.sync_size = sync_size
+
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        if not offset:
+            flags |= os.O_TRUNC
+        self._fd = os.open(path, flags, 0o644)
+        os.lseek(self._fd, offset, os.SEEK_SET)
+        self._position = offset
+        self._buffer = bytearray()
+        self._unsynced = 0
+
+    def reserve(self, total_size):
+        """Preallocate space for the rest of the file of `total_size`"""
+        return preallocate(
+            self._fd, self._position, total_size - self._position)
+
+    def _write(self, size):
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        written = os.write(self._fd, data)
+        while written < size:
+            written += os.write(self._fd, data[written:])
+
+        self._position += size
+        self._unsynced += size
+        if self.sync_size and self._unsynced >= self.sync_size:
+            os.fsync(self._fd)
+            self._unsynced = 0
+
+    def write(self, data):
+        self._buffer.extend(data)
+        # The first block ends at the boundary following the offset
+        block = self.buffer_size - self._position % self.buffer_size
+        while len(self._buffer) >= block:
+            self._write(block)
+            block = self.buffer_size
+
+    def flush(self):
+        """Write buffered data, so other readers of the file see it"""
+        if self._buffer:
+            self._write(len(self._buffer))
+
+    def close(self):
+        if self._fd is None:
+            return
+        try:
+            self.flush()
+            os.fsync(self._fd)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,15 @@
+class ExecutorBusy(Exception):
+    """Raised when command executor's queue is full"""
+    def __init__(self, name, queue_depth):
+        super(ExecutorBusy, self).__init__(
+            'Cannot queue command {}: {} commands are already waiting'.format(
+                name, queue_depth)
+        )
+
+
+class CommandRejected(Exception):
+    """Raised when admitting the command would exceed one of the limits"""
+    def __init__(self, reason, retry_after):
+        super(CommandRejected, self).__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
@@ -0,0 +1,182 @@
+from __future__ import absolute_import
+
+import time
+from collections import deque, namedtuple
+from threading import Condition, Thread
+
+from tornado import gen
+
+from ..util.metrics import MetricsRegistry
+from .exceptions import ExecutorBusy
+
+_Task = namedtuple('_Task', (
+    'ordering_key', 'name', 'func', 'args', 'kwargs', 'queued_at', 'engine'
+))
+
+
+class CommandExecutor(object):
+    """
+    Bounded pool of worker threads executing commands outside of the MQTT
+    client's network thread. Workers take commands from a shared queue,
+    a command is held back only while another command with the same
+    ordering key is being executed, so commands with the same key are
+    executed one at a time in the order they were submitted, e.g. stop
+    of a download after its start.
+
+    Attributes:
+        pool_size - number of worker threads
+        queue_depth - maximum number of commands waiting for a free worker
+    """
+
+    def __init__(self, pool_size, queue_depth, logger, metrics=None):
+        """
+        Create a CommandExecutor and start its worker threads
+
+        :param pool_size: number of worker threads
+        :param queue_depth: maximum number of commands waiting for a worker
+        :param logger: logger used for reporting command timings and errors
+        :param metrics: `MetricsRegistry` queue wait times are recorded in
+        """
+        self.pool_size = pool_size
+        self.queue_depth = queue_depth
+
+        self._logger = logger
+        self._condition = Condition()
+        self._queue = deque()
+        self._running_keys = set()
+        self._shutdown = False
+        self._workers = []
+        self._metrics = metrics or MetricsRegistry(enabled=False)
+        self._metrics.gauge('executor.queue_size', lambda: self.queue_size)
+
+        for number in range(pool_size):
+            worker = Thread(
+                target=self._work,
+                name='mqtt-controls-worker-%d' % number
+            )
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def queue_size(self):
+        """Number of commands waiting for a worker"""
+        return len(self._queue)
+
+    def submit(self, name, func, *args, **kwargs):
+        """
+        Schedule `func` to be called with given arguments by one of
+        the workers, in no particular order to other commands.
+        Raise `ExecutorBusy` if the queue is full.
+        """
+        self.submit_ordered(None, name, func, *args, **kwargs)
+
+    def submit_ordered(self, ordering_key, name, func, *args, **kwargs):
+        """
+        Schedule `func` to be called with given arguments after commands
+        previously submitted with the same `ordering_key` have finished,
+        commands without a key are executed in no particular order.
+        Raise `ExecutorBusy` if the queue is full.
+        """
+        self._enqueue(
+            _Task(ordering_key, name, func, args, kwargs, time.time(), None))
+
+    def submit_async(self, ordering_key, name, engine, func, *args,
+                     **kwargs):
+        """
+        Schedule coroutine function `func` to be run on the `AsyncEngine`
+        like `submit_ordered` schedules functions. The coroutine does not
+        hold a worker, commands with the same key are held back until it
+        finishes.
+        Raise `ExecutorBusy` if the queue is full.
+        """
+        self._enqueue(
+            _Task(ordering_key, name, func, args, kwargs, time.time(), engine))
+
+    def _enqueue(self, task):
+        with self._condition:
+            if len(self._queue) >= self.queue_depth:
+                raise ExecutorBusy(task.name, self.queue_depth)
+            self._queue.append(task)
+            self._condition.notify()
+
+    def _release(self, ordering_key):
+        """Let commands held back by the key run"""
+        with self._condition:
+            self._running_keys.discard(ordering_key)
+            self._condition.notify_all()
+
+    def shutdown(self, timeout=None):
+        """Stop workers after all already queued commands are executed"""
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _next_task(self):
+        """Remove and return the first task which may run now"""
+        for task in self._queue:
+            if (
+                task.ordering_key is None
+                or task.ordering_key not in self._running_keys
+            ):
+                self._queue.remove(task)
+                if task.ordering_key is not None:
+                    self._running_keys.add(task.ordering_key)
+                return task
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                task = self._next_task()
+                while task is None:
+                    if self._shutdown and not self._queue:
+                        return
+                    self._condition.wait()
+                    task = self._next_task()
+            if task.engine is not None:
+                task.engine.spawn(self._run_async, task)
+                continue
+            try:
+                self._run(task)
+            finally:
+                if task.ordering_key is not None:
+                    self._release(task.ordering_key)
+
+    @gen.coroutine
+    def _run_async(self, task):
+        started_at = time.time()
+        self._metrics.histogram('executor.queue_wait').observe(
+            started_at - task.queued_at)
+        try:
+            yield task.func(*task.args, **task.kwargs)
+        except Exception:
+            self._logger.exception('Command %s failed' % task.name)
+        finally:
+            if task.ordering_key is not None:
+                self._release(task.ordering_key)
+            self._log_timings(task, started_at)
+
+    def _run(self, task):
+        started_at = time.time()
+        self._metrics.histogram('executor.queue_wait').observe(
+            started_at - task.queued_at)
+        try:
+            task.func(*task.args, **task.kwargs)
+        except Exception:
+            self._logger.exception('Command %s failed' % task.name)
+        finally:
+            self._log_timings(task, started_at)
+
+    def _log_timings(self, task, started_at):
+        self._logger.debug(
+            'Command {name}: queue wait {wait:.3f}s, '
+            'execution {execution:.3f}s'
+            .format(
+                name=task.name,
+                wait=started_at - task.queued_at,
+                execution=time.time() - started_at
+            )
+        )
@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+
+import json
+import os
+import time
+from threading import Lock
+
+from ..util import LRUCache
+
+_IN_PROGRESS = object()
+
+
+class IdempotencyStore(object):
+    """
+    Bounded store of recently seen command keys together with the last
+    response reported for each of them, used to drop commands redelivered
+    by the broker. Can be persisted to a JSON file.
+
+    Attributes:
+        ttl - number of seconds a command is remembered for
+        path - path to the file the store is persisted to, if any
+    """
+
+    def __init__(self, max_size, ttl, path=None, save_interval=30,
+                 clock=time.time):
+        """
+        Create an IdempotencyStore
+
+        :param max_size: maximum number of remembered commands
+        :param ttl: number of seconds a command is remembered for
+        :param path: path to the file the store is persisted to
+        :param save_interval: minimum number of seconds between saving
+                              the store after it has changed
+        """
+        self.ttl = ttl
+        self.path = path
+        self.save_interval = save_interval
+
+        self._clock = clock
+        self._cache = LRUCache(max_size, clock=clock)
+        self._lock = Lock()
+        self._save_lock = Lock()
+        self._saved_at = clock()
+
+    def claim(self, key):
+        """
+        Remember the command key. Return a tuple `(is_new, response)`
+        where `response` is the last response reported for an already seen
+        command or None if there is none yet.
+        """
+        with self._lock:
+            response = self._cache.get(key)
+            if response is None:
+                self._cache.set(key, _IN_PROGRESS, self.ttl)
+                return True, None
+        return False, (response if response is not _IN_PROGRESS else None)
+
+    def release(self, key):
+        """Forget the command key, e.g. when the command was not executed"""
+        self._cache.pop(key)
+
+    def release_unanswered(self, key):
+        """
+        Forget the command key if no response has been recorded for it,
+        e.g. when the command failed
+        """
+        with self._lock:
+            if self._cache.get(key) is _IN_PROGRESS:
+                self._cache.pop(key)
+
+    def record(self, key, response):
+        """Remember the response reported for the command"""
+        with self._lock:
+            if self._cache.get(key) is None:
+                return
+            self._cache.set(key, response, self.ttl)
+        if self.path and self._clock() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            entries = json.load(f)
+        for key, response, ttl in entries:
+            if ttl is None or ttl > 0:
+                self._cache.set(key, response, ttl)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._save_lock:
+            self._saved_at = self._clock()
+            entries = [
+                (key, response, ttl)
+                for key, response, ttl in self._cache.snapshot()
+                if response is not _IN_PROGRESS
+            ]
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(entries, f)
+            os.rename(temp_path, self.path)
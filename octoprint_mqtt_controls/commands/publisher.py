@@ -0,0 +1,149 @@
+from __future__ import absolute_import
+
+import json
+from collections import OrderedDict
+from itertools import count
+from threading import Condition, Thread
+
+from ..util.metrics import MetricsRegistry
+
+
+class PublishQueue(object):
+    """
+    Queue of outgoing MQTT messages published by a background thread, so
+    producers never wait for the broker.
+
+    Messages published with the same coalescing key replace the queued
+    one in place, so only the latest progress of a download is sent.
+    When queued messages exceed the memory budget, the oldest coalescable
+    messages are dropped first; if that is not enough, the new message is
+    dropped. A single message is always accepted into an empty queue.
+
+    Attributes:
+        max_bytes - memory budget of queued messages, measured as the size
+                    of their JSON encoding
+    """
+
+    def __init__(self, publish_func, max_bytes, logger, metrics=None):
+        """
+        Create a PublishQueue and start its flusher thread
+
+        :param publish_func: function called with topic and payload
+                             of each message
+        :param max_bytes: memory budget of queued messages
+        :param logger: logger used for reporting dropped messages and
+                       publishing errors
+        :param metrics: `MetricsRegistry` queue statistics are recorded in
+        """
+        self.max_bytes = max_bytes
+
+        self._publish_func = publish_func
+        self._logger = logger
+        self._metrics = metrics or MetricsRegistry(enabled=False)
+        self._condition = Condition()
+        self._pending = OrderedDict()
+        self._size = 0
+        self._counter = count()
+        self._stopped = False
+
+        self._metrics.gauge('publisher.depth', lambda: self.depth)
+        self._metrics.gauge('publisher.bytes', lambda: self.size)
+
+        self._thread = Thread(
+            target=self._flush_loop, name='mqtt-controls-publisher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def depth(self):
+        """Number of queued messages"""
+        return len(self._pending)
+
+    @property
+    def size(self):
+        """Size of queued messages in bytes"""
+        return self._size
+
+    def _drop_coalescable(self, needed):
+        """Drop the oldest coalescable messages until `needed` bytes fit"""
+        for key in list(self._pending):
+            if self._size + needed <= self.max_bytes:
+                return
+            if key[0] == 'coalesce':
+                self._size -= self._pending.pop(key)[2]
+                self._metrics.counter('publisher.dropped').inc()
+
+    def publish(self, topic, payload, coalesce_key=None, block=False):
+        """
+        Queue the message, or publish it right away if the queue has been
+        stopped. With `block`, wait until the message fits into the memory
+        budget instead of dropping it.
+        Return False if it has been dropped because of the memory budget.
+        """
+        if self._stopped:
+            self._publish_func(topic, payload)
+            return True
+
+        size = len(json.dumps(payload))
+        if coalesce_key is not None:
+            key = ('coalesce', topic, coalesce_key)
+        else:
+            key = ('message', next(self._counter))
+
+        with self._condition:
+            replaced = self._pending.get(key)
+            if replaced is not None:
+                self._size -= replaced[2]
+                self._metrics.counter('publisher.coalesced').inc()
+            elif block:
+                while (
+                    self._pending and self._size + size > self.max_bytes
+                    and not self._stopped
+                ):
+                    self._condition.wait()
+            elif self._pending and self._size + size > self.max_bytes:
+                self._drop_coalescable(size)
+                if self._pending and self._size + size > self.max_bytes:
+                    self._metrics.counter('publisher.dropped').inc()
+                    self._logger.warning(
+                        'Dropped message to {topic}: {size} bytes are '
+                        'already queued'.format(topic=topic, size=self._size)
+                    )
+                    return False
+
+            self._pending[key] = (topic, payload, size)
+            self._size += size
+            self._condition.notify_all()
+        return True
+
+    def _take_pending(self):
+        with self._condition:
+            while not self._pending and not self._stopped:
+                self._condition.wait()
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._size = 0
+            self._condition.notify_all()
+            return pending
+
+    def _flush_loop(self):
+        while True:
+            pending = self._take_pending()
+            if not pending and self._stopped:
+                return
+            for topic, payload, size in pending:
+                try:
+                    self._publish_func(topic, payload)
+                except Exception:
+                    self._logger.exception(
+                        'Could not publish message to %s' % topic)
+                else:
+                    self._metrics.counter('publish.count').inc()
+                    self._metrics.counter('publish.bytes').inc(size)
+
+    def stop(self, timeout=None):
+        """Publish already queued messages and stop the flusher thread"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
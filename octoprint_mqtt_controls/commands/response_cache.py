@@ -0,0 +1,141 @@
+from __future__ import absolute_import
+
+import json
+from threading import Event, Lock
+
+from octoprint.events import Events
+
+from ..util import LRUCache
+
+CACHEABLE_METHODS = ('GET',)
+
+_PRINTER = '/api/printer'
+_JOB = '/api/job'
+_FILES = '/api/files'
+_CONNECTION = '/api/connection'
+
+INVALIDATING_EVENTS = {
+    Events.CONNECTED: (_CONNECTION, _PRINTER, _JOB),
+    Events.DISCONNECTED: (_CONNECTION, _PRINTER, _JOB),
+    Events.PRINTER_STATE_CHANGED: (_CONNECTION, _PRINTER, _JOB),
+    Events.FILE_ADDED: (_FILES,),
+    Events.FILE_REMOVED: (_FILES,),
+    Events.FOLDER_ADDED: (_FILES,),
+    Events.FOLDER_REMOVED: (_FILES,),
+    Events.UPDATED_FILES: (_FILES,),
+    Events.METADATA_ANALYSIS_FINISHED: (_FILES,),
+    Events.FILE_SELECTED: (_JOB, _FILES),
+    Events.FILE_DESELECTED: (_JOB, _FILES),
+    Events.PRINT_STARTED: (_JOB, _PRINTER, _FILES),
+    Events.PRINT_DONE: (_JOB, _PRINTER, _FILES),
+    Events.PRINT_FAILED: (_JOB, _PRINTER, _FILES),
+    Events.PRINT_CANCELLED: (_JOB, _PRINTER, _FILES),
+    Events.PRINT_PAUSED: (_JOB, _PRINTER),
+    Events.PRINT_RESUMED: (_JOB, _PRINTER),
+    Events.SETTINGS_UPDATED: None,
+}
+
+
+class _PendingFetch(object):
+    def __init__(self):
+        self.done = Event()
+        self.response = None
+
+
+class ResponseCache(object):
+    """
+    Cache of API responses to idempotent requests.
+    Each endpoint is cached for the number of seconds configured for
+    the longest endpoint prefix matching whole path segments, e.g.
+    `/api/job` matches `/api/job/x` but not `/api/jobs`, endpoints without
+    configured time are not cached. Concurrent requests for the same missing entry
+    wait for a single backend request.
+
+    Attributes:
+        ttls - dict mapping endpoint prefix to number of seconds
+               its responses are cached for
+    """
+
+    def __init__(self, max_size, ttls):
+        self.ttls = dict(ttls or {})
+
+        self._cache = LRUCache(max_size)
+        self._lock = Lock()
+        self._pending = dict()
+        self._generation = 0
+
+    @staticmethod
+    def _path(endpoint):
+        return endpoint.split('?', 1)[0]
+
+    @staticmethod
+    def _matches(path, prefixes):
+        """Whether the path is any prefix or lies under it"""
+        return any(
+            path == prefix or path.startswith(prefix.rstrip('/') + '/')
+            for prefix in prefixes
+        )
+
+    def _ttl(self, endpoint):
+        path = self._path(endpoint)
+        prefixes = [p for p in self.ttls if self._matches(path, (p,))]
+        if not prefixes:
+            return None
+        return self.ttls[max(prefixes, key=len)] or None
+
+    def fetch(self, method, endpoint, data, request_func):
+        """
+        Return cached response to the request or call `request_func`
+        and cache its result if the response is cacheable
+        """
+        ttl = self._ttl(endpoint) if method in CACHEABLE_METHODS else None
+        if ttl is None:
+            return request_func()
+
+        key = (method, endpoint, json.dumps(data, sort_keys=True))
+        response = self._cache.get(key)
+        if response is not None:
+            return response
+
+        with self._lock:
+            pending = self._pending.get(key)
+            is_owner = pending is None
+            if is_owner:
+                pending = self._pending[key] = _PendingFetch()
+            generation = self._generation
+
+        if not is_owner:
+            pending.done.wait()
+            return pending.response or request_func()
+
+        try:
+            pending.response = response = request_func()
+            with self._lock:
+                if (
+                    generation == self._generation
+                    and 200 <= response.status_code < 300
+                ):
+                    self._cache.set(key, response, ttl)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.done.set()
+        return response
+
+    def invalidate(self, prefixes=None):
+        """Drop cached responses of endpoints under any prefix"""
+        with self._lock:
+            self._generation += 1
+        if prefixes is None:
+            self._cache.invalidate()
+        else:
+            self._cache.invalidate(
+                lambda key: self._matches(self._path(key[1]), prefixes)
+            )
+
+    def on_event(self, event):
+        if event in INVALIDATING_EVENTS:
+            self.invalidate(INVALIDATING_EVENTS[event])
+
+    def stats(self):
+        return self._cache.stats()
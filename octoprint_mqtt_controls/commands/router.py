@@ -0,0 +1,33 @@
+from __future__ import absolute_import
+
+WILDCARD = '#'
+
+
+class CommandRouter(object):
+    """
+    Receives messages from a single wildcard subscription covering
+    all commands and dispatches them to commands by subtopic.
+    Messages at topics of no command are dropped before being parsed.
+
+    Attributes:
+        base_topic - topic all command subtopics are relative to
+    """
+
+    def __init__(self, base_topic, commands):
+        self.base_topic = base_topic
+        self._routes = dict(
+            (command.subtopic, command) for command in commands
+        )
+
+    @property
+    def topic(self):
+        """Topic filter matching topics of all commands"""
+        return self.base_topic + WILDCARD
+
+    def __call__(self, topic, payload, *args, **kwargs):
+        if not topic.startswith(self.base_topic):
+            return
+
+        command = self._routes.get(topic[len(self.base_topic):])
+        if command is not None:
+            command(topic, payload, *args, **kwargs)
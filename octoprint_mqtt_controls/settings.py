@@ -2,14 +2,15 @@ from __future__ import absolute_import
 
 import os
 
+from octoprint.events import Events
 from octoprint.settings import settings
 
-from .util import cached_call
+from .util import memoize
 
 DEFAULT_UPLOADS_LOCATION = '~/.octoprint/uploads'
 
 
-@cached_call
+@memoize(max_size=1, invalidated_by=(Events.SETTINGS_UPDATED,))
 def uploads_location():
     octoprint_settings = settings()
     return os.path.expanduser(
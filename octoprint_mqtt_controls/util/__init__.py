@@ -1,5 +1,8 @@
 from __future__ import absolute_import
 
-from .api import api_request, api_url_base, get_endpoint_url
-from .cache import cached_property, cached_call
+from .api import api_url_base, get_endpoint_url
+from .cache import (
+    LRUCache, cached_call, cached_property, invalidate_on_event, memoize,
+    memoized_stats
+)
 from .urlencode_safe import urlencode_safe
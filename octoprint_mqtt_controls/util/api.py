@@ -1,12 +1,12 @@
 from urlparse import urljoin
 
-import requests
+from octoprint.events import Events
 from octoprint.settings import settings as get_octoprint_settings
 
-from .cache import cached_call
+from .cache import memoize
 
 
-@cached_call
+@memoize(max_size=1, invalidated_by=(Events.SETTINGS_UPDATED,))
 def api_url_base():
     octoprint_settings = get_octoprint_settings()
     api_host = octoprint_settings.get(['server', 'host']) or '0.0.0.0'
@@ -14,20 +14,8 @@ def api_url_base():
     return 'http://{}:{}'.format(api_host, api_port)
 
 
+@memoize(max_size=256, invalidated_by=(Events.SETTINGS_UPDATED,))
 def get_endpoint_url(endpoint):
     """Get full url for the given"""
     return urljoin(api_url_base(), endpoint)
 
-
-def api_request(method, endpoint, **kwargs):
-    octoprint_settings = get_octoprint_settings()
-
-    headers = {
-        'X-Api-Key': octoprint_settings.get(['api', 'key'])
-    }
-    headers.update(
-        kwargs.get('headers', ())
-    )
-    kwargs['headers'] = headers
-
-    return requests.request(method, get_endpoint_url(endpoint), **kwargs)
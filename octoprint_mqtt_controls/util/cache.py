@@ -1,29 +1,171 @@
 from __future__ import absolute_import
 
+import time
+from collections import OrderedDict
 from functools import wraps
+from threading import Lock, RLock
+
+_MISSING = object()
+
+_memoized = []
 
 
 class cached_property(object):
+    """
+    Property computed once per instance. Concurrent first accesses compute
+    the value only once, `del instance.name` invalidates it.
+    """
+
     def __init__(self, func):
         self.func = func
         self.__doc__ = func.__doc__
+        self._lock = RLock()
 
     def __get__(self, obj, objtype=None):
         if obj is None:
             return self
 
-        value = obj.__dict__[self.func.__name__] = self.func(obj)
-        return value
+        name = self.func.__name__
+        with self._lock:
+            if name not in obj.__dict__:
+                obj.__dict__[name] = self.func(obj)
+            return obj.__dict__[name]
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping holding at most `max_size` entries, evicting
+    the least recently used ones. Entries may expire after given number
+    of seconds.
+
+    Attributes:
+        max_size - maximum number of entries
+        hits - number of successful lookups
+        misses - number of lookups of missing or expired entries
+    """
+
+    def __init__(self, max_size, clock=time.time):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._clock = clock
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or (
+                entry[1] is not None and entry[1] <= self._clock()
+            ):
+                self.misses += 1
+                return default
+
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Store the value, it expires after `ttl` seconds if given"""
+        expires_at = self._clock() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def invalidate(self, predicate=None):
+        """Remove entries with keys matching the predicate or all entries"""
+        with self._lock:
+            if predicate is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]
+
+    def snapshot(self):
+        """
+        Return list of `(key, value, ttl)` tuples of entries which have not
+        expired yet, ordered from the least recently used one
+        """
+        now = self._clock()
+        with self._lock:
+            return [
+                (key, value, expires_at - now if expires_at else None)
+                for key, (value, expires_at) in self._entries.items()
+                if expires_at is None or expires_at > now
+            ]
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def memoize(max_size=128, ttl=None, invalidated_by=(), clock=time.time):
+    """
+    Cache results of the decorated function by its arguments in
+    an `LRUCache`. Results expire after `ttl` seconds if given and are
+    dropped when one of `invalidated_by` events is passed
+    to `invalidate_on_event`.
+
+    The decorated function has `invalidate(*args, **kwargs)` removing result
+    of the given call, `cache_clear()` and `cache_stats()` attributes.
+    """
+    def decorator(func):
+        cache = LRUCache(max_size, clock)
+
+        def key(args, kwargs):
+            return args, tuple(sorted(kwargs.items()))
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            call_key = key(args, kwargs)
+            result = cache.get(call_key, _MISSING)
+            if result is _MISSING:
+                result = func(*args, **kwargs)
+                cache.set(call_key, result, ttl)
+            return result
+
+        wrapper.invalidate = lambda *args, **kwargs: cache.pop(
+            key(args, kwargs))
+        wrapper.cache_clear = cache.invalidate
+        wrapper.cache_stats = cache.stats
+        wrapper.invalidated_by = frozenset(invalidated_by)
+        _memoized.append(wrapper)
+        return wrapper
+
+    return decorator
 
 
 def cached_call(func):
     """Cache result of first call and return it on sequential calls"""
-    result = {}
+    return memoize(max_size=1)(func)
+
+
+def invalidate_on_event(event):
+    """Clear caches of memoized functions invalidated by the event"""
+    for func in _memoized:
+        if event in func.invalidated_by:
+            func.cache_clear()
 
-    @wraps(func)
-    def wrapper():
-        if not result.get('res'):
-            result['res'] = func()
-        return result['res']
 
-    return wrapper
+def memoized_stats():
+    """Return cache statistics of memoized functions by their names"""
+    return dict(
+        ('{module}.{name}'.format(module=func.__module__, name=func.__name__),
+         func.cache_stats())
+        for func in _memoized
+    )
@@ -0,0 +1,118 @@
+from __future__ import absolute_import
+
+import base64
+import gzip
+import io
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+ZLIB = 'zlib'
+GZIP = 'gzip'
+
+ENCODINGS = (JSON, MSGPACK, ZLIB, GZIP)
+
+
+def filter_headers(headers, names):
+    """Return headers with given names, compared case-insensitively"""
+    wanted = set(name.lower() for name in names)
+    return dict(
+        (name, value) for name, value in headers.items()
+        if name.lower() in wanted
+    )
+
+
+def _lookup(value, keys):
+    for key in keys:
+        if isinstance(value, dict) and key in value:
+            value = value[key]
+        elif isinstance(value, list) and key.isdigit() \
+                and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            raise KeyError(key)
+    return value
+
+
+def project(body, paths):
+    """
+    Reduce JSON body to values at given dot-separated paths, keeping their
+    nesting, e.g. `state.text` or `files.0.name`. Missing paths are skipped.
+    Return body unchanged if paths are None or body is not a JSON document.
+    """
+    if paths is None or not isinstance(body, (dict, list)):
+        return body
+
+    projected = {}
+    for path in paths:
+        keys = path.split('.')
+        try:
+            value = _lookup(body, keys)
+        except KeyError:
+            continue
+
+        target = projected
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = value
+    return projected
+
+
+def _gzip(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def _text(value):
+    """
+    Decode native strings, e.g. header names and values, to unicode,
+    so MessagePack packs them as strings instead of binary data
+    """
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return value
+    if isinstance(value, dict):
+        return dict((_text(key), _text(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_text(item) for item in value]
+    return value
+
+
+def encode_message(message, encoding):
+    """
+    Encode the message for publishing. JSON messages are returned as they
+    are, other encodings are base64-encoded and wrapped in an envelope
+    declaring the encoding, since the MQTT helper publishes JSON.
+    Return the message and the encoding actually used, which falls back
+    to JSON if MessagePack is not installed. The fallback is declared by
+    the `encoding` field added to the message.
+    """
+    if encoding == MSGPACK and msgpack is None:
+        return dict(message, encoding=JSON), JSON
+    if encoding not in ENCODINGS or encoding == JSON:
+        return message, JSON
+
+    if encoding == MSGPACK:
+        data = msgpack.packb(_text(message), use_bin_type=True)
+    else:
+        data = json.dumps(message, separators=(',', ':')).encode('utf-8')
+        data = zlib.compress(data) if encoding == ZLIB else _gzip(data)
+
+    envelope = {
+        'encoding': encoding,
+        'data': base64.b64encode(data).decode('ascii'),
+    }
+    for key in ('uid', 'timestamp'):
+        if key in message:
+            envelope[key] = message[key]
+    return envelope, encoding
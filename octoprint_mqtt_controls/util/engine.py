@@ -0,0 +1,322 @@
+from __future__ import absolute_import
+
+import sys
+from collections import deque
+from Queue import Queue
+from threading import Event, Lock, Thread
+
+from tornado import gen, stack_context
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPError
+from tornado.ioloop import IOLoop
+from tornado.simple_httpclient import _HTTPConnection, SimpleAsyncHTTPClient
+
+DEFAULT_WORKERS = 2
+
+DEFAULT_MAX_PENDING_BYTES = 16 * 1024 * 1024
+
+
+class Cancellation(object):
+    """
+    Cancels a request fetched by `AsyncEngine.fetch`: the request fails
+    with `HTTPError` 599 and its connection is closed. A request cancelled
+    before it is connected fails as soon as it connects.
+
+    Attributes:
+        reason - why the request has been cancelled, None if it has not
+    """
+
+    def __init__(self):
+        self.reason = None
+        self._callback = None
+
+    def cancel(self, reason):
+        """Cancel the request, must be called on the engine's event loop"""
+        if self.reason is not None:
+            return
+        self.reason = reason
+        if self._callback is not None:
+            self._callback(reason)
+
+    def bind(self, callback):
+        """Set function failing the connected request with the reason"""
+        self._callback = callback
+        if self.reason is not None:
+            callback(self.reason)
+
+
+class _CancellableConnection(_HTTPConnection):
+    def _on_connect(self, stream):
+        cancellation = getattr(self.request.request, 'cancellation', None)
+        if cancellation is not None:
+            if cancellation.reason is not None:
+                stream.close()
+                raise HTTPError(599, cancellation.reason)
+            # Raised in the connection's context, so it fails the request
+            # and closes the stream. Bound before the response is read,
+            # it may be read while connecting, and raised outside
+            # of callbacks reading it.
+            cancel = stack_context.wrap(self._cancel)
+            cancellation.bind(
+                lambda reason: self.io_loop.add_callback(cancel, reason))
+        super(_CancellableConnection, self)._on_connect(stream)
+
+    def _cancel(self, reason):
+        if self.final_callback is not None:
+            raise HTTPError(599, reason)
+
+
+class _HTTPClient(SimpleAsyncHTTPClient):
+    def _connection_class(self):
+        return _CancellableConnection
+
+
+class AsyncEngine(object):
+    """
+    Tornado event loop running in a single background thread, used for
+    non-blocking HTTP requests of commands and downloads, so their number
+    does not affect the number of threads
+
+    Attributes:
+        io_loop - the event loop
+        http_client - `AsyncHTTPClient` bound to the event loop
+        max_clients - maximum number of simultaneous HTTP requests, further
+                      requests wait in the client's queue
+    """
+
+    def __init__(self, max_clients, logger, workers=DEFAULT_WORKERS,
+                 max_pending_bytes=DEFAULT_MAX_PENDING_BYTES):
+        """
+        Create an AsyncEngine and start its event loop
+
+        :param max_clients: maximum number of simultaneous HTTP requests
+        :param logger: logger used for reporting failed coroutines
+        :param workers: number of threads of the `worker_pool`
+        :param max_pending_bytes: number of bytes held by operations
+                                  waiting in the `worker_pool`
+        """
+        self.max_clients = max_clients
+        self.io_loop = None
+        self.http_client = None
+        self.worker_pool = None
+
+        self._logger = logger
+        self._started = Event()
+        self._thread = Thread(target=self._run, name='mqtt-controls-engine')
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait()
+        self.worker_pool = WorkerPool(
+            workers, max_pending_bytes, self.io_loop, logger)
+
+    def _run(self):
+        self.io_loop = IOLoop(make_current=True)
+        self.http_client = _HTTPClient(
+            force_instance=True,
+            max_clients=self.max_clients,
+            max_body_size=sys.maxsize
+        )
+        self._started.set()
+        try:
+            self.io_loop.start()
+        finally:
+            self.http_client.close()
+            self.io_loop.close(all_fds=True)
+
+    @gen.coroutine
+    def _call(self, func, args, kwargs):
+        try:
+            yield func(*args, **kwargs)
+        except Exception:
+            self._logger.exception('Coroutine %r failed' % func)
+
+    def fetch(self, request, cancellation=None):
+        """
+        Fetch the request with the `http_client`, it may be cancelled
+        by `cancellation`. Must be called on the event loop.
+        """
+        request.cancellation = cancellation
+        return self.http_client.fetch(request)
+
+    def spawn(self, func, *args, **kwargs):
+        """
+        Run coroutine function `func` with given arguments on the event
+        loop. Safe to call from any thread.
+        """
+        self.io_loop.add_callback(self._call, func, args, kwargs)
+
+    def stop(self, timeout=None):
+        """Stop the event loop, abandoning running coroutines"""
+        self.io_loop.add_callback(self.io_loop.stop)
+        self._thread.join(timeout)
+        self.worker_pool.stop(timeout)
+
+
+class WorkerStream(object):
+    """
+    Operations submitted to a `WorkerPool`, performed one at a time
+    in the order they were submitted
+
+    Attributes:
+        error - exception of the first failed operation, following
+                operations are skipped
+    """
+
+    def __init__(self, pool):
+        self.error = None
+
+        self._pool = pool
+        self._operations = deque()
+        self._scheduled = False
+
+    @property
+    def full(self):
+        """Whether the pool's budget of pending bytes is used up"""
+        return self._pool.pending_bytes >= self._pool.max_pending_bytes
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue the operation without waiting, it is skipped if a previous
+        one failed. `size` is the number of bytes the operation holds.
+        """
+        self._pool.submit(
+            self, (func, args, None, False, kwargs.get('size', 0)))
+
+    def call(self, func, *args, **kwargs):
+        """
+        Queue the operation and return a future of its result, failed with
+        `error` if a previous operation failed, unless `always` is set
+        """
+        future = Future()
+        self._pool.submit(
+            self, (func, args, future, kwargs.get('always', False), 0))
+        return future
+
+    def drained(self):
+        """
+        Return a future resolved once operations of the stream are done
+        and the pool's pending bytes dropped to half of its budget
+        """
+        future = Future()
+        self._pool.wait_drained(self, future)
+        return future
+
+
+class WorkerPool(object):
+    """
+    Constant number of threads performing blocking operations, e.g. disk
+    writes, of coroutines on the event loop. Operations of each
+    `WorkerStream` are performed in order, streams share the threads.
+    Submitting never blocks the event loop: streams check whether
+    the budget of pending bytes is used up and pause themselves.
+
+    Attributes:
+        max_pending_bytes - number of bytes held by pending operations
+                            above which streams are `full`
+    """
+
+    def __init__(self, size, max_pending_bytes, io_loop, logger):
+        """
+        Create a WorkerPool and start its threads
+
+        :param size: number of threads
+        :param max_pending_bytes: budget of bytes held by pending operations
+        :param io_loop: event loop futures of operations are resolved on
+        :param logger: logger used for reporting failed operations
+        """
+        self.max_pending_bytes = max_pending_bytes
+        self.pending_bytes = 0
+
+        self._io_loop = io_loop
+        self._logger = logger
+        self._lock = Lock()
+        self._ready = Queue()
+        self._waiting = []
+        self._threads = []
+        for number in range(size):
+            thread = Thread(
+                target=self._work,
+                name='mqtt-controls-file-worker-%d' % number
+            )
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stream(self):
+        """Return a new stream of operations performed in order"""
+        return WorkerStream(self)
+
+    def submit(self, stream, operation):
+        with self._lock:
+            stream._operations.append(operation)
+            self.pending_bytes += operation[4]
+            if stream._scheduled:
+                return
+            stream._scheduled = True
+        self._ready.put(stream)
+
+    def wait_drained(self, stream, future):
+        with self._lock:
+            self._waiting.append((stream, future))
+            self._notify_drained()
+
+    def _notify_drained(self):
+        if self.pending_bytes > self.max_pending_bytes // 2:
+            return
+        waiting = []
+        for stream, future in self._waiting:
+            if stream._operations or stream._scheduled:
+                waiting.append((stream, future))
+            else:
+                self._io_loop.add_callback(future.set_result, None)
+        self._waiting = waiting
+
+    def stop(self, timeout=None):
+        """Stop the threads after operations already submitted"""
+        for _ in self._threads:
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _resolve(self, future, result=None, error=None):
+        if future is None:
+            return
+        if error is not None:
+            self._io_loop.add_callback(future.set_exception, error)
+        else:
+            self._io_loop.add_callback(future.set_result, result)
+
+    def _perform(self, stream, operation):
+        func, args, future, always, _ = operation
+        if stream.error is not None and not always:
+            self._resolve(future, error=stream.error)
+            return
+        try:
+            result = func(*args)
+        except Exception as e:
+            if stream.error is None:
+                stream.error = e
+            if future is None:
+                self._logger.debug('Operation %r failed: %s' % (func, e))
+            self._resolve(future, error=e)
+        else:
+            self._resolve(future, result)
+
+    def _work(self):
+        while True:
+            stream = self._ready.get()
+            if stream is None:
+                return
+
+            with self._lock:
+                operation = stream._operations.popleft()
+            self._perform(stream, operation)
+
+            with self._lock:
+                self.pending_bytes -= operation[4]
+                requeue = bool(stream._operations)
+                stream._scheduled = requeue
+                self._notify_drained()
+            if requeue:
+                # Other streams get a turn before the next operation
+                self._ready.put(stream)
@@ -0,0 +1,41 @@
+from __future__ import absolute_import
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_TIMEOUT = (10, 60)
+
+
+class PooledSession(requests.Session):
+    """
+    Session keeping alive connections in per-host pools and applying
+    default timeouts to requests which do not specify one. Safe to share
+    between threads.
+
+    Attributes:
+        timeout - default timeout of requests, seconds or a tuple of
+                  connect and read timeouts
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10,
+                 timeout=DEFAULT_TIMEOUT):
+        """
+        Create a PooledSession
+
+        :param pool_connections: number of hosts whose connections are kept
+        :param pool_maxsize: number of connections kept for each host
+        :param timeout: default timeout of requests
+        """
+        super(PooledSession, self).__init__()
+        self.timeout = timeout
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize
+        )
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super(PooledSession, self).request(method, url, **kwargs)
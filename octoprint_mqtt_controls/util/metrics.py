@@ -0,0 +1,163 @@
+from __future__ import absolute_import
+
+import time
+from collections import deque
+from threading import Lock
+
+from octoprint.util import RepeatedTimer
+
+PERCENTILES = (50, 95, 99)
+
+
+class Counter(object):
+    """Monotonically increasing value"""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram(object):
+    """
+    Distribution of observed values. Percentiles are calculated
+    from the most recent `reservoir_size` observations.
+    """
+
+    def __init__(self, reservoir_size=1024):
+        self.count = 0
+        self.total = 0.0
+        self._samples = deque(maxlen=reservoir_size)
+        self._lock = Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self._samples.append(value)
+
+    def summary(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self.count, self.total
+
+        summary = {
+            'count': count,
+            'mean': total / count if count else None,
+            'max': samples[-1] if samples else None,
+        }
+        for percentile in PERCENTILES:
+            summary['p%d' % percentile] = samples[
+                min(len(samples) - 1, len(samples) * percentile // 100)
+            ] if samples else None
+        return summary
+
+
+class _NullMetric(object):
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+_NULL_METRIC = _NullMetric()
+
+
+class MetricsRegistry(object):
+    """
+    Named counters, gauges and histograms. A disabled registry hands out
+    instruments which ignore all values.
+
+    Attributes:
+        enabled - whether values are recorded
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
+        self._lock = Lock()
+        self._counters = dict()
+        self._histograms = dict()
+        self._gauges = dict()
+
+    def _get(self, metrics, name, factory):
+        if not self.enabled:
+            return _NULL_METRIC
+        metric = metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = metrics.setdefault(name, factory())
+        return metric
+
+    def counter(self, name):
+        return self._get(self._counters, name, Counter)
+
+    def histogram(self, name):
+        return self._get(self._histograms, name, Histogram)
+
+    def gauge(self, name, func):
+        """Register function returning current value of the gauge"""
+        if self.enabled:
+            with self._lock:
+                self._gauges[name] = func
+
+    def snapshot(self):
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = list(self._histograms.items())
+            gauges = list(self._gauges.items())
+
+        return {
+            'counters': dict(
+                (name, counter.value) for name, counter in counters),
+            'gauges': dict((name, func()) for name, func in gauges),
+            'histograms': dict(
+                (name, histogram.summary()) for name, histogram in histograms
+            ),
+        }
+
+
+class MetricsPublisher(object):
+    """
+    Periodically publishes snapshot of the registry, adding per second
+    rate of each counter since the previous snapshot
+    """
+
+    def __init__(self, registry, interval, publish_func, clock=time.time):
+        self.registry = registry
+        self.interval = interval
+
+        self._publish_func = publish_func
+        self._clock = clock
+        self._previous_counters = dict()
+        self._previous_time = clock()
+        self._timer = None
+
+    def snapshot(self):
+        now = self._clock()
+        snapshot = self.registry.snapshot()
+        elapsed = float(now - self._previous_time)
+        snapshot['rates'] = dict(
+            (name, (value - self._previous_counters.get(name, 0)) / elapsed)
+            for name, value in snapshot['counters'].items()
+        ) if elapsed > 0 else {}
+        snapshot['timestamp'] = now
+
+        self._previous_counters = snapshot['counters']
+        self._previous_time = now
+        return snapshot
+
+    def publish(self):
+        self._publish_func(self.snapshot())
+
+    def start(self):
+        self._timer = RepeatedTimer(self.interval, self.publish, daemon=True)
+        self._timer.start()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
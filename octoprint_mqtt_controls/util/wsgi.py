@@ -0,0 +1,122 @@
+from __future__ import absolute_import
+
+import io
+import re
+from urlparse import urlsplit
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.response import HTTPResponse
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+LOCAL_ADDRESS = '127.0.0.1'
+
+# Path prefixes served by OctoPrint's Flask application, other paths such
+# as `/downloads/` are served by Tornado handlers
+FLASK_PREFIXES = ('/api/',)
+
+# Methods and paths under `FLASK_PREFIXES` served by Tornado handlers,
+# e.g. multipart uploads streamed to the disk before Flask gets them
+TORNADO_ROUTES = (
+    (None, re.compile(r'/api/logs(/|$)')),
+    ('POST', re.compile(r'/api/files/[^/]*/?$')),
+)
+
+
+def is_served_by_tornado(method, path):
+    """Whether OctoPrint serves the request outside of its Flask app"""
+    return any(
+        (route_method is None or route_method == method)
+        and pattern.match(path)
+        for route_method, pattern in TORNADO_ROUTES
+    )
+
+
+def get_octoprint_app():
+    """Get OctoPrint's Flask application or None if it is not available"""
+    try:
+        from octoprint.server import app
+    except ImportError:
+        return None
+    return app
+
+
+class _WSGIBody(io.RawIOBase):
+    """File-like object reading WSGI application's response iterable"""
+
+    def __init__(self, app_iter):
+        super(_WSGIBody, self).__init__()
+        self._app_iter = app_iter
+        self._chunks = iter(app_iter)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        if not self.closed and hasattr(self._app_iter, 'close'):
+            self._app_iter.close()
+        super(_WSGIBody, self).close()
+
+
+class WSGIAdapter(HTTPAdapter):
+    """
+    Transport adapter for `requests` passing requests directly to
+    a WSGI application running in the same process, so no TCP connection
+    and HTTP parsing is involved. Requests served by OctoPrint's Tornado
+    handlers, and all requests when the application is not available,
+    are sent over HTTP.
+
+    Attributes:
+        app - WSGI application requests are dispatched to
+    """
+
+    def __init__(self, app, *args, **kwargs):
+        super(WSGIAdapter, self).__init__(*args, **kwargs)
+        self.app = app
+
+    def _environ(self, request):
+        url = urlsplit(request.url)
+        body = request.body or b''
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+
+        return EnvironBuilder(
+            path=url.path,
+            base_url='{}://{}'.format(url.scheme, url.netloc),
+            query_string=url.query,
+            method=request.method,
+            headers=dict(request.headers),
+            data=body,
+            environ_base={'REMOTE_ADDR': LOCAL_ADDRESS},
+        ).get_environ()
+
+    def send(self, request, **kwargs):
+        if self.app is None or is_served_by_tornado(
+            request.method, urlsplit(request.url).path
+        ):
+            return super(WSGIAdapter, self).send(request, **kwargs)
+
+        app_iter, status, headers = run_wsgi_app(
+            self.app, self._environ(request))
+        status_code, _, reason = status.partition(' ')
+        raw = HTTPResponse(
+            body=_WSGIBody(app_iter),
+            headers=list(headers),
+            status=int(status_code),
+            reason=reason,
+            preload_content=False,
+            decode_content=False,
+        )
+        return self.build_response(request, raw)
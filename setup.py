@@ -43,7 +43,13 @@ plugin_requires = [
 extras_require = {
     'dev': [
         'pytest==4.0.2',
-    ]
+    ],
+    'msgpack': [
+        'msgpack>=0.6.2,<1.0',
+    ],
+    'zstd': [
+        'zstandard>=0.11,<0.14',
+    ],
 }
 
 ### --------------------------------------------------------------------------------------------------------------------
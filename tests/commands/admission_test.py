@@ -0,0 +1,69 @@
+from __future__ import absolute_import
+
+import pytest
+
+from octoprint_mqtt_controls.commands.admission import (
+    REASON_CLIENT_RATE, REASON_COMMAND, REASON_IN_FLIGHT, AdmissionController
+)
+from octoprint_mqtt_controls.commands.exceptions import CommandRejected
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_in_flight_commands_are_limited():
+    controller = AdmissionController(max_in_flight=2, retry_after=3)
+    controller.admit('mqtt-rest-api/')
+    controller.admit('download-file/command')
+
+    with pytest.raises(CommandRejected) as e:
+        controller.admit('mqtt-rest-api/')
+    assert e.value.reason == REASON_IN_FLIGHT
+    assert e.value.retry_after == 3
+
+    controller.release('mqtt-rest-api/')
+    controller.admit('mqtt-rest-api/')
+
+
+def test_commands_are_limited_by_type():
+    controller = AdmissionController(
+        command_limits={'download-file/command': 1})
+    controller.admit('download-file/command')
+    controller.admit('mqtt-rest-api/')
+
+    with pytest.raises(CommandRejected) as e:
+        controller.admit('download-file/command')
+    assert e.value.reason == REASON_COMMAND
+
+
+def test_client_rate_is_limited():
+    clock = FakeClock()
+    controller = AdmissionController(
+        client_rate=2, client_burst=2, clock=clock)
+    controller.admit('mqtt-rest-api/', 'dashboard')
+    controller.admit('mqtt-rest-api/', 'dashboard')
+
+    with pytest.raises(CommandRejected) as e:
+        controller.admit('mqtt-rest-api/', 'dashboard')
+    assert e.value.reason == REASON_CLIENT_RATE
+    assert e.value.retry_after == 0.5
+
+    controller.admit('mqtt-rest-api/', 'other')
+    clock.now = 0.5
+    controller.admit('mqtt-rest-api/', 'dashboard')
+
+
+def test_rejected_commands_are_not_counted():
+    controller = AdmissionController(max_in_flight=1)
+    controller.admit('mqtt-rest-api/')
+    with pytest.raises(CommandRejected):
+        controller.admit('mqtt-rest-api/')
+
+    assert controller.stats() == {
+        'in_flight': 1, 'commands': {'mqtt-rest-api/': 1}
+    }
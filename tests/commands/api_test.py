@@ -0,0 +1,251 @@
+from __future__ import absolute_import
+
+import hashlib
+import threading
+from base64 import b64encode
+
+import pytest
+from mock import Mock, patch
+
+from octoprint_mqtt_controls.commands.api import (
+    APIRequestCommand, APIResponse
+)
+from octoprint_mqtt_controls.util.metrics import MetricsRegistry
+
+SETTINGS = {
+    ('http', 'pool_connections'): 2,
+    ('http', 'pool_maxsize'): 4,
+    ('http', 'connect_timeout'): 1,
+    ('http', 'read_timeout'): 1,
+    ('api', 'dispatch'): 'http',
+    ('api', 'cache', 'enabled'): False,
+    ('api', 'batch_concurrency'): 2,
+    ('api', 'batch_max_size'): 3,
+}
+
+
+class FakeSettings(object):
+    def __init__(self, **overrides):
+        self.values = dict(SETTINGS)
+        for name, value in overrides.items():
+            self.values[tuple(name.split('__'))] = value
+
+    def get(self, path):
+        return self.values[tuple(path)]
+
+    get_int = get_float = get_boolean = get
+
+
+def _plugin(metrics=None, **settings):
+    plugin = Mock()
+    plugin.base_topic = 'printer/'
+    plugin._settings = FakeSettings(**settings)
+    plugin.idempotency_store = None
+    plugin.publish_queue = None
+    plugin.metrics = metrics or MetricsRegistry(enabled=False)
+    return plugin
+
+
+def _command(plugin):
+    with patch('octoprint_mqtt_controls.commands.api.settings'):
+        return APIRequestCommand(plugin)
+
+
+@pytest.fixture
+def command():
+    command = _command(_plugin())
+    threads = []
+
+    def request(method, endpoint, data):
+        threads.append(threading.current_thread())
+        if endpoint == '/api/broken':
+            raise IOError('Connection refused')
+        return APIResponse(200, {}, {'endpoint': endpoint})
+
+    command._request = Mock(side_effect=request)
+    command.threads = threads
+    yield command
+    command.on_shutdown()
+
+
+def _responses(command):
+    message = command.plugin_instance.mqtt_publish.call_args[0][1]
+    return message['responses']
+
+
+def _batch(mode, *endpoints):
+    return {
+        'uid': 1,
+        'timestamp': 0,
+        'mode': mode,
+        'requests': [{'endpoint': endpoint} for endpoint in endpoints],
+    }
+
+
+def test_sequential_batch_is_performed_in_order(command):
+    command.execute(
+        'topic', _batch('sequential', '/api/job', '/api/printer'))
+
+    assert [r['body']['endpoint'] for r in _responses(command)] == [
+        '/api/job', '/api/printer'
+    ]
+    assert command.threads == [threading.current_thread()] * 2
+
+
+def test_parallel_batch_is_performed_by_pool(command):
+    command.execute(
+        'topic', _batch('parallel', '/api/job', '/api/printer'))
+
+    assert [r['body']['endpoint'] for r in _responses(command)] == [
+        '/api/job', '/api/printer'
+    ]
+    assert threading.current_thread() not in command.threads
+
+
+@pytest.mark.parametrize('mode', ['sequential', 'parallel'])
+def test_failed_batch_items_are_reported_with_others(command, mode):
+    payload = _batch(mode, '/api/broken', '/api/job')
+    payload['requests'].append('/api/printer')
+
+    command.execute('topic', payload)
+
+    broken, job, invalid = _responses(command)
+    assert broken == {
+        'request': {'endpoint': '/api/broken'},
+        'error': 'Connection refused',
+    }
+    assert job['status_code'] == 200
+    assert invalid == {
+        'request': '/api/printer',
+        'error': 'Invalid request format',
+    }
+
+
+def test_oversized_batch_is_rejected(command):
+    command.execute('topic', _batch(
+        'sequential', '/api/job', '/api/printer', '/api/files',
+        '/api/connection'
+    ))
+
+    command._request.assert_not_called()
+    command.plugin_instance.mqtt_publish.assert_not_called()
+
+
+def test_response_cache_hits_and_misses_are_measured():
+    metrics = MetricsRegistry()
+    command = _command(_plugin(
+        metrics,
+        api__cache__enabled=True,
+        api__cache__max_size=8,
+        api__cache__ttl={'/api/job': 10}
+    ))
+    command._request = Mock(return_value=APIResponse(200, {}, {}))
+    payload = {'uid': 1, 'timestamp': 0, 'endpoint': '/api/job'}
+
+    command.execute('topic', payload)
+    command.execute('topic', payload)
+    command.on_shutdown()
+
+    gauges = metrics.snapshot()['gauges']
+    assert gauges['api.cache.hits'] == 1
+    assert gauges['api.cache.misses'] == 1
+
+
+def test_changing_requests_are_ordered_per_client(command):
+    def payload(client_id, method):
+        return {'uid': 1, 'timestamp': 0, 'client_id': client_id,
+                'endpoint': '/api/job', 'method': method}
+
+    assert command.ordering_key(payload('a', 'POST')) == \
+        command.ordering_key(payload('a', 'DELETE'))
+    assert command.ordering_key(payload('a', 'POST')) != \
+        command.ordering_key(payload('b', 'POST'))
+    assert command.ordering_key(payload('a', 'GET')) == \
+        'mqtt-rest-api/:1'
+
+
+class FakeStreamedResponse(object):
+    def __init__(self, chunks, failure=None):
+        self.status_code = 200
+        self.headers = {
+            'Content-Type': 'text/plain',
+            'Content-Length': str(sum(len(chunk) for chunk in chunks)),
+        }
+        self.chunks = chunks
+        self.failure = failure
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            yield chunk
+        if self.failure is not None:
+            raise self.failure
+
+    def close(self):
+        self.closed = True
+
+
+def _stream(response):
+    """Stream the response, return the published messages"""
+    command = _command(_plugin(api__stream_chunk_size=4))
+    command.api_session = Mock()
+    command.api_session.request.return_value = response
+
+    with patch(
+        'octoprint_mqtt_controls.commands.api.get_endpoint_url',
+        side_effect=lambda endpoint: 'http://localhost' + endpoint
+    ):
+        command.execute('topic', {
+            'uid': 1, 'timestamp': 0,
+            'endpoint': '/api/files/local/model.gcode',
+            'stream': True, 'headers': False,
+        })
+    command.on_shutdown()
+    return [
+        call[0][1]
+        for call in command.plugin_instance.mqtt_publish.call_args_list
+    ]
+
+
+def test_streamed_response_is_published_in_chunks():
+    response = FakeStreamedResponse([b'G28\n', b'G1 X', b'1\n'])
+
+    header, first, second, third, end = _stream(response)
+
+    assert header['stream'] == 'header'
+    assert header['status_code'] == 200
+    assert header['content_length'] == 10
+    assert header['chunk_size'] == 4
+    assert [
+        (chunk['stream'], chunk['seq'], chunk['data'])
+        for chunk in (first, second, third)
+    ] == [
+        ('chunk', 0, b64encode(b'G28\n')),
+        ('chunk', 1, b64encode(b'G1 X')),
+        ('chunk', 2, b64encode(b'1\n')),
+    ]
+    assert end == {
+        'uid': 1,
+        'timestamp': 0,
+        'stream': 'end',
+        'chunks': 3,
+        'total_size': 10,
+        'md5': hashlib.md5(b'G28\nG1 X1\n').hexdigest(),
+    }
+    assert response.closed
+
+
+def test_failed_stream_is_ended_with_error():
+    response = FakeStreamedResponse(
+        [b'G28\n'], failure=IOError('Connection reset'))
+
+    header, chunk, error = _stream(response)
+
+    assert chunk['seq'] == 0
+    assert error == {
+        'uid': 1,
+        'timestamp': 0,
+        'stream': 'error',
+        'reason': 'Connection reset',
+    }
+    assert response.closed
@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+
+import json
+
+import pytest
+from mock import Mock
+
+from octoprint_mqtt_controls.commands.base import CommandBase
+from octoprint_mqtt_controls.commands.idempotency import IdempotencyStore
+from octoprint_mqtt_controls.util.metrics import MetricsRegistry
+
+
+class InlineExecutor(object):
+    def submit_ordered(self, ordering_key, name, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+
+class FakeCommand(CommandBase):
+    subtopic = 'fake/command'
+    report_subtopic = 'fake/report'
+
+    def __init__(self, *args, **kwargs):
+        super(FakeCommand, self).__init__(*args, **kwargs)
+        self.executed = Mock()
+
+    def execute(self, topic, payload, *args, **kwargs):
+        self.executed(payload)
+
+
+def _plugin():
+    plugin = Mock()
+    plugin.base_topic = 'printer/'
+    plugin.idempotency_store = IdempotencyStore(8, 600)
+    plugin.admission_controller = None
+    plugin.engine = None
+    plugin.publish_queue = None
+    plugin.metrics = MetricsRegistry(enabled=False)
+    plugin.command_executor = InlineExecutor()
+    return plugin
+
+
+def _message(uid):
+    return json.dumps({'uid': uid, 'timestamp': 0})
+
+
+def test_failed_command_is_executed_again_when_redelivered():
+    command = FakeCommand(_plugin())
+    command.executed.side_effect = [IOError(), None]
+
+    with pytest.raises(IOError):
+        command('printer/fake/command', _message(1))
+    command('printer/fake/command', _message(1))
+
+    assert command.executed.call_count == 2
+
+
+def test_unanswered_command_is_executed_again_when_redelivered():
+    command = FakeCommand(_plugin())
+
+    command('printer/fake/command', _message(1))
+    command('printer/fake/command', _message(1))
+
+    assert command.executed.call_count == 2
+
+
+def test_answered_command_is_dropped_when_redelivered():
+    plugin = _plugin()
+    command = FakeCommand(plugin)
+    command.executed.side_effect = \
+        lambda payload: command.report({'uid': payload['uid'], 'ok': True})
+
+    command('printer/fake/command', _message(1))
+    command('printer/fake/command', _message(1))
+
+    command.executed.assert_called_once()
+    assert plugin.mqtt_publish.call_count == 2
+    plugin.mqtt_publish.assert_called_with(
+        'printer/fake/report', {'uid': 1, 'ok': True})
+
+
+def test_later_responses_are_recorded_under_given_key():
+    plugin = _plugin()
+    command = FakeCommand(plugin)
+    command.reports_later = True
+
+    command('printer/fake/command', _message(1))
+    command.report({'uid': 1, 'progress': 'success'}, 'fake/command:1')
+
+    assert plugin.idempotency_store.claim('fake/command:1') == (
+        False, {'uid': 1, 'progress': 'success'})
@@ -0,0 +1,195 @@
+from __future__ import absolute_import
+
+import hashlib
+import os
+import re
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from mock import Mock, patch
+
+from octoprint_mqtt_controls.commands.download_file.async_download import (
+    AsyncDownload
+)
+from octoprint_mqtt_controls.commands.download_file.partial import (
+    PartialDownload
+)
+from octoprint_mqtt_controls.util.engine import AsyncEngine
+
+CONTENT = b'G1 X1\n' * 4096
+
+
+STALLED = threading.Event()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    ranges = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        start = int(match.group(1)) if match else 0
+        _Handler.ranges.append(start)
+        if start:
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+                start, len(CONTENT) - 1, len(CONTENT)))
+        else:
+            self.send_response(404 if self.path == '/missing' else 200)
+        self.send_header('Content-Length', str(len(CONTENT) - start))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        if self.path == '/interrupted':
+            # Connection closes before the whole file is sent
+            self.wfile.write(CONTENT[:len(CONTENT) // 2])
+        elif self.path == '/stalled':
+            self.wfile.write(CONTENT[:1024])
+            self.wfile.flush()
+            STALLED.wait(10)
+        else:
+            for offset in range(start, len(CONTENT), 4096):
+                self.wfile.write(CONTENT[offset:offset + 4096])
+                if self.path == '/throttled':
+                    self.wfile.flush()
+                    time.sleep(0.002)
+
+
+@pytest.fixture
+def server():
+    _Handler.ranges = []
+    STALLED.clear()
+    http_server = HTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=http_server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:%d' % http_server.server_address[1]
+    STALLED.set()
+    http_server.shutdown()
+    http_server.server_close()
+
+
+@pytest.fixture
+def engine():
+    engine = AsyncEngine(4, Mock())
+    yield engine
+    engine.stop(5)
+
+
+@pytest.fixture(autouse=True)
+def partial_location(tmpdir):
+    location = str(tmpdir.mkdir('partial'))
+    with patch(
+        'octoprint_mqtt_controls.commands.download_file.partial'
+        '.partial_location',
+        return_value=location
+    ):
+        yield location
+
+
+def _download(engine, url, md5=None, read_timeout=5, wait=True):
+    finished = threading.Event()
+    threads = set()
+    file_manager = Mock()
+
+    def add_file(destination, path, file_object, **kwargs):
+        threads.add(threading.current_thread().name)
+        return path
+
+    file_manager.add_file.side_effect = add_file
+    file_manager.path_on_disk.side_effect = \
+        lambda destination, path: '/uploads/' + path
+    printer = Mock()
+    printer.is_ready.return_value = True
+    reports = []
+
+    download = AsyncDownload(
+        'uid', 0, url, 'model.gcode', md5, reports.append, file_manager,
+        printer, session=Mock(timeout=(5, read_timeout)), engine=engine
+    )
+    download.finished = finished
+    download.finished_callback = lambda _: finished.set()
+    download.start()
+    if wait:
+        finished.wait(10)
+    return download, reports, threads
+
+
+def test_file_is_stored_outside_of_event_loop(engine, server):
+    download, reports, threads = _download(
+        engine, server + '/model.gcode', hashlib.md5(CONTENT).hexdigest())
+
+    assert reports[-1]['progress'] == 'success'
+    assert len(threads) == 1
+    assert threads.pop().startswith('mqtt-controls-file-worker-')
+    download._printer.select_file.assert_called_once_with(
+        '/uploads/model.gcode', False, printAfterSelect=True)
+
+
+def test_interrupted_download_is_kept_for_resuming(engine, server):
+    url = server + '/interrupted'
+    _, reports, _ = _download(engine, url)
+
+    assert reports[-1]['progress'] == 'error'
+    state, offset = PartialDownload('uid', url).resumable_state()
+    assert state['etag'] == '"v1"'
+    assert offset == len(CONTENT) // 2
+
+
+def test_refused_download_is_discarded(engine, server):
+    url = server + '/missing'
+    partial = PartialDownload('uid', url)
+    with open(partial.file_path, 'w') as f:
+        f.write('G28\n')
+    partial.save_state(etag='"v0"')
+
+    _, reports, _ = _download(engine, url)
+
+    assert reports[-1]['progress'] == 'error'
+    assert not os.path.exists(partial.file_path)
+
+
+def test_download_pauses_while_received_data_is_written(server):
+    write_received = AsyncDownload._write_received
+
+    def slow_write(download, chunk):
+        # Disk slower than the network
+        time.sleep(0.01)
+        write_received(download, chunk)
+
+    engine = AsyncEngine(4, Mock(), workers=1, max_pending_bytes=4096)
+    try:
+        with patch.object(AsyncDownload, '_write_received', slow_write):
+            download, reports, _ = _download(
+                engine, server + '/throttled',
+                hashlib.md5(CONTENT).hexdigest())
+    finally:
+        engine.stop(5)
+
+    assert reports[-1]['progress'] == 'success'
+    assert len(_Handler.ranges) > 1
+    assert _Handler.ranges == sorted(_Handler.ranges)
+    download._file_manager.add_file.assert_called_once()
+
+
+def test_stop_cancels_stalled_download(engine, server):
+    download, reports, _ = _download(
+        engine, server + '/stalled', wait=False)
+    time.sleep(0.5)
+
+    download.schedule_to_stop()
+
+    assert download.finished.wait(5)
+    assert reports[-1]['progress'] == 'stopped'
+
+
+def test_stalled_download_times_out(engine, server):
+    started_at = time.time()
+    _, reports, _ = _download(engine, server + '/stalled', read_timeout=0.5)
+
+    assert time.time() - started_at < 5
+    assert reports[-1]['progress'] == 'error'
+    assert 'Timeout' in reports[-1]['reason']
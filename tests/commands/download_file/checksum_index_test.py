@@ -0,0 +1,141 @@
+from __future__ import absolute_import
+
+import json
+import os
+
+from mock import Mock
+
+from octoprint_mqtt_controls.commands.download_file.checksum_index import (
+    ChecksumIndex
+)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+def _index(tmpdir, max_size=0, selected=None):
+    storage = tmpdir.mkdir('uploads')
+    file_manager = Mock()
+    file_manager.path_on_disk.side_effect = \
+        lambda destination, path: os.path.join(str(storage), path)
+    file_manager.remove_file.side_effect = \
+        lambda destination, path: storage.join(path).remove()
+
+    printer = Mock()
+    printer.get_current_job.return_value = {
+        'file': {'origin': 'local', 'path': selected}
+    }
+
+    index = ChecksumIndex(
+        str(tmpdir.join('index.json')), max_size, file_manager, printer,
+        Mock(), clock=FakeClock()
+    )
+    return index, storage
+
+
+def test_indexed_file_is_found_by_checksum(tmpdir):
+    index, storage = _index(tmpdir)
+    storage.join('part.gcode').write('G28\n')
+
+    index.add('ABC', 'part.gcode')
+
+    assert index.lookup('abc') == 'part.gcode'
+    assert index.lookup('def') is None
+
+
+def test_changed_or_removed_files_are_not_found(tmpdir):
+    index, storage = _index(tmpdir)
+    storage.join('changed.gcode').write('G28\n')
+    storage.join('removed.gcode').write('G28\n')
+    index.add('changed', 'changed.gcode')
+    index.add('removed', 'removed.gcode')
+
+    storage.join('changed.gcode').write('G28\nG1 X1\n')
+    index.remove_path('removed.gcode')
+
+    assert index.lookup('changed') is None
+    assert index.lookup('removed') is None
+
+
+def test_index_is_persisted(tmpdir):
+    index, storage = _index(tmpdir)
+    storage.join('part.gcode').write('G28\n')
+    index.add('abc', 'part.gcode')
+
+    restored = ChecksumIndex(
+        index.path, 0, index._file_manager, index._printer, Mock())
+    restored.load()
+
+    assert restored.lookup('abc') == 'part.gcode'
+
+
+def test_least_recently_used_unselected_files_are_evicted(tmpdir):
+    index, storage = _index(tmpdir, max_size=12, selected='selected.gcode')
+    for name in ('selected', 'old', 'recent', 'new'):
+        storage.join(name + '.gcode').write('G28\n')
+
+    index.add('selected', 'selected.gcode')
+    index.add('old', 'old.gcode')
+    index.add('recent', 'recent.gcode')
+    index.lookup('old')
+    index.add('new', 'new.gcode')
+
+    assert sorted(os.listdir(str(storage))) == [
+        'new.gcode', 'old.gcode', 'selected.gcode'
+    ]
+    assert index.lookup('recent') is None
+    assert index.lookup('old') == 'old.gcode'
+
+
+def test_overwritten_files_are_not_found(tmpdir):
+    index, storage = _index(tmpdir)
+    stored = storage.join('part.gcode')
+    stored.write('G28\n')
+    index.add('old', 'part.gcode')
+
+    stored.write('G29\n')
+    stored.setmtime(stored.mtime() + 10)
+
+    assert index.lookup('old') is None
+
+
+def test_replaced_file_is_indexed_by_new_checksum_only(tmpdir):
+    index, storage = _index(tmpdir)
+    storage.join('part.gcode').write('G28\n')
+    index.add('old', 'part.gcode')
+
+    index.add('new', 'part.gcode')
+
+    assert index.lookup('old') is None
+    assert index.lookup('new') == 'part.gcode'
+
+
+def test_changed_file_is_dropped_when_refreshed(tmpdir):
+    index, storage = _index(tmpdir)
+    stored = storage.join('part.gcode')
+    stored.write('G28\n')
+    index.add('kept', 'part.gcode')
+
+    index.refresh_path('part.gcode')
+    assert index.lookup('kept') == 'part.gcode'
+
+    stored.setmtime(stored.mtime() + 10)
+    index.refresh_path('part.gcode')
+    assert 'kept' not in json.loads(tmpdir.join('index.json').read())
+
+
+def test_lookup_does_not_save_index(tmpdir):
+    index, storage = _index(tmpdir)
+    storage.join('part.gcode').write('G28\n')
+    index.add('abc', 'part.gcode')
+
+    tmpdir.join('index.json').remove()
+    assert index.lookup('abc') == 'part.gcode'
+
+    assert not tmpdir.join('index.json').exists()
@@ -0,0 +1,45 @@
+from __future__ import absolute_import
+
+import hashlib
+
+import pytest
+
+from octoprint_mqtt_controls.commands.download_file.checksum import (
+    ChecksumVerifier
+)
+from octoprint_mqtt_controls.commands.download_file.exceptions import (
+    ChecksumVerificationError
+)
+
+DATA = b'G28\nG1 X10 Y10\n' * 1000
+
+
+def _feed(verifier, data, chunk_size=1000):
+    for offset in range(0, len(data), chunk_size):
+        verifier.update(data[offset:offset + chunk_size])
+
+
+def test_chunked_data_matches_checksums():
+    verifier = ChecksumVerifier(
+        md5=hashlib.md5(DATA).hexdigest(),
+        sha256=hashlib.sha256(DATA).hexdigest().upper()
+    )
+    _feed(verifier, DATA)
+
+    verifier.verify()
+
+
+def test_mismatched_checksum_raises():
+    verifier = ChecksumVerifier(md5=hashlib.md5(b'other').hexdigest())
+    _feed(verifier, DATA)
+
+    with pytest.raises(ChecksumVerificationError):
+        verifier.verify()
+
+
+def test_missing_checksums_are_skipped():
+    verifier = ChecksumVerifier(md5=None, sha256='')
+    _feed(verifier, DATA)
+
+    assert verifier.expected == {}
+    verifier.verify()
@@ -0,0 +1,62 @@
+from __future__ import absolute_import
+
+import gzip
+import io
+import zlib
+
+import pytest
+
+from octoprint_mqtt_controls.commands.download_file.compression import (
+    create_decoder, normalize
+)
+from octoprint_mqtt_controls.commands.download_file.exceptions import (
+    UnsupportedCompression
+)
+
+DATA = b'G1 X10 Y10 E0.5\n' * 4096
+
+
+def _decode(compression, data, chunk_size=1000):
+    decoder = create_decoder(compression)
+    chunks = [
+        decoder.decode(data[offset:offset + chunk_size])
+        for offset in range(0, len(data), chunk_size)
+    ]
+    chunks.append(decoder.flush())
+    return b''.join(chunks)
+
+
+def _gzip(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def _raw_deflate(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def test_gzip_is_decoded_chunk_by_chunk():
+    assert _decode('gzip', _gzip(DATA)) == DATA
+
+
+def test_deflate_accepts_zlib_and_raw_streams():
+    assert _decode('deflate', zlib.compress(DATA)) == DATA
+    assert _decode('deflate', _raw_deflate(DATA)) == DATA
+
+
+def test_identity_passes_data_through():
+    assert _decode('identity', DATA) == DATA
+    assert _decode(None, DATA) == DATA
+
+
+def test_names_are_normalized():
+    assert normalize(' X-GZIP ') == 'gzip'
+    assert normalize('identity') is None
+
+
+def test_unsupported_compression_is_rejected():
+    with pytest.raises(UnsupportedCompression):
+        create_decoder('br')
@@ -0,0 +1,63 @@
+from __future__ import absolute_import
+
+import pytest
+from mock import Mock, patch
+
+from octoprint_mqtt_controls.commands.download_file import DownloadFile
+from octoprint_mqtt_controls.commands.download_file.progress import (
+    Progress
+)
+from octoprint_mqtt_controls.util.metrics import MetricsRegistry
+
+SETTINGS = {
+    ('download', 'max_concurrent'): 1,
+    ('download', 'queue'): 'priority',
+    ('download', 'buffer_size'): 4096,
+    ('download', 'segment_min_size'): 1024,
+    ('download', 'progress_interval'): 0,
+    ('download', 'progress_step'): 0,
+    ('download', 'sync_size'): 0,
+    ('download', 'stream_print', 'buffer_ahead'): 1024,
+    ('download', 'stream_print', 'min_lead'): 256,
+    ('download', 'stream_print', 'poll_interval'): 0.1,
+    ('download', 'cache', 'enabled'): False,
+    ('download', 'partial', 'max_age'): 0,
+    ('download', 'partial', 'max_size'): 0,
+}
+
+
+class FakeSettings(object):
+    def get(self, path):
+        return SETTINGS[tuple(path)]
+
+    get_int = get_float = get_boolean = get
+
+
+@pytest.fixture
+def command(tmpdir):
+    plugin = Mock()
+    plugin.base_topic = 'printer/'
+    plugin._settings = FakeSettings()
+    plugin.metrics = MetricsRegistry(enabled=False)
+    with patch(
+        'octoprint_mqtt_controls.commands.download_file.partial'
+        '.partial_location',
+        return_value=str(tmpdir)
+    ):
+        yield DownloadFile(plugin)
+
+
+def test_progress_reports_are_coalesced_by_uid(command):
+    assert command.coalesce_key({
+        'uid': 'u', 'progress': 10, 'downloaded': 100, 'total_size': 1000,
+    }) == 'u'
+    # Progress of downloads of unknown size is not a percentage
+    assert command.coalesce_key({
+        'uid': 'u', 'progress': None, 'downloaded': 100, 'total_size': None,
+    }) == 'u'
+
+
+def test_final_reports_are_never_coalesced(command):
+    for progress in Progress:
+        assert command.coalesce_key(
+            {'uid': 'u', 'progress': progress.value}) is None
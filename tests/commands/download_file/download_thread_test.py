@@ -0,0 +1,226 @@
+from __future__ import absolute_import
+
+import hashlib
+import os
+
+import pytest
+from mock import Mock, patch
+from requests import HTTPError
+from requests.structures import CaseInsensitiveDict
+
+from octoprint_mqtt_controls.commands.download_file.checksum import (
+    ChecksumVerifier
+)
+from octoprint_mqtt_controls.commands.download_file.download_thread import (
+    DownloadThread
+)
+from octoprint_mqtt_controls.commands.download_file.exceptions import (
+    FileBeingPrinted
+)
+from octoprint_mqtt_controls.commands.download_file.partial import (
+    PartialDownload
+)
+from octoprint_mqtt_controls.commands.download_file.progress import (
+    ProgressReporter
+)
+
+URL = 'http://example.com/model.gcode'
+
+CONTENT = b'G28\nG1 X10 Y10\nG1 X20 Y20\n'
+
+RESUMED = 4
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, body=b'', headers=None):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.raw = Mock()
+        self.raw.stream.side_effect = \
+            lambda size, decode_content: iter([body]) if body else iter([])
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError(self.status_code)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession(object):
+    """Returns prepared responses and records headers of requests"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, stream=False, headers=None):
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+
+def _full_response(etag='"v1"'):
+    return FakeResponse(200, CONTENT, {
+        'Content-Length': str(len(CONTENT)),
+        'ETag': etag,
+    })
+
+
+@pytest.fixture(autouse=True)
+def partial_location(tmpdir):
+    location = str(tmpdir.mkdir('partial'))
+    with patch(
+        'octoprint_mqtt_controls.commands.download_file.partial'
+        '.partial_location',
+        return_value=location
+    ):
+        yield location
+
+
+def _interrupted_partial(etag='"v1"'):
+    partial = PartialDownload('uid', URL)
+    with open(partial.file_path, 'wb') as f:
+        f.write(CONTENT[:RESUMED])
+    partial.save_state(etag=etag, total_size=len(CONTENT))
+    return partial
+
+
+def _download_thread(tmpdir, **kwargs):
+    storage = tmpdir.ensure('uploads', dir=True)
+    file_manager = Mock()
+    file_manager.add_file.side_effect = \
+        lambda destination, path, *args, **kwargs: path
+    file_manager.path_on_disk.side_effect = \
+        lambda destination, path: os.path.join(str(storage), path)
+
+    printer = Mock()
+    printer.is_ready.return_value = True
+
+    return DownloadThread(
+        'uid', 0, URL, 'model.gcode', None,
+        Mock(), file_manager, printer, **kwargs
+    )
+
+
+def test_stored_file_is_selected_by_its_path_on_disk(tmpdir):
+    download_thread = _download_thread(tmpdir)
+    partial = Mock(file_path=str(tmpdir.join('download.part')))
+
+    download_thread._complete(partial)
+
+    download_thread._printer.select_file.assert_called_once_with(
+        str(tmpdir.join('uploads', 'model.gcode')),
+        False,
+        printAfterSelect=True
+    )
+
+
+def test_file_being_printed_is_not_overwritten(tmpdir):
+    download_thread = _download_thread(tmpdir)
+    download_thread._printer.can_modify_file.return_value = False
+    partial = Mock(file_path=str(tmpdir.join('download.part')))
+
+    with pytest.raises(FileBeingPrinted):
+        download_thread._complete(partial)
+
+    assert not download_thread._file_manager.add_file.called
+    assert not download_thread._printer.select_file.called
+
+
+def _resume(tmpdir, session):
+    """Continue the interrupted download, return its partial and verifier"""
+    download_thread = _download_thread(tmpdir, resume=True, session=session)
+    download_thread._progress_reporter = ProgressReporter(
+        download_thread._report, 0, 0)
+    partial = PartialDownload('uid', URL)
+    checksum_verifier = ChecksumVerifier(md5=hashlib.md5(CONTENT).hexdigest())
+
+    download_thread._fetch_single(partial, checksum_verifier)
+    return partial, checksum_verifier
+
+
+def _content(partial):
+    with open(partial.file_path, 'rb') as f:
+        return f.read()
+
+
+def test_download_continues_from_matching_content_range(tmpdir):
+    _interrupted_partial()
+    session = FakeSession(FakeResponse(206, CONTENT[RESUMED:], {
+        'Content-Range': 'bytes %d-%d/%d' % (
+            RESUMED, len(CONTENT) - 1, len(CONTENT)),
+        'Content-Length': str(len(CONTENT) - RESUMED),
+        'ETag': '"v1"',
+    }))
+
+    partial, checksum_verifier = _resume(tmpdir, session)
+
+    assert session.requests[0]['Range'] == 'bytes=%d-' % RESUMED
+    assert session.requests[0]['If-Range'] == '"v1"'
+    assert len(session.requests) == 1
+    assert _content(partial) == CONTENT
+    checksum_verifier.verify()
+
+
+def test_whole_file_sent_instead_of_range_replaces_partial_file(tmpdir):
+    # Server ignores the range of a file changed since the interruption
+    _interrupted_partial(etag='"v0"')
+    session = FakeSession(_full_response(etag='"v1"'))
+
+    partial, checksum_verifier = _resume(tmpdir, session)
+
+    assert session.requests[0]['If-Range'] == '"v0"'
+    assert len(session.requests) == 1
+    assert _content(partial) == CONTENT
+    assert partial.resumable_state()[0]['etag'] == '"v1"'
+    checksum_verifier.verify()
+
+
+def test_unsatisfiable_range_is_downloaded_again(tmpdir):
+    _interrupted_partial()
+    session = FakeSession(
+        FakeResponse(416, headers={'Content-Range': 'bytes */2'}),
+        _full_response()
+    )
+
+    partial, checksum_verifier = _resume(tmpdir, session)
+
+    assert 'Range' in session.requests[0]
+    assert 'Range' not in session.requests[1]
+    assert _content(partial) == CONTENT
+    checksum_verifier.verify()
+
+
+def test_range_not_matching_offset_is_downloaded_again(tmpdir):
+    _interrupted_partial()
+    session = FakeSession(
+        FakeResponse(206, CONTENT, {
+            'Content-Range': 'bytes 0-%d/%d' % (
+                len(CONTENT) - 1, len(CONTENT)),
+        }),
+        _full_response()
+    )
+
+    partial, checksum_verifier = _resume(tmpdir, session)
+
+    assert len(session.requests) == 2
+    assert 'Range' not in session.requests[1]
+    assert _content(partial) == CONTENT
+    checksum_verifier.verify()
+
+
+def test_offset_and_total_size_are_read_from_content_range():
+    response = FakeResponse(206, headers={
+        'Content-Range': 'bytes 4-9/10',
+        'Content-Length': '6',
+    })
+    unknown_size = FakeResponse(206, headers={'Content-Range': 'bytes 4-9/*'})
+
+    assert DownloadThread._resume_offset(response, 4) == 4
+    assert DownloadThread._resume_offset(response, 5) is None
+    assert DownloadThread._resume_offset(_full_response(), 4) == 0
+    assert DownloadThread._resume_offset(FakeResponse(416), 4) is None
+    assert DownloadThread._total_size(response) == 10
+    assert DownloadThread._total_size(unknown_size) is None
+    assert DownloadThread._total_size(_full_response()) == len(CONTENT)
@@ -0,0 +1,99 @@
+from __future__ import absolute_import
+
+from mock import Mock
+
+from octoprint_mqtt_controls.commands.download_file.manager import (
+    DownloadManager
+)
+
+
+class FakeDownloadThread(object):
+    def __init__(self, uid, started):
+        self.uid = uid
+        self.finished_callback = None
+        self.start = Mock(side_effect=lambda: started.append(uid))
+        self.report_queued = Mock()
+        self.schedule_to_stop = Mock()
+        self.cancel = Mock()
+
+    def finish(self):
+        self.finished_callback(self)
+
+
+def test_queued_downloads_start_by_priority_then_arrival():
+    started = []
+    manager = DownloadManager(1, Mock())
+    threads = dict(
+        (uid, FakeDownloadThread(uid, started))
+        for uid in ('running', 'low', 'high', 'high-later')
+    )
+
+    manager.schedule(threads['running'])
+    manager.schedule(threads['low'], priority=0)
+    manager.schedule(threads['high'], priority=5)
+    manager.schedule(threads['high-later'], priority=5)
+
+    assert started == ['running']
+    threads['low'].report_queued.assert_called_once_with(1)
+    threads['high'].report_queued.assert_called_once_with(1)
+    threads['high-later'].report_queued.assert_called_once_with(2)
+
+    for uid in ('running', 'high', 'high-later'):
+        threads[uid].finish()
+
+    assert started == ['running', 'high', 'high-later', 'low']
+
+
+def test_stop_removes_queued_download():
+    started = []
+    manager = DownloadManager(1, Mock())
+    running = FakeDownloadThread('running', started)
+    queued = FakeDownloadThread('queued', started)
+
+    manager.schedule(running)
+    manager.schedule(queued)
+
+    assert manager.stop('queued')
+    queued.cancel.assert_called_once_with()
+
+    running.finish()
+    assert started == ['running']
+    assert not manager.stop('queued')
+
+
+def test_duplicate_uid_is_not_scheduled():
+    manager = DownloadManager(2, Mock())
+    manager.schedule(FakeDownloadThread('uid', []))
+
+    assert not manager.schedule(FakeDownloadThread('uid', []))
+
+
+def test_stopped_downloads_do_not_count_in_position():
+    manager = DownloadManager(1, Mock())
+    threads = dict(
+        (uid, FakeDownloadThread(uid, []))
+        for uid in ('running', 'stopped', 'queued')
+    )
+
+    manager.schedule(threads['running'])
+    manager.schedule(threads['stopped'], priority=5)
+    manager.stop('stopped')
+    manager.schedule(threads['queued'])
+
+    threads['queued'].report_queued.assert_called_once_with(1)
+
+
+def test_stop_all_stops_running_and_queued_downloads():
+    started = []
+    manager = DownloadManager(1, Mock())
+    running = FakeDownloadThread('running', started)
+    queued = FakeDownloadThread('queued', started)
+    manager.schedule(running)
+    manager.schedule(queued)
+
+    manager.stop_all()
+    running.finish()
+
+    running.schedule_to_stop.assert_called_once_with()
+    queued.cancel.assert_called_once_with()
+    assert started == ['running']
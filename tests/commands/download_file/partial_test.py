@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+
+import pytest
+from mock import patch
+
+from octoprint_mqtt_controls.commands.download_file.partial import (
+    PartialDownload, cleanup_partial_downloads
+)
+
+URL = 'http://example.com/model.gcode'
+
+DAY = 24 * 60 * 60
+
+
+@pytest.fixture
+def partial(tmpdir):
+    with patch(
+        'octoprint_mqtt_controls.commands.download_file.partial'
+        '.partial_location',
+        return_value=str(tmpdir)
+    ):
+        yield PartialDownload('uid', URL)
+
+
+def test_cleanup_removes_files_without_counterpart(tmpdir):
+    for name in ('resumable.part', 'resumable.json', 'orphan.part',
+                 'stale.json', 'other.txt'):
+        tmpdir.join(name).write('')
+
+    with patch(
+        'octoprint_mqtt_controls.commands.download_file.partial'
+        '.partial_location',
+        return_value=str(tmpdir)
+    ):
+        assert cleanup_partial_downloads() == 2
+
+    assert sorted(p.basename for p in tmpdir.listdir()) == [
+        'other.txt', 'resumable.json', 'resumable.part'
+    ]
+
+
+def _cleanup_aged(tmpdir, **limits):
+    """Clean up three downloads modified 1, 2 and 3 days ago"""
+    now = 10 * DAY
+    for age in (1, 2, 3):
+        for extension in ('.part', '.json'):
+            path = tmpdir.join('%ddays%s' % (age, extension))
+            path.write('x' * 10 if extension == '.part' else '')
+            path.setmtime(now - age * DAY)
+
+    with patch(
+        'octoprint_mqtt_controls.commands.download_file.partial'
+        '.partial_location',
+        return_value=str(tmpdir)
+    ):
+        removed = cleanup_partial_downloads(clock=lambda: now, **limits)
+    return removed, sorted(p.purebasename for p in tmpdir.listdir())
+
+
+def test_cleanup_removes_expired_downloads(tmpdir):
+    removed, kept = _cleanup_aged(tmpdir, max_age=2.5 * DAY)
+
+    assert removed == 2
+    assert kept == ['1days', '1days', '2days', '2days']
+
+
+def test_cleanup_removes_oldest_downloads_above_max_size(tmpdir):
+    removed, kept = _cleanup_aged(tmpdir, max_size=15)
+
+    assert removed == 4
+    assert kept == ['1days', '1days']
+
+
+def test_interrupted_download_is_resumable(partial):
+    with open(partial.file_path, 'w') as f:
+        f.write('G28\n')
+    partial.save_state(etag='"v1"', total_size=10)
+
+    state, offset = partial.resumable_state()
+
+    assert state['etag'] == '"v1"'
+    assert offset == 4
+
+
+def test_download_without_state_is_not_resumable(partial):
+    with open(partial.file_path, 'w') as f:
+        f.write('G28\n')
+
+    assert partial.resumable_state() == (None, 0)
+
+
+def test_download_without_file_is_not_resumable(partial):
+    partial.save_state(etag='"v1"', total_size=10)
+
+    assert partial.resumable_state() == (None, 0)
+
+
+def test_file_larger_than_total_size_is_not_resumable(partial):
+    with open(partial.file_path, 'w') as f:
+        f.write('G28\nG1 X10\n')
+    partial.save_state(etag='"v1"', total_size=4)
+
+    assert partial.resumable_state() == (None, 0)
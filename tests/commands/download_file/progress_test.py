@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+
+from octoprint_mqtt_controls.commands.download_file.progress import (
+    ProgressReporter
+)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _reporter(interval=1.0, step=1):
+    reports = []
+    clock = FakeClock()
+    return ProgressReporter(reports.append, interval, step, clock), \
+        reports, clock
+
+
+def test_updates_within_interval_are_coalesced():
+    reporter, reports, clock = _reporter()
+
+    for downloaded in range(0, 1000, 10):
+        clock.now += 0.01
+        reporter.update(downloaded, 1000)
+
+    assert len(reports) == 1
+    assert reports[0]['downloaded'] == 990
+
+
+def test_small_progress_changes_are_not_reported():
+    reporter, reports, clock = _reporter(step=5)
+
+    clock.now = 2.0
+    reporter.update(30, 1000)
+
+    assert reports == []
+
+
+def test_flush_reports_last_update():
+    reporter, reports, clock = _reporter()
+
+    clock.now = 2.0
+    reporter.update(500, 1000)
+    clock.now = 2.5
+    reporter.update(1000, 1000)
+    reporter.flush()
+    reporter.flush()
+
+    assert [r['progress'] for r in reports] == [50, 100]
+
+
+def test_report_contains_speed_and_eta():
+    reporter, reports, clock = _reporter()
+
+    clock.now = 2.0
+    reporter.update(500, 1000)
+
+    assert reports == [{
+        'progress': 50,
+        'downloaded': 500,
+        'total_size': 1000,
+        'speed': 250,
+        'eta': 2,
+    }]
+
+
+def test_decompressed_size_is_reported():
+    reporter, reports, clock = _reporter()
+
+    clock.now = 2.0
+    reporter.update(500, 1000, 4000)
+
+    assert reports[-1]['written'] == 4000
+
+
+def test_resumed_bytes_are_not_counted_in_speed():
+    reports = []
+    clock = FakeClock()
+    reporter = ProgressReporter(
+        reports.append, 1.0, 1, clock, downloaded=600)
+
+    clock.now = 2.0
+    reporter.update(800, 1000)
+
+    assert reports[-1]['speed'] == 100
+    assert reports[-1]['eta'] == 2
@@ -0,0 +1,162 @@
+from __future__ import absolute_import
+
+import hashlib
+import os
+import re
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import pytest
+import requests
+from mock import Mock, patch
+
+from octoprint_mqtt_controls.commands.download_file.checksum import (
+    ChecksumVerifier
+)
+from octoprint_mqtt_controls.commands.download_file.download_thread import (
+    DownloadThread
+)
+from octoprint_mqtt_controls.commands.download_file.exceptions import (
+    StopDownload, UnexpectedRangeResponse
+)
+from octoprint_mqtt_controls.commands.download_file.partial import (
+    PartialDownload
+)
+from octoprint_mqtt_controls.commands.download_file.progress import (
+    ProgressReporter
+)
+from octoprint_mqtt_controls.commands.download_file.segmented import (
+    SegmentedFetcher, split_ranges
+)
+
+CONTENT = b''.join(b'G1 X%d\n' % i for i in range(4096))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    ranges = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if self.path == '/whole' or match is None:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(CONTENT)))
+            self.end_headers()
+            self.wfile.write(CONTENT)
+            return
+
+        start, end = int(match.group(1)), int(match.group(2))
+        _Handler.ranges.append((start, end))
+        if self.path == '/broken' and start:
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+            start, end, len(CONTENT)))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(CONTENT[start:end + 1])
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    _Handler.ranges = []
+    http_server = _Server(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=http_server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:%d' % http_server.server_address[1]
+    http_server.shutdown()
+    http_server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def partial_location(tmpdir):
+    location = str(tmpdir.mkdir('partial'))
+    with patch(
+        'octoprint_mqtt_controls.commands.download_file.partial'
+        '.partial_location',
+        return_value=location
+    ):
+        yield location
+
+
+def _fetcher(url, file_path, should_stop=None):
+    return SegmentedFetcher(
+        'uid', url, file_path, len(CONTENT), 3, 1024,
+        should_stop or threading.Event(), Mock(), requests.Session()
+    )
+
+
+def test_split_ranges_covers_whole_file():
+    assert split_ranges(10, 3) == [(0, 3), (4, 7), (8, 9)]
+
+
+def test_split_ranges_of_evenly_divisible_size():
+    assert split_ranges(8, 4) == [(0, 1), (2, 3), (4, 5), (6, 7)]
+
+
+def test_split_ranges_never_returns_empty_ranges():
+    assert split_ranges(2, 4) == [(0, 0), (1, 1)]
+
+
+def test_segments_are_written_at_their_offsets(server, tmpdir):
+    file_path = str(tmpdir.join('model.gcode'))
+    checksum_verifier = ChecksumVerifier(
+        md5=hashlib.md5(CONTENT).hexdigest())
+
+    _fetcher(server + '/file', file_path).fetch(checksum_verifier)
+
+    assert sorted(_Handler.ranges) == split_ranges(len(CONTENT), 3)
+    with open(file_path, 'rb') as f:
+        assert f.read() == CONTENT
+    # Following segments are hashed by reading them back from the file
+    checksum_verifier.verify()
+
+
+def test_range_request_answered_with_whole_file_fails(server, tmpdir):
+    with pytest.raises(UnexpectedRangeResponse):
+        _fetcher(server + '/whole', str(tmpdir.join('model.gcode'))).fetch(
+            ChecksumVerifier())
+
+
+def _fetch_segmented(url, should_stop):
+    download_thread = DownloadThread(
+        'uid', 0, url, 'model.gcode', None, Mock(), Mock(), Mock(),
+        segments=3, buffer_size=1024, session=requests.Session()
+    )
+    download_thread._should_stop = should_stop
+    download_thread._progress_reporter = ProgressReporter(
+        download_thread._report, 0, 0)
+    partial = PartialDownload('uid', url)
+    partial.prepare()
+    partial.save_state(total_size=len(CONTENT))
+
+    download_thread._fetch_segmented(
+        partial, len(CONTENT), ChecksumVerifier())
+
+
+def test_stopped_download_discards_segmented_file(server, partial_location):
+    should_stop = threading.Event()
+    should_stop.set()
+
+    with pytest.raises(StopDownload):
+        _fetch_segmented(server + '/file', should_stop)
+
+    assert os.listdir(partial_location) == []
+
+
+def test_failed_segment_discards_segmented_file(server, partial_location):
+    with pytest.raises(requests.HTTPError):
+        _fetch_segmented(server + '/broken', threading.Event())
+
+    assert os.listdir(partial_location) == []
@@ -0,0 +1,111 @@
+from __future__ import absolute_import
+
+from octoprint_mqtt_controls.commands.download_file.stream_print import (
+    StreamPrintGuard, StreamPrintOptions
+)
+
+
+class FakePrinter(object):
+    def __init__(self):
+        self.filepos = 0
+        self.state = 'printing'
+        self.path = 'model.gcode'
+        self.calls = []
+
+    def is_current_file(self, path, sd):
+        return path == self.path and not sd
+
+    def is_printing(self):
+        return self.state == 'printing'
+
+    def is_pausing(self):
+        return False
+
+    def is_paused(self):
+        return self.state == 'paused'
+
+    def get_current_data(self):
+        return {'progress': {'filepos': self.filepos}}
+
+    def pause_print(self):
+        self.calls.append('pause')
+        self.state = 'paused'
+
+    def resume_print(self):
+        self.calls.append('resume')
+        self.state = 'printing'
+
+    def cancel_print(self):
+        self.calls.append('cancel')
+        self.state = 'operational'
+
+
+def _guard(written=1000):
+    printer = FakePrinter()
+    reports = []
+    guard = StreamPrintGuard(
+        printer,
+        'model.gcode',
+        StreamPrintOptions(buffer_ahead=1000, min_lead=100, poll_interval=60),
+        reports.append
+    )
+    guard.start(written)
+    return guard, printer, reports
+
+
+def test_print_is_paused_until_data_is_buffered_ahead():
+    guard, printer, reports = _guard()
+
+    printer.filepos = 950
+    guard.check()
+    guard.update(1500)
+    guard.check()
+    guard.update(1950)
+    guard.check()
+    guard.finish()
+
+    assert printer.calls == ['pause', 'resume']
+    assert [r['progress'] for r in reports] == [
+        'printing', 'print_paused', 'printing'
+    ]
+
+
+def test_finished_download_resumes_print():
+    guard, printer, reports = _guard()
+
+    printer.filepos = 950
+    guard.check()
+    guard.finish()
+
+    assert printer.calls == ['pause', 'resume']
+
+
+def test_print_paused_by_user_is_not_resumed():
+    guard, printer, reports = _guard()
+
+    printer.state = 'paused'
+    guard.update(5000)
+    guard.check()
+    guard.finish()
+
+    assert printer.calls == []
+
+
+def test_abort_cancels_print():
+    guard, printer, reports = _guard()
+
+    guard.abort()
+    guard.check()
+
+    assert printer.calls == ['cancel']
+
+
+def test_print_of_another_file_is_not_touched():
+    guard, printer, reports = _guard()
+
+    printer.path = 'other.gcode'
+    printer.filepos = 990
+    guard.check()
+    guard.abort()
+
+    assert printer.calls == []
@@ -0,0 +1,57 @@
+from __future__ import absolute_import
+
+import os
+
+from mock import patch
+
+from octoprint_mqtt_controls.commands.download_file.writer import (
+    ALIGNMENT, FileWriter, align
+)
+
+
+def test_align_rounds_up_to_block_size():
+    assert align(1) == ALIGNMENT
+    assert align(ALIGNMENT) == ALIGNMENT
+    assert align(ALIGNMENT + 1) == 2 * ALIGNMENT
+
+
+def _write(path, offset, chunks):
+    positions = []
+    real_write = os.write
+
+    def write(fd, data):
+        positions.append((os.lseek(fd, 0, os.SEEK_CUR), len(data)))
+        return real_write(fd, data)
+
+    with patch('os.write', side_effect=write):
+        with FileWriter(path, offset, buffer_size=ALIGNMENT) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    return positions
+
+
+def test_blocks_are_aligned_to_file_offsets(tmpdir):
+    path = str(tmpdir.join('file.part'))
+    with open(path, 'wb') as f:
+        f.write(b'a' * 100)
+
+    positions = _write(path, 100, [b'b' * 3000] * 4)
+
+    assert positions == [
+        (100, ALIGNMENT - 100),
+        (ALIGNMENT, ALIGNMENT),
+        (2 * ALIGNMENT, 12100 - 2 * ALIGNMENT),
+    ]
+    with open(path, 'rb') as f:
+        assert f.read() == b'a' * 100 + b'b' * 12000
+
+
+def test_file_is_truncated_without_offset(tmpdir):
+    path = str(tmpdir.join('file.part'))
+    with open(path, 'wb') as f:
+        f.write(b'a' * 100)
+
+    _write(path, 0, [b'b' * 10])
+
+    with open(path, 'rb') as f:
+        assert f.read() == b'b' * 10
@@ -0,0 +1,110 @@
+from __future__ import absolute_import
+
+import time
+from threading import Event
+
+import pytest
+from mock import Mock
+from tornado import gen
+
+from octoprint_mqtt_controls.commands.exceptions import ExecutorBusy
+from octoprint_mqtt_controls.commands.executor import CommandExecutor
+from octoprint_mqtt_controls.util.engine import AsyncEngine
+
+
+def test_commands_are_executed_concurrently():
+    executor = CommandExecutor(2, 4, Mock())
+    first_started = Event()
+    second_started = Event()
+
+    def first():
+        first_started.set()
+        assert second_started.wait(1)
+
+    def second():
+        second_started.set()
+        assert first_started.wait(1)
+
+    executor.submit('first', first)
+    executor.submit('second', second)
+    executor.shutdown(timeout=2)
+
+    assert first_started.is_set() and second_started.is_set()
+
+
+def test_submit_raises_when_queue_is_full():
+    executor = CommandExecutor(1, 1, Mock())
+    release = Event()
+    started = Event()
+
+    def blocking():
+        started.set()
+        release.wait(1)
+
+    executor.submit('running', blocking)
+    assert started.wait(1)
+    executor.submit('queued', Mock())
+
+    with pytest.raises(ExecutorBusy):
+        executor.submit('rejected', Mock())
+
+    release.set()
+    executor.shutdown(timeout=2)
+
+
+def test_commands_with_same_key_are_executed_in_order():
+    executor = CommandExecutor(4, 16, Mock())
+    first_running = Event()
+    executed = []
+
+    def first():
+        first_running.set()
+        time.sleep(0.1)
+        executed.append('start')
+
+    executor.submit_ordered('download:1', 'start', first)
+    assert first_running.wait(1)
+    executor.submit_ordered('download:1', 'stop', executed.append, 'stop')
+    executor.shutdown(timeout=2)
+
+    assert executed == ['start', 'stop']
+
+
+def test_unrelated_command_does_not_wait_for_slow_one():
+    executor = CommandExecutor(2, 16, Mock())
+    release = Event()
+    executed = []
+
+    executor.submit_ordered('stream:1', 'slow', release.wait, 2)
+    executor.submit_ordered('stream:1', 'held back', executed.append, 1)
+    for number in range(2, 6):
+        executor.submit_ordered(
+            'job:%d' % number, 'fast', executed.append, number)
+
+    deadline = time.time() + 1
+    while len(executed) < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    assert sorted(executed) == [2, 3, 4, 5]
+
+    release.set()
+    executor.shutdown(timeout=2)
+    assert executed[-1] == 1
+
+
+def test_coroutine_holds_back_its_key_but_not_a_worker():
+    engine = AsyncEngine(4, Mock())
+    executor = CommandExecutor(1, 16, Mock())
+    executed = []
+
+    @gen.coroutine
+    def start():
+        yield gen.sleep(0.2)
+        executed.append('start')
+
+    executor.submit_async('job:a', 'start', engine, start)
+    executor.submit_ordered('job:a', 'cancel', executed.append, 'cancel')
+    executor.submit_ordered('job:b', 'other', executed.append, 'other')
+    executor.shutdown(timeout=2)
+    engine.stop(2)
+
+    assert executed == ['other', 'start', 'cancel']
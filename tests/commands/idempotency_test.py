@@ -0,0 +1,45 @@
+from __future__ import absolute_import
+
+import os
+
+from octoprint_mqtt_controls.commands.idempotency import IdempotencyStore
+
+
+def test_duplicate_gets_recorded_response():
+    store = IdempotencyStore(8, 60)
+
+    assert store.claim('cmd:1') == (True, None)
+    assert store.claim('cmd:1') == (False, None)
+
+    store.record('cmd:1', {'uid': 1, 'status_code': 200})
+    assert store.claim('cmd:1') == (False, {'uid': 1, 'status_code': 200})
+
+
+def test_released_command_can_be_claimed_again():
+    store = IdempotencyStore(8, 60)
+    store.claim('cmd:1')
+    store.release('cmd:1')
+
+    assert store.claim('cmd:1') == (True, None)
+
+
+def test_responses_of_unknown_commands_are_not_recorded():
+    store = IdempotencyStore(8, 60)
+    store.record('cmd:1', {'uid': 1})
+
+    assert store.claim('cmd:1') == (True, None)
+
+
+def test_store_is_persisted(tmpdir):
+    path = os.path.join(str(tmpdir), 'seen.json')
+    store = IdempotencyStore(8, 60, path)
+    store.claim('cmd:1')
+    store.record('cmd:1', {'uid': 1})
+    store.claim('cmd:2')
+    store.save()
+
+    restored = IdempotencyStore(8, 60, path)
+    restored.load()
+
+    assert restored.claim('cmd:1') == (False, {'uid': 1})
+    assert restored.claim('cmd:2') == (True, None)
@@ -0,0 +1,110 @@
+from __future__ import absolute_import
+
+from threading import Event, Thread
+
+from mock import Mock
+
+from octoprint_mqtt_controls.commands.publisher import PublishQueue
+from octoprint_mqtt_controls.util.metrics import MetricsRegistry
+
+
+class BlockingPublisher(object):
+    """Publish function holding the flusher until released"""
+
+    def __init__(self):
+        self.published = []
+        self.started = Event()
+        self.released = Event()
+
+    def __call__(self, topic, payload):
+        self.started.set()
+        self.released.wait(5)
+        self.published.append((topic, payload))
+
+
+def _blocked_queue(max_bytes=1024 * 1024, metrics=None):
+    publish = BlockingPublisher()
+    queue = PublishQueue(publish, max_bytes, Mock(), metrics)
+    queue.publish('report', {'uid': 'first'})
+    publish.started.wait(5)
+    return queue, publish
+
+
+def test_messages_are_published_in_order():
+    queue, publish = _blocked_queue()
+    queue.publish('report', {'uid': 'a'})
+    queue.publish('other', {'uid': 'b'})
+    assert queue.depth == 2
+
+    publish.released.set()
+    queue.stop(5)
+
+    assert publish.published == [
+        ('report', {'uid': 'first'}),
+        ('report', {'uid': 'a'}),
+        ('other', {'uid': 'b'}),
+    ]
+
+
+def test_progress_is_coalesced():
+    metrics = MetricsRegistry()
+    queue, publish = _blocked_queue(metrics=metrics)
+    for progress in (10, 20, 30):
+        queue.publish('report', {'uid': 'u', 'progress': progress}, 'u')
+    queue.publish('report', {'uid': 'u', 'progress': 'success'})
+
+    publish.released.set()
+    queue.stop(5)
+
+    assert publish.published[1:] == [
+        ('report', {'uid': 'u', 'progress': 30}),
+        ('report', {'uid': 'u', 'progress': 'success'}),
+    ]
+    assert metrics.snapshot()['counters']['publisher.coalesced'] == 2
+
+
+def test_coalescable_messages_are_dropped_first():
+    final = {'uid': 'final', 'body': 'x' * 20}
+    queue, publish = _blocked_queue(max_bytes=80)
+    queue.publish('report', {'uid': 'u', 'progress': 10}, 'u')
+    queue.publish('report', {'uid': 'v', 'progress': 10}, 'v')
+    assert queue.publish('report', final)
+    assert queue.depth == 2
+    assert not queue.publish('report', {'uid': 'dropped', 'body': 'x' * 20})
+
+    publish.released.set()
+    queue.stop(5)
+
+    assert publish.published[1:] == [('report', final)]
+
+
+def test_messages_are_published_directly_after_stop():
+    publish = Mock()
+    queue = PublishQueue(publish, 1024, Mock())
+    queue.stop(5)
+
+    queue.publish('report', {'uid': 'late'})
+
+    publish.assert_called_once_with('report', {'uid': 'late'})
+
+
+def test_blocking_publish_waits_for_space():
+    queue, publish = _blocked_queue(max_bytes=40)
+    queue.publish('report', {'uid': 'u', 'progress': 10})
+
+    waiting = Thread(
+        target=queue.publish,
+        args=('report', {'uid': 'v', 'progress': 10}),
+        kwargs={'block': True}
+    )
+    waiting.start()
+    waiting.join(0.1)
+    assert waiting.is_alive()
+
+    publish.released.set()
+    waiting.join(5)
+    queue.stop(5)
+
+    assert [payload['uid'] for _, payload in publish.published] == [
+        'first', 'u', 'v'
+    ]
@@ -0,0 +1,94 @@
+from __future__ import absolute_import
+
+from threading import Event, Thread
+
+from mock import Mock
+
+from octoprint_mqtt_controls.commands.api import APIResponse
+from octoprint_mqtt_controls.commands.response_cache import ResponseCache
+
+TTLS = {'/api/printer': 1, '/api/files': 10}
+
+
+def _ok(body):
+    return APIResponse(200, {}, body)
+
+
+def test_get_responses_are_cached_per_endpoint():
+    cache = ResponseCache(8, TTLS)
+    request = Mock(side_effect=lambda: _ok('printer'))
+
+    for _ in range(3):
+        response = cache.fetch('GET', '/api/printer', None, request)
+
+    assert response.body == 'printer'
+    assert request.call_count == 1
+    assert cache.stats()['hits'] == 2
+
+
+def test_uncacheable_requests_always_reach_backend():
+    cache = ResponseCache(8, TTLS)
+    request = Mock(side_effect=lambda: _ok('ok'))
+
+    cache.fetch('POST', '/api/printer', {'command': 'home'}, request)
+    cache.fetch('POST', '/api/printer', {'command': 'home'}, request)
+    cache.fetch('GET', '/api/job', None, request)
+    cache.fetch('GET', '/api/job', None, request)
+
+    assert request.call_count == 4
+
+
+def test_error_responses_are_not_cached():
+    cache = ResponseCache(8, TTLS)
+    request = Mock(return_value=APIResponse(409, {}, 'busy'))
+
+    cache.fetch('GET', '/api/printer', None, request)
+    cache.fetch('GET', '/api/printer', None, request)
+
+    assert request.call_count == 2
+
+
+def test_event_invalidates_related_endpoints():
+    cache = ResponseCache(8, TTLS)
+    request = Mock(side_effect=lambda: _ok('ok'))
+    cache.fetch('GET', '/api/printer', None, request)
+    cache.fetch('GET', '/api/files', None, request)
+
+    cache.on_event('FileAdded')
+    cache.fetch('GET', '/api/printer', None, request)
+    cache.fetch('GET', '/api/files', None, request)
+
+    assert request.call_count == 3
+
+
+def test_prefixes_match_whole_path_segments():
+    cache = ResponseCache(8, TTLS)
+    request = Mock(side_effect=lambda: _ok('ok'))
+
+    for _ in range(2):
+        cache.fetch('GET', '/api/files/local?recursive=true', None, request)
+        cache.fetch('GET', '/api/filesystem', None, request)
+    cache.invalidate(['/api/file'])
+    cache.fetch('GET', '/api/files/local?recursive=true', None, request)
+
+    assert request.call_count == 3
+
+
+def test_concurrent_misses_share_one_backend_request():
+    cache = ResponseCache(8, TTLS)
+    release = Event()
+    request = Mock(side_effect=lambda: release.wait(1) and _ok('files'))
+    results = []
+
+    def fetch():
+        results.append(cache.fetch('GET', '/api/files', None, request))
+
+    threads = [Thread(target=fetch) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(1)
+
+    assert request.call_count == 1
+    assert [r.body for r in results] == ['files'] * 5
@@ -0,0 +1,35 @@
+from __future__ import absolute_import
+
+from mock import Mock
+
+from octoprint_mqtt_controls.commands.router import CommandRouter
+
+
+def _command(subtopic):
+    command = Mock()
+    command.subtopic = subtopic
+    return command
+
+
+def test_messages_are_routed_by_subtopic():
+    api = _command('mqtt-rest-api/')
+    download = _command('download-file/command')
+    router = CommandRouter('octoPrint/', [api, download])
+
+    router('octoPrint/download-file/command', '{}', qos=1)
+
+    download.assert_called_once_with(
+        'octoPrint/download-file/command', '{}', qos=1)
+    api.assert_not_called()
+    assert router.topic == 'octoPrint/#'
+
+
+def test_unknown_topics_are_dropped():
+    api = _command('mqtt-rest-api/')
+    router = CommandRouter('octoPrint/', [api])
+
+    router('octoPrint/control-response/', '{}')
+    router('octoPrint/temperature/tool0', '{}')
+    router('other/mqtt-rest-api/', '{}')
+
+    api.assert_not_called()
@@ -2,7 +2,9 @@ from __future__ import absolute_import
 
 from mock import Mock, create_autospec
 
-from octoprint_mqtt_controls.util import cached_property, cached_call
+from octoprint_mqtt_controls.util import (
+    LRUCache, cached_property, cached_call, invalidate_on_event, memoize
+)
 
 
 def test_cached_property():
@@ -40,3 +42,115 @@ def test_cached_call():
 
     mock.assert_called_once()
     assert retrieved_value == expected_value
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats() == {'size': 2, 'max_size': 2, 'hits': 3, 'misses': 1}
+
+
+def test_lru_cache_entries_expire():
+    clock = FakeClock()
+    cache = LRUCache(2, clock=clock)
+    cache.set('a', 1, ttl=5)
+    cache.set('b', 2)
+
+    clock.now = 5
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+
+
+def test_lru_cache_invalidates_matching_keys():
+    cache = LRUCache(3)
+    for key in ('/api/job', '/api/files', '/api/files/local'):
+        cache.set(key, key)
+
+    cache.invalidate(lambda key: key.startswith('/api/files'))
+
+    assert len(cache) == 1
+    assert cache.get('/api/job') == '/api/job'
+
+
+def test_cached_call_caches_falsy_result():
+    mock = Mock(return_value=None)
+    mock.__name__ = 'mocked_function'
+
+    decorated = cached_call(mock)
+    decorated()
+    decorated()
+
+    mock.assert_called_once()
+
+
+def test_cached_property_can_be_invalidated():
+    mock_method = Mock(side_effect=[1, 2])
+
+    class TestedClass(object):
+        @cached_property
+        def mocked_property(self):
+            return mock_method()
+
+    instance = TestedClass()
+    assert instance.mocked_property == 1
+    del instance.mocked_property
+    assert instance.mocked_property == 2
+
+
+def test_memoize_caches_results_by_arguments():
+    mock = Mock(side_effect=lambda a, b=0: a + b)
+    mock.__name__ = 'mocked_function'
+
+    decorated = memoize(max_size=2)(mock)
+
+    assert decorated(1) == 1
+    assert decorated(1, b=2) == 3
+    assert decorated(1) == 1
+    assert mock.call_count == 2
+    assert decorated.cache_stats()['hits'] == 1
+
+    decorated.invalidate(1)
+    decorated(1)
+    assert mock.call_count == 3
+
+
+def test_memoize_results_expire():
+    clock = FakeClock()
+    mock = Mock(return_value=42)
+    mock.__name__ = 'mocked_function'
+
+    decorated = memoize(ttl=5, clock=clock)(mock)
+    decorated()
+    clock.now = 5
+    decorated()
+
+    assert mock.call_count == 2
+
+
+def test_memoize_invalidated_by_event():
+    mock = Mock(return_value=42)
+    mock.__name__ = 'mocked_function'
+
+    decorated = memoize(invalidated_by=('SettingsUpdated',))(mock)
+    decorated()
+    invalidate_on_event('PrinterStateChanged')
+    decorated()
+    invalidate_on_event('SettingsUpdated')
+    decorated()
+
+    assert mock.call_count == 2
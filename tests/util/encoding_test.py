@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+
+import base64
+import json
+import zlib
+
+import msgpack
+from mock import patch
+
+from octoprint_mqtt_controls.util.encoding import (
+    encode_message, filter_headers, project
+)
+
+BODY = {
+    'state': {'text': 'Printing', 'flags': {'printing': True}},
+    'files': [{'name': 'a.gcode'}, {'name': 'b.gcode'}],
+}
+
+
+def test_filter_headers_ignores_case():
+    headers = {'Content-Type': 'application/json', 'ETag': '"1"'}
+
+    assert filter_headers(headers, ['content-type']) == {
+        'Content-Type': 'application/json'
+    }
+
+
+def test_project_keeps_nesting_of_selected_paths():
+    assert project(BODY, ['state.text', 'files.1.name', 'missing.path']) == {
+        'state': {'text': 'Printing'},
+        'files': {'1': {'name': 'b.gcode'}},
+    }
+
+
+def test_project_without_paths_returns_body():
+    assert project(BODY, None) is BODY
+    assert project('plain text', ['state']) == 'plain text'
+
+
+def test_json_message_is_not_wrapped():
+    message = {'uid': 1, 'body': BODY}
+
+    assert encode_message(message, None) == (message, 'json')
+
+
+def test_zlib_message_is_wrapped_in_envelope():
+    message = {'uid': 1, 'timestamp': 2, 'body': BODY}
+
+    envelope, encoding = encode_message(message, 'zlib')
+
+    assert encoding == 'zlib'
+    assert envelope['uid'] == 1 and envelope['timestamp'] == 2
+    decoded = zlib.decompress(base64.b64decode(envelope['data']))
+    assert json.loads(decoded.decode('utf-8')) == message
+
+
+def test_msgpack_message_packs_native_strings_as_text():
+    message = {'uid': 1, 'method': 'GET', 'headers': {'ETag': '"1"'}}
+
+    envelope, encoding = encode_message(message, 'msgpack')
+
+    assert encoding == 'msgpack'
+    decoded = msgpack.unpackb(base64.b64decode(envelope['data']), raw=False)
+    assert decoded == message
+    assert all(
+        isinstance(value, type(u''))
+        for value in (decoded['method'], decoded['headers']['ETag'])
+    )
+
+
+def test_msgpack_fallback_is_declared():
+    message = {'uid': 1, 'body': BODY}
+
+    with patch(
+        'octoprint_mqtt_controls.util.encoding.msgpack', None
+    ):
+        encoded, encoding = encode_message(message, 'msgpack')
+
+    assert encoding == 'json'
+    assert encoded == dict(message, encoding='json')
@@ -0,0 +1,43 @@
+from __future__ import absolute_import
+
+from threading import Event, current_thread
+
+from mock import Mock
+from tornado import gen
+
+from octoprint_mqtt_controls.util.engine import AsyncEngine
+
+
+def test_coroutines_run_on_engine_thread():
+    engine = AsyncEngine(4, Mock())
+    finished = Event()
+    threads = []
+
+    @gen.coroutine
+    def coroutine(value):
+        yield gen.moment
+        threads.append((current_thread().name, value))
+        finished.set()
+
+    engine.spawn(coroutine, 42)
+    finished.wait(5)
+    engine.stop(5)
+
+    assert threads == [('mqtt-controls-engine', 42)]
+
+
+def test_failed_coroutines_are_logged():
+    logger = Mock()
+    engine = AsyncEngine(4, logger)
+    finished = Event()
+
+    @gen.coroutine
+    def coroutine():
+        finished.set()
+        raise ValueError()
+
+    engine.spawn(coroutine)
+    finished.wait(5)
+    engine.stop(5)
+
+    logger.exception.assert_called_once()
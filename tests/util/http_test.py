@@ -0,0 +1,41 @@
+from __future__ import absolute_import
+
+from mock import Mock
+from requests import Response
+
+from octoprint_mqtt_controls.util.http import PooledSession
+
+
+def _session_with_adapter(**kwargs):
+    session = PooledSession(**kwargs)
+    response = Response()
+    response.status_code = 200
+    adapter = Mock()
+    adapter.send.return_value = response
+    session.mount('http://', adapter)
+    return session, adapter
+
+
+def test_default_timeout_is_applied():
+    session, adapter = _session_with_adapter(timeout=(1, 2))
+
+    session.get('http://example.com/file.gcode')
+
+    assert adapter.send.call_args[1]['timeout'] == (1, 2)
+
+
+def test_explicit_timeout_is_kept():
+    session, adapter = _session_with_adapter(timeout=(1, 2))
+
+    session.get('http://example.com/file.gcode', timeout=5)
+
+    assert adapter.send.call_args[1]['timeout'] == 5
+
+
+def test_adapters_pool_connections():
+    session = PooledSession(pool_connections=3, pool_maxsize=7)
+
+    adapter = session.get_adapter('https://example.com/')
+
+    assert adapter._pool_connections == 3
+    assert adapter._pool_maxsize == 7
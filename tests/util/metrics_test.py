@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+
+from mock import Mock
+
+from octoprint_mqtt_controls.util.metrics import (
+    MetricsPublisher, MetricsRegistry
+)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_histogram_percentiles():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('latency')
+    for value in range(1, 101):
+        histogram.observe(value)
+
+    summary = registry.snapshot()['histograms']['latency']
+
+    assert summary['count'] == 100
+    assert summary['mean'] == 50.5
+    assert summary['max'] == 100
+    assert summary['p50'] == 51
+    assert summary['p95'] == 96
+    assert summary['p99'] == 100
+
+
+def test_registry_returns_same_instruments():
+    registry = MetricsRegistry()
+    registry.counter('received').inc()
+    registry.counter('received').inc(2)
+    registry.gauge('queued', lambda: 7)
+
+    snapshot = registry.snapshot()
+
+    assert snapshot['counters'] == {'received': 3}
+    assert snapshot['gauges'] == {'queued': 7}
+
+
+def test_disabled_registry_records_nothing():
+    registry = MetricsRegistry(enabled=False)
+    registry.counter('received').inc()
+    registry.histogram('latency').observe(1)
+    registry.gauge('queued', lambda: 7)
+
+    assert registry.snapshot() == {
+        'counters': {}, 'gauges': {}, 'histograms': {}
+    }
+
+
+def test_publisher_reports_counter_rates():
+    clock = FakeClock()
+    registry = MetricsRegistry()
+    publish = Mock()
+    publisher = MetricsPublisher(registry, 10, publish, clock)
+
+    registry.counter('received').inc(20)
+    clock.now = 10
+    publisher.publish()
+    registry.counter('received').inc(5)
+    clock.now = 20
+    publisher.publish()
+
+    first, second = [call[0][0] for call in publish.call_args_list]
+    assert first['rates'] == {'received': 2.0}
+    assert second['rates'] == {'received': 0.5}
+    assert second['counters'] == {'received': 25}
+    assert second['timestamp'] == 20
@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+
+import json
+
+import pytest
+import requests
+from mock import patch
+from requests.adapters import HTTPAdapter
+
+from octoprint_mqtt_controls.util.wsgi import (
+    WSGIAdapter, is_served_by_tornado
+)
+
+BASE_URL = 'http://octoprint.local:5000'
+
+
+def echo_app(environ, start_response):
+    body = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+    response = json.dumps({
+        'method': environ['REQUEST_METHOD'],
+        'path': environ['PATH_INFO'],
+        'query': environ['QUERY_STRING'],
+        'api_key': environ.get('HTTP_X_API_KEY'),
+        'body': json.loads(body) if body else None,
+    }).encode('utf-8')
+    start_response('201 CREATED', [
+        ('Content-Type', 'application/json'),
+        ('Content-Length', str(len(response))),
+    ])
+    return [response[:10], response[10:]]
+
+
+def _session(app):
+    session = requests.Session()
+    session.headers['X-Api-Key'] = 'secret'
+    session.mount(BASE_URL, WSGIAdapter(app))
+    return session
+
+
+def test_request_is_dispatched_to_wsgi_app():
+    response = _session(echo_app).post(
+        BASE_URL + '/api/job?force=1', json={'command': 'start'})
+
+    assert response.status_code == 201
+    assert response.headers['content-type'] == 'application/json'
+    assert response.json() == {
+        'method': 'POST',
+        'path': '/api/job',
+        'query': 'force=1',
+        'api_key': 'secret',
+        'body': {'command': 'start'},
+    }
+
+
+def test_response_can_be_streamed():
+    response = _session(echo_app).get(BASE_URL + '/api/files', stream=True)
+
+    chunks = list(response.iter_content(7))
+
+    assert all(len(chunk) <= 7 for chunk in chunks)
+    assert json.loads(b''.join(chunks).decode('utf-8'))['path'] == \
+        '/api/files'
+
+
+def test_tornado_routes_are_recognized():
+    assert is_served_by_tornado('POST', '/api/files/local')
+    assert is_served_by_tornado('GET', '/api/logs/octoprint.log')
+    assert not is_served_by_tornado('GET', '/api/files/local')
+    assert not is_served_by_tornado('POST', '/api/files/local/model.gcode')
+
+
+def test_tornado_routes_are_sent_over_http():
+    with patch.object(
+        HTTPAdapter, 'send', side_effect=requests.ConnectionError()
+    ) as send:
+        with pytest.raises(requests.ConnectionError):
+            _session(echo_app).post(BASE_URL + '/api/files/local')
+
+    send.assert_called_once()